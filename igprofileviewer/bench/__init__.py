@@ -0,0 +1,3 @@
+# Offline benchmark suite for the profile viewer.
+#
+# Run with `python -m igprofileviewer.bench.run --help`.
@@ -0,0 +1,333 @@
+# fake_servers.py
+
+import asyncio
+import json
+import random
+import socket
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+from igprofileviewer.bench.payloads import profile_payload
+
+# Columns PostgREST would resolve an upsert conflict on for each table when
+# the client does not pass `on_conflict` explicitly. post_media falls back
+# to its primary key, as in Supabase, so upserts without on_conflict
+# duplicate rows there too.
+CONFLICT_KEYS = {
+    'profiles': ('username',),
+    'posts': ('shortcode',),
+    'profile_relationships': ('profile_id', 'related_profile_id', 'relationship_type'),
+}
+
+# 1x1 JPEG header; the remainder of each fake image is padding.
+_JPEG_HEADER = bytes.fromhex('ffd8ffe000104a46494600010100000100010000')
+
+
+def bind_local_socket() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    return sock
+
+
+class _Latency:
+    """Fixed delay plus uniform jitter, in milliseconds.
+
+    A `stall_rate` fraction of requests waits an extra `stall_ms`, to model
+    the long tail of a degraded upstream.
+    """
+
+    def __init__(self, base_ms: float = 0.0, jitter_ms: float = 0.0, stall_rate: float = 0.0,
+                 stall_ms: float = 0.0):
+        self.base_ms = base_ms
+        self.jitter_ms = jitter_ms
+        self.stall_rate = stall_rate
+        self.stall_ms = stall_ms
+
+    async def wait(self) -> None:
+        delay = self.base_ms + (random.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0)
+        if self.stall_rate and random.random() < self.stall_rate:
+            delay += self.stall_ms
+        if delay > 0:
+            await asyncio.sleep(delay / 1000.0)
+
+
+class PostgRESTSink:
+    """Minimal in-memory PostgREST: enough of the filter/upsert grammar for postgrest-py."""
+
+    def __init__(self, stats: Counter):
+        self.stats = stats
+        self.tables: Dict[str, List[Dict[str, Any]]] = {}
+        self.next_ids: Dict[str, int] = {}
+
+    # -- filter parsing -------------------------------------------------
+
+    @staticmethod
+    def _coerce(sample: Any, value: str) -> Any:
+        if value == 'null':
+            return None
+        if isinstance(sample, bool):
+            return value == 'true'
+        if isinstance(sample, (int, float)):
+            try:
+                return type(sample)(value)
+            except ValueError:
+                return value
+        return value
+
+    def _matches(self, row: Dict[str, Any], column: str, expr: str) -> bool:
+        op, _, raw = expr.partition('.')
+        actual = row.get(column)
+        if op == 'in':
+            values = [v.strip().strip('"') for v in raw.strip('()').split(',') if v]
+            return actual in {self._coerce(actual, v) for v in values}
+        if op == 'is':
+            return actual is None if raw == 'null' else actual == (raw == 'true')
+        expected = self._coerce(actual, raw)
+        if op == 'eq':
+            return actual == expected
+        if op == 'neq':
+            return actual != expected
+        if actual is None or expected is None:
+            return False
+        if op == 'gt':
+            return actual > expected
+        if op == 'gte':
+            return actual >= expected
+        if op == 'lt':
+            return actual < expected
+        if op == 'lte':
+            return actual <= expected
+        return False
+
+    def _filtered(self, table: str, query) -> List[Dict[str, Any]]:
+        filters = [(k, v) for k, v in query.items()
+                   if k not in ('select', 'order', 'limit', 'offset', 'on_conflict', 'columns')]
+        return [row for row in self.tables.get(table, [])
+                if all(self._matches(row, k, v) for k, v in filters)]
+
+    @staticmethod
+    def _project(rows: List[Dict[str, Any]], select: Optional[str]) -> List[Dict[str, Any]]:
+        if not select or select == '*':
+            return rows
+        columns = [c.strip() for c in select.split(',')]
+        return [{c: row.get(c) for c in columns} for row in rows]
+
+    # -- handlers -------------------------------------------------------
+
+    async def handle(self, request: web.Request) -> web.Response:
+        table = request.match_info['table']
+        self.stats[f"postgrest {request.method} {table}"] += 1
+        prefer = request.headers.get('Prefer', '')
+
+        if request.method == 'GET':
+            rows = self._filtered(table, request.query)
+            for part in reversed(request.query.get('order', '').split(',')):
+                if part:
+                    column, _, direction = part.partition('.')
+                    rows = sorted(rows, key=lambda r: (r.get(column) is None, r.get(column)),
+                                  reverse=direction.startswith('desc'))
+            total = len(rows)
+            offset = int(request.query.get('offset', 0))
+            limit = request.query.get('limit')
+            rows = rows[offset:offset + int(limit)] if limit else rows[offset:]
+            headers = {}
+            if 'count=' in prefer:
+                headers['Content-Range'] = f"{offset}-{offset + max(len(rows) - 1, 0)}/{total}"
+            return web.json_response(self._project(rows, request.query.get('select')), headers=headers)
+
+        if request.method == 'POST':
+            body = await request.json()
+            records = body if isinstance(body, list) else [body]
+            conflict = request.query.get('on_conflict')
+            keys = tuple(conflict.split(',')) if conflict else CONFLICT_KEYS.get(table, ('id',))
+            upsert = 'resolution=merge-duplicates' in prefer
+            ignore = 'resolution=ignore-duplicates' in prefer
+            written = [self._write(table, record, keys, upsert, ignore) for record in records]
+            written = [row for row in written if row is not None]
+            if 'return=representation' in prefer:
+                return web.json_response(written, status=201)
+            return web.Response(status=201)
+
+        if request.method == 'PATCH':
+            changes = await request.json()
+            rows = self._filtered(table, request.query)
+            for row in rows:
+                row.update(changes)
+            return web.json_response(rows if 'return=representation' in prefer else [])
+
+        if request.method == 'DELETE':
+            rows = self._filtered(table, request.query)
+            self.tables[table] = [row for row in self.tables.get(table, []) if row not in rows]
+            return web.json_response(rows if 'return=representation' in prefer else [])
+
+        return web.json_response({'message': 'method not allowed'}, status=405)
+
+    def _write(self, table: str, record: Dict[str, Any], keys, upsert: bool,
+               ignore: bool = False) -> Optional[Dict[str, Any]]:
+        rows = self.tables.setdefault(table, [])
+        if upsert or ignore:
+            for row in rows:
+                if all(row.get(k) == record.get(k) for k in keys):
+                    if ignore:
+                        return None
+                    row.update(record)
+                    return row
+        row = dict(record)
+        if 'id' not in row:
+            self.next_ids[table] = self.next_ids.get(table, 0) + 1
+            row['id'] = self.next_ids[table]
+        rows.append(row)
+        return row
+
+
+class FakeServers:
+    """Local stand-ins for ScrapeCreators, Instagram oEmbed, the CDN and PostgREST.
+
+    All three run on one background event loop, each on its own ephemeral
+    port. Every request is tallied in `stats` so callers can report how many
+    upstream round-trips a scenario cost.
+    """
+
+    def __init__(self, api_latency_ms: float = 50.0, api_jitter_ms: float = 0.0,
+                 cdn_latency_ms: float = 20.0, cdn_jitter_ms: float = 0.0,
+                 db_latency_ms: float = 5.0, image_bytes: int = 50_000,
+                 posts: int = 12, related: int = 10, pool_size: int = 1000,
+                 following: int = 0, following_page_size: int = 50,
+                 stall_rate: float = 0.0, stall_ms: float = 0.0, api_error_rate: float = 0.0):
+        self.api_latency = _Latency(api_latency_ms, api_jitter_ms, stall_rate, stall_ms)
+        self.cdn_latency = _Latency(cdn_latency_ms, cdn_jitter_ms, stall_rate, stall_ms)
+        # Fraction of ScrapeCreators requests answered with a 503.
+        self.api_error_rate = api_error_rate
+        self.db_latency = _Latency(db_latency_ms)
+        self.image_body = _JPEG_HEADER + b'\0' * max(image_bytes - len(_JPEG_HEADER), 0)
+        self.posts = posts
+        self.related = related
+        self.pool_size = pool_size
+        self.following = following
+        self.following_page_size = following_page_size
+
+        self.stats: Counter = Counter()
+        self.postgrest = PostgRESTSink(self.stats)
+        self.scrapecreators_url = None
+        self.oembed_url = None
+        self.cdn_url = None
+        self.postgrest_url = None
+
+        self._loop = None
+        self._thread = None
+        self._runners = []
+
+    # -- route handlers -------------------------------------------------
+
+    async def _profile(self, request: web.Request) -> web.Response:
+        self.stats['scrapecreators profile'] += 1
+        await self.api_latency.wait()
+        if self.api_error_rate and random.random() < self.api_error_rate:
+            return web.json_response({'error': 'service unavailable'}, status=503)
+        username = request.query.get('handle')
+        if not username:
+            return web.json_response({'error': 'handle is required'}, status=400)
+        payload = profile_payload(username, self.cdn_url, posts=self.posts,
+                                  related=self.related, pool_size=self.pool_size)
+        return web.Response(text=json.dumps(payload), content_type='application/json')
+
+    async def _following(self, request: web.Request) -> web.Response:
+        self.stats['scrapecreators following'] += 1
+        await self.api_latency.wait()
+        username = request.query.get('handle')
+        if not username:
+            return web.json_response({'error': 'handle is required'}, status=400)
+        # Deterministic per user: `following` handles drawn from the pool,
+        # served `following_page_size` at a time with an offset cursor.
+        rng = random.Random(f"following:{username}")
+        count = min(self.following, self.pool_size)
+        handles = [f"user{n}" for n in rng.sample(range(self.pool_size), count)]
+        start = int(request.query.get('cursor') or 0)
+        end = start + self.following_page_size
+        return web.json_response({
+            'users': [{'username': handle, 'full_name': handle.title()} for handle in handles[start:end]],
+            'next_max_id': str(end) if end < len(handles) else None,
+        })
+
+    async def _oembed(self, request: web.Request) -> web.Response:
+        self.stats['instagram oembed'] += 1
+        await self.api_latency.wait()
+        shortcode = request.query.get('url', '').rstrip('/').rsplit('/', 1)[-1]
+        # Shortcodes starting with "missing" stand in for deleted posts.
+        if not shortcode or shortcode.startswith('missing'):
+            return web.json_response({'error': 'No Media Match'}, status=404)
+        html = (f'<blockquote class="instagram-media" data-instgrm-permalink='
+                f'"https://www.instagram.com/p/{shortcode}/">{shortcode}</blockquote>')
+        return web.json_response({'version': '1.0', 'type': 'rich', 'html': html})
+
+    async def _image(self, request: web.Request) -> web.Response:
+        self.stats['cdn image'] += 1
+        await self.cdn_latency.wait()
+        return web.Response(body=self.image_body, content_type='image/jpeg')
+
+    async def _rest(self, request: web.Request) -> web.Response:
+        await self.db_latency.wait()
+        return await self.postgrest.handle(request)
+
+    # -- lifecycle ------------------------------------------------------
+
+    async def _serve(self, app: web.Application) -> str:
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        sock = bind_local_socket()
+        await web.SockSite(runner, sock).start()
+        self._runners.append(runner)
+        host, port = sock.getsockname()
+        return f"http://{host}:{port}"
+
+    async def _start(self) -> None:
+        api = web.Application()
+        api.router.add_get('/v1/instagram/profile', self._profile)
+        api.router.add_get('/v1/instagram/user/following', self._following)
+        api.router.add_get('/oembed/', self._oembed)
+        base_url = await self._serve(api)
+        self.scrapecreators_url = base_url + '/v1/instagram'
+        self.oembed_url = base_url + '/oembed/'
+
+        cdn = web.Application()
+        cdn.router.add_get('/img/{name}', self._image)
+        self.cdn_url = await self._serve(cdn)
+
+        rest = web.Application(client_max_size=64 * 1024 ** 2)
+        rest.router.add_route('*', '/rest/v1/{table}', self._rest)
+        self.postgrest_url = await self._serve(rest)
+
+    def start(self) -> 'FakeServers':
+        """Start the servers on a daemon thread and block until they are listening."""
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start())
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name='fake-servers', daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self) -> None:
+        if not self._loop:
+            return
+        for runner in self._runners:
+            asyncio.run_coroutine_threadsafe(runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+
+    def image_url(self, name: str) -> str:
+        return f"{self.cdn_url}/img/{name}.jpg"
+
+    def snapshot(self) -> Counter:
+        return Counter(self.stats)
@@ -0,0 +1,99 @@
+# payloads.py
+
+import hashlib
+import random
+from typing import Any, Dict, List
+
+
+def _rng(username: str) -> random.Random:
+    """Deterministic RNG so the same handle always yields the same payload."""
+    seed = int(hashlib.sha1(username.encode('utf-8')).hexdigest()[:12], 16)
+    return random.Random(seed)
+
+
+def related_usernames(username: str, count: int, pool_size: int) -> List[str]:
+    """Pick related handles from a fixed pool so the crawl graph has overlaps."""
+    rng = _rng(username)
+    related = []
+    while len(related) < min(count, pool_size - 1):
+        candidate = f"user{rng.randrange(pool_size)}"
+        if candidate != username and candidate not in related:
+            related.append(candidate)
+    return related
+
+
+def _image_url(cdn_url: str, name: str) -> str:
+    return f"{cdn_url}/img/{name}.jpg"
+
+
+def _post_node(username: str, index: int, rng: random.Random, cdn_url: str, carousel_size: int) -> Dict[str, Any]:
+    shortcode = f"{username}p{index}"
+    is_sidecar = index % 3 == 0
+    node = {
+        '__typename': 'GraphSidecar' if is_sidecar else 'GraphImage',
+        'id': str(rng.randrange(10 ** 15)),
+        'shortcode': shortcode,
+        'display_url': _image_url(cdn_url, shortcode),
+        'thumbnail_src': _image_url(cdn_url, f"{shortcode}_thumb"),
+        'accessibility_caption': f"Photo by {username}",
+        'is_video': False,
+        'taken_at_timestamp': 1700000000 + index * 3600,
+        'location': None,
+        'edge_media_to_caption': {
+            'edges': [{'node': {'text': f"Synthetic caption {index} for {username} " + 'lorem ipsum ' * rng.randrange(1, 20)}}]
+        },
+        'edge_liked_by': {'count': rng.randrange(100000)},
+        'edge_media_to_comment': {'count': rng.randrange(1000)},
+    }
+    if is_sidecar:
+        node['edge_sidecar_to_children'] = {
+            'edges': [
+                {'node': {
+                    '__typename': 'GraphImage',
+                    'display_url': _image_url(cdn_url, f"{shortcode}_{child}"),
+                    'accessibility_caption': f"Carousel image {child}",
+                    'is_video': False,
+                }}
+                for child in range(carousel_size)
+            ]
+        }
+    return node
+
+
+def profile_payload(username: str, cdn_url: str, posts: int = 12, related: int = 10,
+                    pool_size: int = 1000, carousel_size: int = 3) -> Dict[str, Any]:
+    """Build a ScrapeCreators-shaped GraphQL profile response for `username`."""
+    rng = _rng(username)
+    return {
+        'data': {
+            'user': {
+                'id': str(rng.randrange(10 ** 12)),
+                'username': username,
+                'full_name': f"Synthetic {username.title()}",
+                'biography': f"Benchmark profile for {username}",
+                'is_verified': rng.random() < 0.1,
+                'is_private': False,
+                'external_url': f"https://example.com/{username}",
+                'profile_pic_url': _image_url(cdn_url, f"{username}_pic"),
+                'profile_pic_url_hd': _image_url(cdn_url, f"{username}_pic_hd"),
+                'edge_followed_by': {'count': rng.randrange(10 ** 7)},
+                'edge_follow': {'count': rng.randrange(5000)},
+                'edge_owner_to_timeline_media': {
+                    'count': posts,
+                    'edges': [{'node': _post_node(username, i, rng, cdn_url, carousel_size)} for i in range(posts)],
+                },
+                'edge_related_profiles': {
+                    'edges': [
+                        {'node': {
+                            'username': name,
+                            'full_name': f"Synthetic {name.title()}",
+                            'profile_pic_url': _image_url(cdn_url, f"{name}_pic"),
+                            'is_verified': False,
+                        }}
+                        for name in related_usernames(username, related, pool_size)
+                    ]
+                },
+            }
+        },
+        'status': 'ok',
+    }
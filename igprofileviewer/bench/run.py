@@ -0,0 +1,317 @@
+# run.py
+"""Offline benchmark for the profile viewer hot paths.
+
+Starts local stand-ins for ScrapeCreators, Instagram oEmbed, the CDN and PostgREST,
+points the app at them through its environment variables and drives
+`/profile/<username>`, `/image-proxy`, `/embed/<shortcode>` and
+`InstagramProcessor.process_profiles` at a configurable concurrency.
+
+    python -m igprofileviewer.bench.run --concurrency 16 --requests 200
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+import aiohttp
+
+from igprofileviewer.bench.fake_servers import FakeServers, bind_local_socket
+from igprofileviewer.web.log import configure_logging, get_logger
+
+logger = get_logger(__name__)
+
+SCENARIOS = ('profile', 'image', 'embed', 'crawl')
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile; `samples` need not be sorted."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(int(round(pct / 100.0 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class Result:
+    def __init__(self, name: str, latencies: List[float], elapsed: float,
+                 round_trips: Counter, errors: int = 0, unit: str = 'req'):
+        self.name = name
+        self.latencies = latencies
+        self.elapsed = elapsed
+        self.round_trips = round_trips
+        self.errors = errors
+        self.unit = unit
+
+    def report(self) -> str:
+        count = len(self.latencies)
+        lines = [
+            f"== {self.name} ==",
+            f"  {self.unit}s: {count} ({self.errors} errors) in {self.elapsed:.2f}s"
+            f" -> {count / self.elapsed if self.elapsed else 0:.1f} {self.unit}/s",
+            "  latency ms: p50={:.1f} p95={:.1f} p99={:.1f} max={:.1f}".format(
+                percentile(self.latencies, 50) * 1000,
+                percentile(self.latencies, 95) * 1000,
+                percentile(self.latencies, 99) * 1000,
+                max(self.latencies, default=0.0) * 1000,
+            ),
+            "  round-trips:",
+        ]
+        for key, value in sorted(self.round_trips.items()):
+            per_unit = value / count if count else 0
+            lines.append(f"    {key:<40} {value:>8}  ({per_unit:.2f}/{self.unit})")
+        return "\n".join(lines)
+
+
+def _configure_environment(servers: FakeServers) -> None:
+    """Point the app at the fake servers. Must run before the app is imported."""
+    os.environ['SCRAPECREATORS_BASE_URL'] = servers.scrapecreators_url
+    os.environ['INSTAGRAM_OEMBED_URL'] = servers.oembed_url
+    os.environ['INSTAGRAM_API_KEY'] = 'bench-api-key'
+    os.environ['SUPABASE_URL'] = servers.postgrest_url
+    # supabase-py only checks that the key looks like a JWT.
+    os.environ['SUPABASE_KEY'] = 'bench.bench.bench'
+    # Fresh caches, so a run never starts warm from an earlier one.
+    run_dir = tempfile.mkdtemp(prefix='igpv-bench-')
+    os.environ['IMAGE_CACHE_DIR'] = os.path.join(run_dir, 'images')
+    os.environ['OEMBED_CACHE_DIR'] = os.path.join(run_dir, 'oembed')
+
+
+def _serve_app(mode: str = 'wsgi'):
+    """Serve the app on an ephemeral port and return (url, stop callable).
+
+    `wsgi` runs the Flask app on a threaded Werkzeug server; `asgi` runs
+    igprofileviewer.web.asgi under uvicorn.
+    """
+    if mode == 'asgi':
+        import uvicorn
+        from igprofileviewer.web.asgi import app
+
+        sock = bind_local_socket()
+        server = uvicorn.Server(uvicorn.Config(app, log_level='warning', lifespan='on'))
+        thread = threading.Thread(target=server.run, kwargs={'sockets': [sock]}, name='bench-app', daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.01)
+
+        def stop():
+            server.should_exit = True
+            thread.join()
+
+        return f"http://127.0.0.1:{sock.getsockname()[1]}", stop
+
+    from werkzeug.serving import make_server
+    from igprofileviewer.web.app import app
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-app', daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server.shutdown
+
+
+async def _drive(urls: List[str], concurrency: int):
+    """GET every url with at most `concurrency` requests in flight."""
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def fetch(url):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    async with session.get(url, allow_redirects=False) as response:
+                        await response.read()
+                        if response.status != 200:
+                            errors += 1
+                except aiohttp.ClientError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(fetch(url) for url in urls))
+        return latencies, time.perf_counter() - started, errors
+
+
+def _http_scenario(name: str, servers: FakeServers, urls: List[str], concurrency: int) -> Result:
+    from igprofileviewer.web import background
+
+    before = servers.snapshot()
+    latencies, elapsed, errors = asyncio.run(_drive(urls, concurrency))
+    # Count the prewarms, prefetches and writes the requests started under this scenario.
+    if not background.wait_idle(timeout=120):
+        logger.warning("Background work of %s still running; its round-trips may be counted later", name)
+    return Result(name, latencies, elapsed, servers.snapshot() - before, errors)
+
+
+def bench_profile(servers: FakeServers, app_url: str, args) -> Result:
+    # Cycle through a fixed set of handles so repeat visits are part of the mix.
+    urls = [f"{app_url}/profile/user{i % args.profiles}" for i in range(args.requests)]
+    return _http_scenario('GET /profile/<username>', servers, urls, args.concurrency)
+
+
+def bench_image(servers: FakeServers, app_url: str, args) -> Result:
+    images = [servers.image_url(f"user{i % args.profiles}p{i % args.posts}") for i in range(args.requests)]
+    urls = [f"{app_url}/image-proxy?url={quote(image, safe='')}" for image in images]
+    return _http_scenario('GET /image-proxy', servers, urls, args.concurrency)
+
+
+def bench_embed(servers: FakeServers, app_url: str, args) -> Result:
+    urls = [f"{app_url}/embed/user{i % args.profiles}p{i % args.posts}" for i in range(args.requests)]
+    return _http_scenario('GET /embed/<shortcode>', servers, urls, args.concurrency)
+
+
+def _timed_processor(latencies: List[float], args):
+    from igprofileviewer.web.db.instagram_processor import InstagramProcessor
+    from igprofileviewer.web.db.known_usernames import KnownUsernames
+
+    class TimedProcessor(InstagramProcessor):
+        async def process_profile(self, session, username):
+            started = time.perf_counter()
+            try:
+                return await super().process_profile(session, username)
+            finally:
+                latencies.append(time.perf_counter() - started)
+
+    # An in-memory index, so runs do not see each other's usernames.
+    return TimedProcessor(batch_size=args.concurrency, target_count=args.crawl_target, expand=args.expand,
+                          known=KnownUsernames())
+
+
+def _crawl_worker(lease_path: str, worker_id: str, args, results) -> None:
+    from igprofileviewer.web.db.sharding import SQLiteLeaseStore
+
+    latencies = []
+    processor = _timed_processor(latencies, args)
+    leases = SQLiteLeaseStore(lease_path, num_shards=args.shards)
+    asyncio.run(processor.process_profiles_sharded(
+        os.environ['INSTAGRAM_API_KEY'], leases, worker_id=worker_id,
+        start_username=f"crawl{args.seed}", lease_seconds=10, idle_seconds=0.1))
+    results.put(latencies)
+
+
+def bench_sharded_crawl(servers: FakeServers, args) -> Result:
+    """`--workers` processes crawling one frontier through a SQLite lease store."""
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    with tempfile.TemporaryDirectory() as directory:
+        lease_path = os.path.join(directory, 'leases.db')
+        before = servers.snapshot()
+        started = time.perf_counter()
+        workers = [context.Process(target=_crawl_worker, args=(lease_path, f"worker{i}", args, results))
+                   for i in range(args.workers)]
+        for worker in workers:
+            worker.start()
+        latencies = [latency for _ in workers for latency in results.get()]
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+    return Result(f"InstagramProcessor.process_profiles_sharded x{args.workers}", latencies, elapsed,
+                  servers.snapshot() - before, unit='profile')
+
+
+def bench_crawl(servers: FakeServers, app_url: Optional[str], args) -> Result:
+    if args.workers:
+        return bench_sharded_crawl(servers, args)
+
+    latencies = []
+    processor = _timed_processor(latencies, args)
+    before = servers.snapshot()
+    started = time.perf_counter()
+    asyncio.run(processor.process_profiles(os.environ['INSTAGRAM_API_KEY'], f"crawl{args.seed}"))
+    elapsed = time.perf_counter() - started
+    errors = max(len(latencies) - processor.queue.processed_count, 0)
+    return Result('InstagramProcessor.process_profiles', latencies, elapsed,
+                  servers.snapshot() - before, errors, unit='profile')
+
+
+RUNNERS = {'profile': bench_profile, 'image': bench_image, 'embed': bench_embed, 'crawl': bench_crawl}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument('--mode', choices=('wsgi', 'asgi'), default='wsgi',
+                        help='serve the app with Werkzeug threads (wsgi) or uvicorn (asgi)')
+    parser.add_argument('--concurrency', type=int, default=8, help='requests (or crawl batch size) in flight')
+    parser.add_argument('--requests', type=int, default=200, help='requests per HTTP scenario')
+    parser.add_argument('--profiles', type=int, default=20, help='distinct handles cycled by the profile scenario')
+    parser.add_argument('--crawl-target', type=int, default=50, help='profiles the crawl scenario processes')
+    parser.add_argument('--seed', type=int, default=0, help='suffix for the crawl start handle')
+    parser.add_argument('--api-latency-ms', type=float, default=50.0)
+    parser.add_argument('--api-jitter-ms', type=float, default=0.0)
+    parser.add_argument('--cdn-latency-ms', type=float, default=20.0)
+    parser.add_argument('--cdn-jitter-ms', type=float, default=0.0)
+    parser.add_argument('--db-latency-ms', type=float, default=5.0)
+    parser.add_argument('--stall-rate', type=float, default=0.0,
+                        help='fraction of API and CDN responses delayed by --stall-ms')
+    parser.add_argument('--stall-ms', type=float, default=2000.0)
+    parser.add_argument('--api-error-rate', type=float, default=0.0,
+                        help='fraction of profile requests answered with a 503')
+    parser.add_argument('--image-bytes', type=int, default=50_000)
+    parser.add_argument('--posts', type=int, default=12, help='posts per synthetic profile')
+    parser.add_argument('--related', type=int, default=10, help='related profiles per synthetic profile')
+    parser.add_argument('--pool-size', type=int, default=1000, help='size of the synthetic handle universe')
+    parser.add_argument('--expand', choices=('related', 'following', 'both'), default='related',
+                        help='how the crawl scenario grows its frontier')
+    parser.add_argument('--following', type=int, default=200, help='accounts each synthetic user follows')
+    parser.add_argument('--following-page-size', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=0,
+                        help='run the crawl scenario as this many sharded worker processes')
+    parser.add_argument('--shards', type=int, default=64, help='shard count for --workers')
+    parser.add_argument('--storage', choices=('supabase', 'sqlite'), default='supabase',
+                        help='write crawled data to the fake PostgREST or a local SQLite file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> Dict[str, Result]:
+    args = parse_args(argv)
+    configure_logging()
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    servers = FakeServers(
+        api_latency_ms=args.api_latency_ms, api_jitter_ms=args.api_jitter_ms,
+        cdn_latency_ms=args.cdn_latency_ms, cdn_jitter_ms=args.cdn_jitter_ms,
+        db_latency_ms=args.db_latency_ms, image_bytes=args.image_bytes,
+        posts=args.posts, related=args.related, pool_size=args.pool_size,
+        following=args.following, following_page_size=args.following_page_size,
+        stall_rate=args.stall_rate, stall_ms=args.stall_ms, api_error_rate=args.api_error_rate,
+    ).start()
+    _configure_environment(servers)
+    if args.storage == 'sqlite':
+        os.environ['STORAGE_BACKEND'] = 'sqlite'
+        os.environ['STORAGE_SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='igpv-bench-'), 'bench.sqlite3')
+
+    app_url, stop_app = (None, None)
+    if {'profile', 'image', 'embed'} & set(scenarios):
+        app_url, stop_app = _serve_app(args.mode)
+
+    results = {}
+    try:
+        for name in scenarios:
+            results[name] = RUNNERS[name](servers, app_url, args)
+    finally:
+        if stop_app:
+            stop_app()
+        servers.stop()
+
+    print()
+    for result in results.values():
+        print(result.report())
+        print()
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -1,34 +1,56 @@
 # app.py
 
 import os
-from flask import Flask, render_template, request, flash, redirect, url_for, send_file, Response
+from flask import Flask, render_template, request, flash, redirect, url_for, send_file, Response, make_response, session, jsonify
 from dotenv import load_dotenv
 from igprofileviewer.web.instagram_api import InstagramAPI
 from igprofileviewer.web.db.instagram_processor import InstagramProcessor
-from igprofileviewer.web.db.supabase import init_supabase
+from igprofileviewer.web.db.storage import get_storage
+from igprofileviewer.web.db.graph_index import graph_index
 from igprofileviewer.web.db.processors import process_profile_data, process_posts
+from igprofileviewer.web import background, metrics, profiling
+from igprofileviewer.web.image_cache import download_image, image_cache, prewarm, profile_image_urls
+from igprofileviewer.web.log import configure_logging, get_logger
+from igprofileviewer.web.oembed_cache import (
+    SHORTCODE_RE, PostNotFound, get_embed_html, prefetch as prefetch_oembed, profile_shortcodes,
+)
+from igprofileviewer.web.page_cache import page_cache, profile_digest
+from igprofileviewer.web.resilience import CircuitOpen, DeadlineExceeded, is_upstream_failure
+from igprofileviewer.web.metrics import IMAGE_PROXY_BYTES, IMAGE_PROXY_LATENCY, RENDER_TIME
 import json
 import requests
 from io import BytesIO
 import asyncio
+import time
 
 # Load environment variables
 load_dotenv()
+configure_logging()
 
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "dev-secret-key")
+profiling.init_app(app)
 
-# Initialize Supabase client
+# Warm the image cache in the background whenever a profile is fetched.
+IMAGE_PREWARM = os.getenv("IMAGE_PREWARM", "1") == "1"
+IMAGE_PREWARM_CONCURRENCY = int(os.getenv("IMAGE_PREWARM_CONCURRENCY", "8"))
+# The page lazy-loads carousel slides after the first; raise this to warm them too.
+IMAGE_PREWARM_CAROUSEL_FRAMES = int(os.getenv("IMAGE_PREWARM_CAROUSEL_FRAMES", "1"))
+# Optionally fetch the oEmbed HTML of a viewed profile's posts, ahead of /embed
+# clicks. Off by default: it costs an API call per post on every view. The crawler
+# prefetches the profiles it crawls (--prefetch-embeds).
+OEMBED_PREFETCH = os.getenv("OEMBED_PREFETCH", "0") == "1"
+OEMBED_PREFETCH_CONCURRENCY = int(os.getenv("OEMBED_PREFETCH_CONCURRENCY", "4"))
+
+logger = get_logger(__name__)
+
+# Initialize storage (Supabase unless STORAGE_BACKEND says otherwise)
 try:
-    supabase = init_supabase()
-    print("Supabase initialized successfully")
+    storage = get_storage()
+    logger.info("Storage initialized successfully")
 except Exception as e:
-    print(f"Warning: Supabase initialization failed: {str(e)}")
-    print(f"Error type: {type(e).__name__}")
-    # Print traceback for more detailed debugging
-    import traceback
-    traceback.print_exc()
-    supabase = None
+    logger.warning("Storage initialization failed: %s: %s", type(e).__name__, e, exc_info=True)
+    storage = None
     
     # Create dummy functions if imports fail
     def process_profile_data(profile_data):
@@ -114,19 +136,109 @@ def process_profile_for_display(profile_data):
             'profile_pic_url': related_node.get('profile_pic_url'),
             'is_verified': related_node.get('is_verified', False)
         })
+    # The API sometimes omits related profiles; fall back to crawled ones.
+    if not related_users and profile['username']:
+        related_users = [{'username': related, 'full_name': None, 'profile_pic_url': None, 'is_verified': False}
+                         for related in graph_index.related(profile['username'], limit=12)]
     
     profile['posts'] = posts
     profile['related_users'] = related_users
     
-    # Save to database if Supabase is available
-    if supabase:
+    # Save to database if storage is available
+    if storage:
         try:
             process_profile_data(profile_data)
         except Exception as e:
-            print(f"Warning: Failed to save profile data to database: {e}")
+            logger.warning("Failed to save profile data to database: %s", e)
     
     return profile
 
+def render_timed(template_name, **context):
+    """render_template, observed in the render time histogram."""
+    with RENDER_TIME.time(template=template_name):
+        return render_template(template_name, **context)
+
+def render_profile_page(processed_profile):
+    """Render profile.html through the page cache, answering If-None-Match with 304."""
+    username = processed_profile['username'] or ''
+    digest = profile_digest(processed_profile)
+
+    # Pending flash messages are rendered into the page, so it cannot be shared.
+    if session.get('_flashes'):
+        return render_timed('profile.html', profile=processed_profile)
+
+    if digest in request.if_none_match:
+        response = Response(status=304)
+    else:
+        page = page_cache.get(username, digest)
+        if page is None:
+            page = render_timed('profile.html', profile=processed_profile).encode('utf-8')
+            page_cache.put(username, digest, page)
+        response = make_response(page)
+
+    response.set_etag(digest)
+    # Browsers may keep the page but must revalidate it on every visit.
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def stored_profile_data(username):
+    """The last crawled payload for `username`, shaped like an API response, or None.
+
+    Served instead of a live profile while the API is failing.
+    """
+    if storage is None:
+        return None
+    try:
+        rows = storage.select_in('profiles', 'username', [username.lower()], ('profile_data',))
+    except Exception as e:
+        logger.warning("Could not load stored profile %s: %s", username, e)
+        return None
+    if not rows or not rows[0].get('profile_data'):
+        return None
+    return {'data': {'user': rows[0]['profile_data']}}
+
+def render_stored_profile(profile_data, error):
+    """Render a stored_profile_data() payload, noting that the API could not deliver a fresh one."""
+    processed_profile = process_profile_for_display(profile_data)
+    logger.info("Serving stored profile %s: %s", processed_profile['username'], error)
+    flash('Instagram is not responding right now; showing the last saved copy of this profile.', 'warning')
+    return render_profile_page(processed_profile)
+
+_processor = None
+
+async def persist_profile(username, profile_data):
+    """Store a fetched profile unless it is already in the database.
+
+    Runs on the background loop, since the storage clients block.
+    """
+    global _processor
+    if _processor is None:
+        # One username is cheaper to look up remotely than loading the known-usernames index.
+        _processor = InstagramProcessor(batch_size=1, target_count=1, known=None, storage=storage)
+    if not storage.existing_usernames([username]):
+        await _processor.store_profile(profile_data, username)
+
+def prewarm_profile_images(profile_data, session=None):
+    """Start downloading a profile's images into the image cache, without waiting."""
+    if not IMAGE_PREWARM:
+        return None
+    urls = profile_image_urls(profile_data, carousel_frames=IMAGE_PREWARM_CAROUSEL_FRAMES)
+    coro = prewarm(urls, session=session, concurrency=IMAGE_PREWARM_CONCURRENCY)
+    if session is not None:
+        # Called from a serving loop that owns `session`.
+        return asyncio.ensure_future(background.tracked(coro))
+    return background.submit(coro)
+
+def prefetch_profile_embeds(profile_data, session=None):
+    """Start filling the oEmbed cache for a profile's posts, without waiting."""
+    if not OEMBED_PREFETCH:
+        return None
+    coro = prefetch_oembed(profile_shortcodes(profile_data), session=session,
+                           concurrency=OEMBED_PREFETCH_CONCURRENCY)
+    if session is not None:
+        return asyncio.ensure_future(background.tracked(coro))
+    return background.submit(coro)
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     """Home page with search form."""
@@ -148,21 +260,27 @@ def profile(username):
     """Display profile information for a given username."""
     try:
         api = InstagramAPI()
-        profile_data = api.get_profile(username)
+        try:
+            profile_data = api.get_profile(username)
+        except (requests.RequestException, DeadlineExceeded, CircuitOpen) as e:
+            stored = stored_profile_data(username) if is_upstream_failure(e) else None
+            if stored is None:
+                raise
+            return render_stored_profile(stored, e)
+        prewarm_profile_images(profile_data)
+        prefetch_profile_embeds(profile_data)
         
-        # Process profile data synchronously
-        processor = InstagramProcessor(batch_size=1, target_count=1)
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(processor.process_profiles(api.api_key, username))
-        loop.close()
+        # Persisting does not affect the page, so do not make the visitor wait for it.
+        if storage:
+            background.submit(persist_profile(username, profile_data))
         
-        processed_profile = process_profile_for_display(profile_data)
+        with profiling.stage('normalize'):
+            processed_profile = process_profile_for_display(profile_data)
         if not processed_profile:
             flash('No profile data found for this username', 'error')
             return redirect(url_for('index'))
         
-        return render_template('profile.html', profile=processed_profile)
+        return render_profile_page(processed_profile)
         
     except Exception as e:
         flash(f'Error fetching profile: {str(e)}', 'error')
@@ -175,23 +293,26 @@ def image_proxy():
     if not url:
         return "No URL provided", 400
     
+    started = time.perf_counter()
     try:
-        # Use custom headers to bypass restrictions
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
-            'Referer': 'https://www.instagram.com/',
-        }
-        
-        # Make request to get the image
-        response = requests.get(url, headers=headers, stream=True)
-        response.raise_for_status()
+        cached = image_cache.get(url)
+        if cached:
+            content, content_type = cached
+        else:
+            # Fetches (and caches) the image, or waits for a prewarm already fetching it.
+            try:
+                content, content_type = download_image(url)
+            except Exception as e:
+                # The download may have been a prewarm's, so its error can be an aiohttp one.
+                # An expired copy beats a broken image while the CDN is failing.
+                cached = image_cache.get(url, stale=True) if is_upstream_failure(e) else None
+                if cached is None:
+                    raise
+                content, content_type = cached
         
         # Create in-memory file-like object with the image data
-        img_io = BytesIO(response.content)
-        
-        # Determine content type
-        content_type = response.headers.get('Content-Type', 'image/jpeg')
+        img_io = BytesIO(content)
+        IMAGE_PROXY_BYTES.observe(len(content))
         
         # Send image directly to client
         return send_file(
@@ -201,20 +322,46 @@ def image_proxy():
             download_name=url.split('/')[-1]
         )
     
+    except CircuitOpen as e:
+        return f"Error loading image: {str(e)}", 503, {'Retry-After': str(int(e.retry_after) + 1)}
+
     except Exception as e:
         return f"Error loading image: {str(e)}", 500
+    
+    finally:
+        IMAGE_PROXY_LATENCY.observe(time.perf_counter() - started)
 
 @app.route('/embed/<shortcode>')
 def embed_post(shortcode):
     """Get Instagram oEmbed HTML for a post."""
+    if not SHORTCODE_RE.match(shortcode):
+        return "Invalid shortcode", 400
+    
     try:
-        embed_url = f"https://api.instagram.com/oembed/?url=https://www.instagram.com/p/{shortcode}/&omitscript=true"
-        response = requests.get(embed_url)
-        response.raise_for_status()
-        data = response.json()
-        return render_template('embed.html', embed_html=data['html'], shortcode=shortcode)
+        embed_html = get_embed_html(shortcode)
+        return render_timed('embed.html', embed_html=embed_html, shortcode=shortcode)
+    except PostNotFound:
+        return "Post not found", 404
+    except CircuitOpen as e:
+        return f"Error embedding post: {str(e)}", 503, {'Retry-After': str(int(e.retry_after) + 1)}
     except Exception as e:
         return f"Error embedding post: {str(e)}", 500
 
+@app.route('/related/<username>')
+def related_users(username):
+    """Related accounts, 2-hop suggestions and rank from the local graph index."""
+    limit = request.args.get('limit', 10, type=int)
+    return jsonify({
+        'username': username,
+        'related': graph_index.related(username, limit=limit),
+        'suggestions': graph_index.suggestions(username, limit=limit),
+        'rank': graph_index.rank(username),
+    })
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Expose in-process metrics in the Prometheus text format."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,258 @@
+# asgi.py
+"""Async serving mode.
+
+`/profile/<username>`, `/image-proxy` and `/embed/<shortcode>` are served by
+coroutines that share the server's event loop and one aiohttp session, so a
+worker can hold hundreds of I/O-bound requests in flight. Every other route
+falls through to the Flask app via asgiref's WsgiToAsgi.
+
+    uvicorn igprofileviewer.web.asgi:app
+    gunicorn -k uvicorn.workers.UvicornWorker igprofileviewer.web.asgi:app
+
+Routing, templates, flashing, sessions and the before/after-request hooks
+(e.g. profiling) all come from the Flask app, so both modes render
+identical pages.
+"""
+
+import asyncio
+import os
+import time
+from io import BytesIO
+from typing import Optional
+
+import aiohttp
+from asgiref.wsgi import WsgiToAsgi
+from flask import Response, flash, redirect, url_for
+from werkzeug.exceptions import HTTPException
+from werkzeug.wrappers import Request
+
+from igprofileviewer.web import app as flask_module
+from igprofileviewer.web import background, profiling
+from igprofileviewer.web.app import (
+    app as flask_app, persist_profile, prefetch_profile_embeds, prewarm_profile_images,
+    process_profile_for_display, render_profile_page, render_stored_profile, render_timed,
+)
+from igprofileviewer.web.image_cache import fetch_image, image_cache
+from igprofileviewer.web.instagram_api import AsyncInstagramAPI
+from igprofileviewer.web.log import get_logger
+from igprofileviewer.web.metrics import IMAGE_PROXY_BYTES, IMAGE_PROXY_LATENCY
+from igprofileviewer.web.oembed_cache import SHORTCODE_RE, PostNotFound, fetch_embed_html
+from igprofileviewer.web.resilience import CircuitOpen, is_upstream_failure
+
+logger = get_logger(__name__)
+
+# Upper bound on concurrent upstream connections per worker.
+UPSTREAM_CONNECTIONS = int(os.getenv("ASGI_UPSTREAM_CONNECTIONS", "200"))
+
+_wsgi_app = WsgiToAsgi(flask_app)
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def _get_session() -> aiohttp.ClientSession:
+    """The worker-wide aiohttp session, created on first use inside the serving loop."""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=UPSTREAM_CONNECTIONS))
+    return _session
+
+
+def _environ(scope) -> dict:
+    """Build a minimal WSGI environ so Flask request contexts work for async views."""
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("ascii"),
+        "SERVER_PROTOCOL": "HTTP/%s" % scope["http_version"],
+        "SERVER_NAME": scope.get("server", ("localhost", 80))[0],
+        "SERVER_PORT": str(scope.get("server", ("localhost", 80))[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(),
+        "wsgi.errors": BytesIO(),
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for name, value in scope.get("headers", []):
+        key = name.decode("latin1").upper().replace("-", "_")
+        if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = f"HTTP_{key}"
+        value = value.decode("latin1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _respond(environ, build) -> Response:
+    """Turn the return value of `build()` into a response.
+
+    Called from an async view, inside the request context `_dispatch` pushed.
+    """
+    return flask_app.make_response(build())
+
+
+async def _dispatch(environ, view, args) -> Response:
+    """Run an async view with the Flask request hooks around it.
+
+    Flask request contexts live in contextvars, so the context pushed here
+    stays with this task across awaits and cannot leak into other requests.
+    """
+    ctx = flask_app.request_context(environ)
+    ctx.push()
+    error = None
+    try:
+        response = flask_app.preprocess_request()
+        if response is None:
+            response = await view(environ, **args)
+        return flask_app.process_response(flask_app.make_response(response))
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        ctx.pop(error)
+
+
+async def profile(environ, username: str) -> Response:
+    """Async version of app.profile."""
+    try:
+        api = AsyncInstagramAPI(_get_session())
+        try:
+            profile_data = await api.get_profile(username)
+        except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpen) as e:
+            if not is_upstream_failure(e):
+                raise
+            # The storage clients block, so look the stored copy up off the loop.
+            stored = await asyncio.to_thread(flask_module.stored_profile_data, username)
+            if stored is None:
+                raise
+            return _respond(environ, lambda err=e: render_stored_profile(stored, err))
+        prewarm_profile_images(profile_data, session=_get_session())
+        prefetch_profile_embeds(profile_data, session=_get_session())
+
+        # Persisting does not affect the page, so do not make the visitor wait for it.
+        if flask_module.storage:
+            background.submit(persist_profile(username, profile_data))
+
+        def build():
+            with profiling.stage('normalize'):
+                processed_profile = process_profile_for_display(profile_data)
+            if not processed_profile:
+                flash('No profile data found for this username', 'error')
+                return redirect(url_for('index'))
+            return render_profile_page(processed_profile)
+
+        return _respond(environ, build)
+
+    except Exception as e:
+        error = e
+
+        def build_error():
+            flash(f'Error fetching profile: {str(error)}', 'error')
+            return redirect(url_for('index'))
+
+        return _respond(environ, build_error)
+
+
+async def image_proxy(environ) -> Response:
+    """Async version of app.image_proxy."""
+    url = Request(environ).args.get('url')
+    if not url:
+        return Response("No URL provided", status=400)
+
+    started = time.perf_counter()
+    try:
+        # Cache reads and writes are disk I/O; keep them off the serving loop.
+        cached = await asyncio.to_thread(image_cache.get, url)
+        if cached:
+            content, content_type = cached
+        else:
+            try:
+                content, content_type = await fetch_image(_get_session(), url)
+            except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpen) as e:
+                cached = await asyncio.to_thread(image_cache.get, url, True) if is_upstream_failure(e) else None
+                if cached is None:
+                    raise
+                content, content_type = cached
+        IMAGE_PROXY_BYTES.observe(len(content))
+
+        proxied = Response(content, mimetype=content_type)
+        proxied.headers['Content-Disposition'] = f'inline; filename="{url.split("/")[-1]}"'
+        return proxied
+
+    except CircuitOpen as e:
+        return Response(f"Error loading image: {str(e)}", status=503,
+                        headers={'Retry-After': str(int(e.retry_after) + 1)})
+
+    except Exception as e:
+        return Response(f"Error loading image: {str(e)}", status=500)
+
+    finally:
+        IMAGE_PROXY_LATENCY.observe(time.perf_counter() - started)
+
+
+async def embed_post(environ, shortcode: str) -> Response:
+    """Async version of app.embed_post."""
+    if not SHORTCODE_RE.match(shortcode):
+        return Response("Invalid shortcode", status=400)
+
+    try:
+        embed_html = await fetch_embed_html(_get_session(), shortcode)
+        return _respond(environ, lambda: render_timed('embed.html', embed_html=embed_html, shortcode=shortcode))
+    except PostNotFound:
+        return Response("Post not found", status=404)
+    except CircuitOpen as e:
+        return Response(f"Error embedding post: {str(e)}", status=503,
+                        headers={'Retry-After': str(int(e.retry_after) + 1)})
+    except Exception as e:
+        return Response(f"Error embedding post: {str(e)}", status=500)
+
+
+# Flask endpoint name -> coroutine serving it in async mode.
+ASYNC_VIEWS = {
+    'profile': profile,
+    'image_proxy': image_proxy,
+    'embed_post': embed_post,
+}
+
+
+async def _send(send, response: Response) -> None:
+    headers = [(k.lower().encode('latin1'), v.encode('latin1')) for k, v in response.headers.to_wsgi_list()]
+    await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': response.get_data()})
+
+
+async def _lifespan(receive, send) -> None:
+    global _session
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            _get_session()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _session is not None:
+                await _session.close()
+                _session = None
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI application."""
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+
+    if scope['type'] == 'http' and scope['method'] == 'GET':
+        environ = _environ(scope)
+        try:
+            endpoint, args = flask_app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            endpoint = None
+        view = ASYNC_VIEWS.get(endpoint)
+        if view is not None:
+            await _send(send, await _dispatch(environ, view, args))
+            return
+
+    await _wsgi_app(scope, receive, send)
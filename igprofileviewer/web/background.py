@@ -0,0 +1,86 @@
+# background.py
+"""A long-lived event loop on a daemon thread.
+
+Work that should not hold up a response (writing a fetched profile to
+Supabase, warming caches) is submitted here instead of spinning up a new
+event loop per request. The Supabase client is synchronous, so coroutines
+run here may block this loop without stalling the serving loop.
+
+Work started on a serving loop instead (see `tracked`) is counted together
+with the work submitted here, so `wait_idle()` can wait for all of it, e.g.
+before a benchmark reads its counters.
+"""
+
+import asyncio
+import concurrent.futures
+import threading
+from typing import Awaitable, Coroutine, Optional, TypeVar
+
+from igprofileviewer.web.log import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar('T')
+
+# Tracked coroutines not yet finished, wherever they run.
+_active = 0
+_idle = threading.Condition()
+
+
+def tracked(coro: Awaitable[T]) -> Coroutine[None, None, T]:
+    """Wrap `coro` so wait_idle() waits for it; counted from this call on."""
+    global _active
+    with _idle:
+        _active += 1
+
+    async def run():
+        global _active
+        try:
+            return await coro
+        finally:
+            with _idle:
+                _active -= 1
+                _idle.notify_all()
+
+    return run()
+
+
+def wait_idle(timeout: Optional[float] = None) -> bool:
+    """Block until no tracked work is left; False if `timeout` passed first."""
+    with _idle:
+        return _idle.wait_for(lambda: _active == 0, timeout)
+
+
+class BackgroundLoop:
+    def __init__(self, name: str = 'igpv-background'):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The loop, started on first use."""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name=self.name, daemon=True).start()
+            return self._loop
+
+    def submit(self, coro: Coroutine) -> concurrent.futures.Future:
+        """Schedule `coro` on the loop; failures are logged, not raised."""
+        future = asyncio.run_coroutine_threadsafe(tracked(coro), self.loop)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    @staticmethod
+    def _log_failure(future: concurrent.futures.Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Background task failed: %s", future.exception())
+
+
+_default = BackgroundLoop()
+
+
+def submit(coro: Coroutine) -> concurrent.futures.Future:
+    """Schedule `coro` on the shared background loop."""
+    return _default.submit(coro)
@@ -0,0 +1,287 @@
+# dump.py
+"""Bulk export and import of the crawled dataset as gzipped NDJSON.
+
+Export writes one `<table>.ndjson.gz` per table (plus `manifest.json`),
+reading each table in keyset-paginated pages so memory stays constant.
+Rows keep their ids (follow edges, which have none, are paged on their
+(follower_username, following_username) key instead), and rows pointing at another table also carry the
+parent's natural key (`profile_username`, `post_shortcode`,
+`related_username`), so a dump can be loaded into a database whose ids
+differ, e.g. a local SQLite crawl synced up to Supabase.
+
+Import streams the files back in table order, resolving those natural
+keys to the destination's ids one batch at a time and writing each batch
+with a single bulk upsert, up to `workers` batches in flight. It can also
+load archived ScrapeCreators profile payloads (.json, or .ndjson[.gz] with
+one payload per line).
+
+    python -m igprofileviewer.web.db.dump export dump/
+    python -m igprofileviewer.web.db.dump import dump/ --batch-size 1000 --workers 8
+    python -m igprofileviewer.web.db.dump import-payloads archive/*.ndjson.gz
+
+The storage backend is the STORAGE_BACKEND one unless --sqlite is given.
+"""
+
+import argparse
+import concurrent.futures
+import gzip
+import json
+import os
+import time
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from igprofileviewer.web.db.processors import process_posts, process_profile_data
+from igprofileviewer.web.db.storage import TABLES, SQLiteStorage, Storage, get_storage
+from igprofileviewer.web.log import configure_logging, get_logger
+
+logger = get_logger(__name__)
+
+# Dependency order: parents before children.
+EXPORT_TABLES = ('profiles', 'posts', 'post_media', 'profile_relationships', 'profile_follows')
+
+# Tables without an id column, paged on their natural key.
+SCAN_KEYS = {'profile_follows': TABLES['profile_follows'][0]}
+
+# table -> [(foreign key, parent table, parent natural key, exported field)]
+PARENT_KEYS = {
+    'posts': [('profile_id', 'profiles', 'username', 'profile_username')],
+    'post_media': [('post_id', 'posts', 'shortcode', 'post_shortcode')],
+    'profile_relationships': [
+        ('profile_id', 'profiles', 'username', 'profile_username'),
+        ('related_profile_id', 'profiles', 'username', 'related_username'),
+    ],
+}
+
+
+def _path(directory: str, table: str) -> str:
+    return os.path.join(directory, f"{table}.ndjson.gz")
+
+
+def _pages(storage: Storage, table: str, page_size: int) -> Iterator[List[Dict[str, Any]]]:
+    keys = SCAN_KEYS.get(table)
+    after = None
+    while True:
+        if keys:
+            rows = storage.scan_keyed(table, keys, after=after, limit=page_size)
+        else:
+            rows = storage.scan(table, after_id=after or 0, limit=page_size)
+        yield rows
+        if len(rows) < page_size:
+            return
+        after = [rows[-1][key] for key in keys] if keys else rows[-1]['id']
+
+
+def _batches(rows: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def read_ndjson(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield one object per line of a (possibly gzipped) NDJSON file."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+# -- export ---------------------------------------------------------------
+
+def export_table(storage: Storage, table: str, directory: str, page_size: int = 1000) -> int:
+    """Write `table` to <directory>/<table>.ndjson.gz; returns the row count."""
+    path = _path(directory, table)
+    tmp = path + '.tmp'
+    count = 0
+    with gzip.open(tmp, 'wt', encoding='utf-8', compresslevel=6) as f:
+        for rows in _pages(storage, table, page_size):
+            for fk, parent, natural_key, field in PARENT_KEYS.get(table, ()):
+                parent_ids = {row[fk] for row in rows if row.get(fk) is not None}
+                keys = {parent_row['id']: parent_row[natural_key]
+                        for parent_row in storage.select_in(parent, 'id', parent_ids, ('id', natural_key))}
+                for row in rows:
+                    row[field] = keys.get(row.get(fk))
+            for row in rows:
+                f.write(json.dumps(row, default=str, separators=(',', ':')) + '\n')
+            count += len(rows)
+    os.replace(tmp, path)
+    logger.info("Exported %d %s rows to %s", count, table, path)
+    return count
+
+
+def export(storage: Storage, directory: str, tables: Sequence[str] = EXPORT_TABLES,
+           page_size: int = 1000, workers: int = 1) -> Dict[str, int]:
+    """Export `tables` (concurrently when workers > 1) and write manifest.json."""
+    os.makedirs(directory, exist_ok=True)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = {table: executor.submit(export_table, storage, table, directory, page_size) for table in tables}
+        counts = {table: future.result() for table, future in futures.items()}
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump({'source': storage.source, 'exported_at': time.time(), 'tables': counts}, f, indent=2)
+    return counts
+
+
+# -- import ---------------------------------------------------------------
+
+def _dedupe(table: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Keep the last row per conflict key; Postgres rejects a batch that hits one row twice."""
+    keys = TABLES[table][0]
+    return list({tuple(row.get(k) for k in keys): row for row in rows}.values())
+
+
+def _resolve(storage: Storage, table: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Swap exported natural keys for destination ids; drop rows whose parent is missing."""
+    resolved = rows
+    for fk, parent, natural_key, field in PARENT_KEYS.get(table, ()):
+        names = {row[field] for row in resolved if row.get(field) is not None}
+        ids = {parent_row[natural_key]: parent_row['id']
+               for parent_row in storage.select_in(parent, natural_key, names, ('id', natural_key))}
+        kept = []
+        for row in resolved:
+            if row.get(field) is None:
+                row[fk] = None
+            elif row[field] in ids:
+                row[fk] = ids[row[field]]
+            else:
+                continue
+            kept.append(row)
+        resolved = kept
+
+    helper_fields = {'id'} | {spec[3] for spec in PARENT_KEYS.get(table, ())}
+    return [{k: v for k, v in row.items() if k not in helper_fields} for row in resolved]
+
+
+def _import_batch(storage: Storage, table: str, rows: List[Dict[str, Any]]) -> int:
+    rows = _dedupe(table, _resolve(storage, table, rows))
+    storage.upsert_rows(table, rows)
+    return len(rows)
+
+
+def _run_batches(batches: Iterable[Any], handle: Callable[[Any], int], workers: int, label: str) -> int:
+    """Run `handle` over batches with at most 2 * workers in flight; returns the rows written."""
+    written = 0
+    failed = 0
+    in_flight = set()
+    started = time.perf_counter()
+
+    def collect(done):
+        nonlocal written, failed
+        for future in done:
+            try:
+                written += future.result()
+            except Exception as e:
+                failed += 1
+                logger.error("Failed to import a %s batch: %s", label, e)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for batch in batches:
+            in_flight.add(executor.submit(handle, batch))
+            if len(in_flight) >= 2 * workers:
+                done, in_flight = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                collect(done)
+        collect(concurrent.futures.wait(in_flight).done)
+
+    logger.info("Imported %d %s rows in %.1fs (%d failed batches)",
+                written, label, time.perf_counter() - started, failed)
+    return written
+
+
+def import_dump(storage: Storage, directory: str, tables: Sequence[str] = EXPORT_TABLES,
+                batch_size: int = 500, workers: int = 4) -> Dict[str, int]:
+    """Load a dump written by export(); tables missing from the directory are skipped."""
+    counts = {}
+    for table in tables:
+        path = _path(directory, table)
+        if not os.path.exists(path):
+            continue
+        counts[table] = _run_batches(_batches(read_ndjson(path), batch_size),
+                                     lambda rows, table=table: _import_batch(storage, table, rows),
+                                     workers, table)
+        storage.flush()
+    return counts
+
+
+def _read_payloads(paths: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    for path in paths:
+        if path.endswith(('.ndjson', '.ndjson.gz', '.jsonl', '.jsonl.gz')):
+            yield from read_ndjson(path)
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        yield from data if isinstance(data, list) else [data]
+
+
+def _import_payload_batch(storage: Storage, payloads: List[Dict[str, Any]]) -> int:
+    profiles = []
+    posts = []
+    for payload in payloads:
+        if not payload.get('data', {}).get('user', {}).get('username'):
+            continue
+        profile = process_profile_data(payload)
+        profiles.append(profile)
+        media_posts = payload['data']['user'].get('edge_owner_to_timeline_media', {})
+        posts.extend(process_posts(media_posts, None, profile['username']))
+    if not profiles:
+        return 0
+
+    storage.upsert_rows('profiles', _dedupe('profiles', profiles))
+    profile_ids = {row['username']: row['id'] for row in
+                   storage.select_in('profiles', 'username', [p['username'] for p in profiles], ('id', 'username'))}
+
+    post_rows = [{**post, 'profile_id': profile_ids.get(post['username'])} for post, _ in posts if post.get('shortcode')]
+    storage.upsert_rows('posts', _dedupe('posts', post_rows))
+    post_ids = {row['shortcode']: row['id'] for row in
+                storage.select_in('posts', 'shortcode', [p['shortcode'] for p in post_rows], ('id', 'shortcode'))}
+
+    media_rows = [{**media, 'post_id': post_ids[post['shortcode']]}
+                  for post, media_list in posts if post.get('shortcode') in post_ids for media in media_list]
+    storage.upsert_media(_dedupe('post_media', media_rows))
+    return len(profiles)
+
+
+def import_payloads(storage: Storage, paths: Iterable[str], batch_size: int = 100, workers: int = 4) -> int:
+    """Load archived profile payloads through batched upserts; returns the profiles written."""
+    written = _run_batches(_batches(_read_payloads(paths), batch_size),
+                           lambda payloads: _import_payload_batch(storage, payloads), workers, 'profile payload')
+    storage.flush()
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sqlite', metavar='PATH', help='use this SQLite file instead of STORAGE_BACKEND')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help='write the dataset to a directory')
+    export_parser.add_argument('directory')
+    export_parser.add_argument('--tables', default=','.join(EXPORT_TABLES))
+    export_parser.add_argument('--page-size', type=int, default=1000)
+    export_parser.add_argument('--workers', type=int, default=1, help='tables exported concurrently')
+
+    import_parser = commands.add_parser('import', help='load a directory written by export')
+    import_parser.add_argument('directory')
+    import_parser.add_argument('--tables', default=','.join(EXPORT_TABLES))
+    import_parser.add_argument('--batch-size', type=int, default=500)
+    import_parser.add_argument('--workers', type=int, default=4, help='batches written concurrently')
+
+    payload_parser = commands.add_parser('import-payloads', help='load archived profile API responses')
+    payload_parser.add_argument('paths', nargs='+')
+    payload_parser.add_argument('--batch-size', type=int, default=100, help='profiles per batch')
+    payload_parser.add_argument('--workers', type=int, default=4, help='batches written concurrently')
+
+    args = parser.parse_args(argv)
+    configure_logging()
+    storage: Optional[Storage] = SQLiteStorage(args.sqlite) if args.sqlite else get_storage()
+
+    if args.command == 'export':
+        counts = export(storage, args.directory, args.tables.split(','), args.page_size, args.workers)
+    elif args.command == 'import':
+        counts = import_dump(storage, args.directory, args.tables.split(','), args.batch_size, args.workers)
+    else:
+        counts = {'profiles': import_payloads(storage, args.paths, args.batch_size, args.workers)}
+    print(json.dumps(counts))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+# graph_index.py
+"""In-memory CSR index of the related-profiles graph.
+
+Usernames are remapped to dense integer node ids, and each node's related
+users are stored as one contiguous run of a flat `targets` array, delimited
+by `offsets` (compressed sparse row). Lookups are a slice, so "related
+users", 2-hop suggestions and PageRank ranks are answered without any API
+or DB call.
+
+The index is built from `profile_relationships` (see `build_from_storage`)
+and kept current by the crawler through `set_related()`. Updated rows go to
+a small overlay that shadows the CSR arrays until `compact()` folds them in
+and recomputes the ranks. Compaction builds the new arrays without holding
+the index lock, and callers run it in a worker thread once
+`compaction_due()`, so lookups never wait for PageRank.
+
+In-degrees (how many indexed users list a user as related) are kept up to
+date on every `set_related()`, so `priority()` can order a crawl frontier
+before the new nodes have been through a compaction.
+
+`save()` writes one flat file that `load()` maps read-only, so worker
+processes share the arrays through the page cache:
+
+    magic 'IGPVCSR1' | n, m, names_len (int64)
+    offsets  int64[n + 1]
+    ranks    float64[n]
+    targets  int32[m]
+    names    utf-8, newline separated
+
+Settings:
+    GRAPH_INDEX_PATH: the index the app and crawler load and save
+    GRAPH_COMPACT_ROWS: overlay rows that make a compaction due (default 1000)
+    GRAPH_COMPACT_SECONDS: age of the oldest overlay row that makes one due
+        (default 600)
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from igprofileviewer.web.log import configure_logging, get_logger
+
+logger = get_logger(__name__)
+
+GRAPH_INDEX_PATH = os.getenv('GRAPH_INDEX_PATH')
+GRAPH_COMPACT_ROWS = int(os.getenv('GRAPH_COMPACT_ROWS', '1000'))
+GRAPH_COMPACT_SECONDS = float(os.getenv('GRAPH_COMPACT_SECONDS', '600'))
+
+_MAGIC = b'IGPVCSR1'
+_HEADER = struct.Struct('<8sqqq')
+
+
+class GraphIndex:
+    def __init__(self, names: Sequence[str] = (), offsets: Optional[Sequence[int]] = None,
+                 targets: Optional[Sequence[int]] = None, ranks: Optional[Sequence[float]] = None):
+        """Wrap CSR arrays; use `from_edges` or `load` rather than calling this directly."""
+        self.names: List[str] = list(names)
+        self.ids: Dict[str, int] = {name: i for i, name in enumerate(self.names)}
+        if offsets is None:
+            offsets = array('q', [0] * (len(self.names) + 1))
+        if targets is None:
+            targets = array('i')
+        if ranks is None:
+            ranks = array('d', [0.0] * len(self.names))
+        # Swapped as one tuple so readers never see arrays from different builds.
+        self._csr = (offsets, targets, ranks)
+        # node -> related nodes, for rows changed since the last compact().
+        self._overlay: Dict[int, array] = {}
+        self._overlay_since: Optional[float] = None
+        # node -> in-degree; computed from the arrays on first use.
+        self._in_degree: Optional[Counter] = None
+        self._lock = threading.Lock()
+        # Serializes compactions, which run without holding _lock.
+        self._compact_lock = threading.Lock()
+        self._mmap = None
+
+    @classmethod
+    def from_edges(cls, adjacency: Dict[str, Iterable[str]], pagerank: bool = True) -> 'GraphIndex':
+        """Build an index from {username: related usernames}."""
+        index = cls()
+        for username, related in adjacency.items():
+            index.set_related(username, related)
+        index.compact(pagerank=pagerank)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def edge_count(self) -> int:
+        offsets, targets, _ = self._csr
+        shadowed = sum(offsets[node + 1] - offsets[node] for node in self._overlay if node + 1 < len(offsets))
+        return len(targets) - shadowed + sum(len(row) for row in self._overlay.values())
+
+    # -- updates ----------------------------------------------------------
+
+    def _node(self, username: str) -> int:
+        node = self.ids.get(username)
+        if node is None:
+            node = self.ids[username] = len(self.names)
+            self.names.append(username)
+        return node
+
+    def set_related(self, username: str, related: Iterable[str]) -> None:
+        """Replace `username`'s related users (order is kept, duplicates dropped)."""
+        username = username.lower()
+        with self._lock:
+            node = self._node(username)
+            row = array('i', (self._node(r.lower()) for r in dict.fromkeys(related) if r and r.lower() != username))
+            if self._in_degree is not None:
+                self._in_degree.subtract(self._row(node))
+                self._in_degree.update(row)
+            if not self._overlay:
+                self._overlay_since = time.monotonic()
+            self._overlay[node] = row
+
+    def compaction_due(self, max_rows: int = GRAPH_COMPACT_ROWS, max_age: float = GRAPH_COMPACT_SECONDS) -> bool:
+        """Whether the overlay has `max_rows` rows, or has had any for `max_age` seconds."""
+        since = self._overlay_since
+        return len(self._overlay) >= max_rows or (since is not None and time.monotonic() - since >= max_age)
+
+    def compact(self, pagerank: bool = True) -> None:
+        """Fold the overlay into fresh CSR arrays and (optionally) recompute ranks.
+
+        Readers and set_related() carry on against the current arrays while
+        the new ones are built; rows replaced meanwhile stay in the overlay.
+        """
+        with self._compact_lock:
+            with self._lock:
+                n = len(self.names)
+                overlay = dict(self._overlay)
+                old_offsets, old_targets, old_ranks = self._csr
+            if not overlay and len(old_ranks) == n:
+                return
+
+            offsets = array('q', [0])
+            targets = array('i')
+            for node in range(n):
+                row = overlay.get(node)
+                if row is None:
+                    row = old_targets[old_offsets[node]:old_offsets[node + 1]] if node + 1 < len(old_offsets) else ()
+                targets.extend(row)
+                offsets.append(len(targets))
+            if pagerank:
+                ranks = self._pagerank(offsets, targets)
+            else:
+                ranks = array('d', old_ranks)
+                ranks.extend([0.0] * (n - len(ranks)))
+
+            with self._lock:
+                # The arrays go first: a reader that still finds a row in the
+                # overlay uses it, one that does not finds it in the arrays.
+                self._csr = (offsets, targets, ranks)
+                self._overlay = {node: row for node, row in self._overlay.items() if overlay.get(node) is not row}
+                self._overlay_since = time.monotonic() if self._overlay else None
+                self._mmap = None
+
+    @staticmethod
+    def _pagerank(offsets: Sequence[int], targets: Sequence[int], damping: float = 0.85,
+                  iterations: int = 30, tolerance: float = 1e-9) -> array:
+        n = len(offsets) - 1
+        if n == 0:
+            return array('d')
+        ranks = [1.0 / n] * n
+        for _ in range(iterations):
+            incoming = [0.0] * n
+            dangling = 0.0
+            for node in range(n):
+                start, end = offsets[node], offsets[node + 1]
+                if start == end:
+                    dangling += ranks[node]
+                    continue
+                share = ranks[node] / (end - start)
+                for target in targets[start:end]:
+                    incoming[target] += share
+            base = (1.0 - damping + damping * dangling) / n
+            updated = [base + damping * x for x in incoming]
+            delta = sum(abs(a - b) for a, b in zip(updated, ranks))
+            ranks = updated
+            if delta < tolerance:
+                break
+        return array('d', ranks)
+
+    # -- queries ----------------------------------------------------------
+
+    def _row(self, node: int) -> Sequence[int]:
+        row = self._overlay.get(node)
+        if row is not None:
+            return row
+        return self._csr_row(node)
+
+    def _csr_row(self, node: int) -> Sequence[int]:
+        offsets, targets, _ = self._csr
+        if node + 1 >= len(offsets):
+            return ()
+        return targets[offsets[node]:offsets[node + 1]]
+
+    def __contains__(self, username: str) -> bool:
+        return username.lower() in self.ids
+
+    def related(self, username: str, limit: Optional[int] = None) -> List[str]:
+        """`username`'s related users, in the order the API listed them."""
+        node = self.ids.get(username.lower())
+        if node is None:
+            return []
+        row = self._row(node)
+        return [self.names[i] for i in (row[:limit] if limit else row)]
+
+    def suggestions(self, username: str, limit: int = 10) -> List[str]:
+        """2-hop suggestions: users related to `username`'s related users.
+
+        Ranked by how many of them point at the suggestion, then by rank.
+        """
+        node = self.ids.get(username.lower())
+        if node is None:
+            return []
+        direct = set(self._row(node))
+        counts = Counter()
+        for neighbour in direct:
+            counts.update(t for t in self._row(neighbour) if t != node and t not in direct)
+        ranks = self._csr[2]
+        best = sorted(counts, key=lambda t: (-counts[t], -(ranks[t] if t < len(ranks) else 0.0)))
+        return [self.names[t] for t in best[:limit]]
+
+    def rank(self, username: str) -> float:
+        """PageRank as of the last compact(); 0.0 for unknown or newer users."""
+        node = self.ids.get(username.lower())
+        ranks = self._csr[2]
+        return ranks[node] if node is not None and node < len(ranks) else 0.0
+
+    def in_degree(self, username: str) -> int:
+        """How many indexed users list `username` as related."""
+        node = self.ids.get(username.lower())
+        if node is None:
+            return 0
+        if self._in_degree is None:
+            with self._lock:
+                if self._in_degree is None:
+                    in_degree = Counter(self._csr[1])
+                    for overlay_node, row in self._overlay.items():
+                        in_degree.subtract(self._csr_row(overlay_node))
+                        in_degree.update(row)
+                    self._in_degree = in_degree
+        return self._in_degree[node]
+
+    def priority(self, username: str) -> float:
+        """Crawl priority: in-degree, with rank (always below 1) breaking ties.
+
+        Unlike rank() this is current for users added since the last compact().
+        """
+        return self.in_degree(username) + self.rank(username)
+
+    def by_rank(self, usernames: Iterable[str]) -> List[str]:
+        """`usernames` sorted by descending priority() (stable for ties)."""
+        return sorted(usernames, key=self.priority, reverse=True)
+
+    def top(self, limit: int = 10) -> List[str]:
+        ranks = self._csr[2]
+        return [self.names[i] for i in sorted(range(len(ranks)), key=ranks.__getitem__, reverse=True)[:limit]]
+
+    # -- persistence ------------------------------------------------------
+
+    def save(self, path: str) -> None:
+        """Compact if needed and write the index atomically."""
+        if self._overlay or len(self._csr[2]) != len(self.names):
+            self.compact()
+        offsets, targets, ranks = self._csr
+        names = '\n'.join(self.names).encode('utf-8')
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, len(ranks), len(targets), len(names)))
+            # Sections are written widest first, so each stays aligned in the mapping.
+            for section in (offsets, ranks, targets):
+                f.write(section)
+            f.write(names)
+        # Replacing (not rewriting) the file leaves existing mappings intact.
+        os.replace(tmp, path)
+        logger.info("Saved graph index (%d nodes, %d edges) to %s", len(ranks), len(targets), path)
+
+    @classmethod
+    def load(cls, path: str) -> 'GraphIndex':
+        """Map a saved index read-only; the arrays are not copied into memory."""
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        magic, n, m, names_len = _HEADER.unpack_from(view)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a graph index")
+        pos = _HEADER.size
+        offsets = view[pos:pos + 8 * (n + 1)].cast('q')
+        pos += 8 * (n + 1)
+        ranks = view[pos:pos + 8 * n].cast('d')
+        pos += 8 * n
+        targets = view[pos:pos + 4 * m].cast('i')
+        pos += 4 * m
+        names = bytes(view[pos:pos + names_len]).decode('utf-8').split('\n') if n else []
+        index = cls(names, offsets, targets, ranks)
+        index._mmap = mapped
+        return index
+
+
+def build_from_storage(storage, page_size: int = 1000, pagerank: bool = True) -> GraphIndex:
+    """Build an index from every 'related' row of profile_relationships.
+
+    Both tables are read with keyset pagination on id.
+    """
+    usernames: Dict[int, str] = {}
+    last_id = 0
+    while True:
+        rows = storage.scan('profiles', ('id', 'username'), after_id=last_id, limit=page_size)
+        for row in rows:
+            usernames[row['id']] = row['username']
+        if len(rows) < page_size:
+            break
+        last_id = rows[-1]['id']
+
+    adjacency: Dict[str, List[str]] = {}
+    last_id = 0
+    while True:
+        rows = storage.scan('profile_relationships', ('id', 'profile_id', 'related_profile_id'),
+                            after_id=last_id, limit=page_size, filters={'relationship_type': 'related'})
+        for row in rows:
+            source = usernames.get(row['profile_id'])
+            target = usernames.get(row['related_profile_id'])
+            if source and target:
+                adjacency.setdefault(source, []).append(target)
+        if len(rows) < page_size:
+            break
+        last_id = rows[-1]['id']
+
+    index = GraphIndex.from_edges(adjacency, pagerank=pagerank)
+    logger.info("Built graph index from %s: %d nodes, %d edges", storage.source, len(index), index.edge_count)
+    return index
+
+
+def _load_default() -> GraphIndex:
+    if GRAPH_INDEX_PATH and os.path.exists(GRAPH_INDEX_PATH):
+        try:
+            return GraphIndex.load(GRAPH_INDEX_PATH)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not load graph index %s: %s", GRAPH_INDEX_PATH, e)
+    return GraphIndex()
+
+
+graph_index = _load_default()
+
+
+def main(argv=None):
+    """Build the index file from storage: python -m igprofileviewer.web.db.graph_index [path]"""
+    from igprofileviewer.web.db.storage import get_storage
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('path', nargs='?', default=GRAPH_INDEX_PATH)
+    parser.add_argument('--page-size', type=int, default=1000)
+    args = parser.parse_args(argv)
+    if not args.path:
+        parser.error('pass a path or set GRAPH_INDEX_PATH')
+    configure_logging()
+    build_from_storage(get_storage(), page_size=args.page_size).save(args.path)
+
+
+if __name__ == "__main__":
+    main()
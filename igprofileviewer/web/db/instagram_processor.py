@@ -1,8 +1,11 @@
 # instagram_processor.py
 
+import argparse
 import asyncio
+import os
 import aiohttp
-from typing import List, Tuple
+from collections import Counter
+from typing import Callable, Iterable, List, Optional, Set, Tuple
 # Replace these relative imports
 # from queue_manager import ProfileQueue
 # from processors import process_profile_data, process_posts
@@ -10,43 +13,166 @@ from typing import List, Tuple
 
 # With these absolute imports
 from igprofileviewer.web.db.queue_manager import ProfileQueue
+from igprofileviewer.web.db.following import FollowingIngestor
+from igprofileviewer.web.db.graph_index import graph_index
+from igprofileviewer.web.db.known_usernames import KnownUsernames
+from igprofileviewer.web.db.sharding import LeaseStore, default_worker_id
 from igprofileviewer.web.db.processors import process_profile_data, process_posts
-from igprofileviewer.web.db.supabase import init_supabase
-import traceback  # Add this at the top with other imports
+from igprofileviewer.web.db.storage import Storage, get_storage
+from igprofileviewer.web.instagram_api import AsyncInstagramAPI
+from igprofileviewer.web.log import configure_logging, get_logger
+from igprofileviewer.web.profiling import ProfileSession
+from igprofileviewer.web.image_cache import prewarm, profile_image_urls
+from igprofileviewer.web.oembed_cache import prefetch as prefetch_oembed, profile_shortcodes
+from igprofileviewer.web.page_cache import page_cache
+from igprofileviewer.web.resilience import CircuitOpen, is_upstream_failure, wait_until_available
+from igprofileviewer.web.metrics import CRAWL_POSTS, CRAWL_PROFILES, QUEUE_DEPTH
+
+logger = get_logger(__name__)
 
 class InstagramProcessor:
-    def __init__(self, batch_size: int = 1, target_count: int = 10, queue_state_file: str = None):
+    def __init__(self, batch_size: int = 1, target_count: int = 10, queue_state_file: str = None,
+                 profiling: str = None, prewarm_images: bool = False, image_concurrency: int = 8,
+                 prefetch_embeds: bool = False, expand: str = 'related', follow_batch_size: int = 500,
+                 graph_index_path: str = None, known: Optional[KnownUsernames] = None,
+                 storage: Optional[Storage] = None, queue_state_key: str = None,
+                 following_concurrency: int = 2, max_queue_size: int = 100_000, upstream_retries: int = 3):
+        """
+        Args:
+            profiling: 'sample' or 'cprofile' to profile each process_profiles
+                run into PROFILE_DIR (see profiling.py); None disables it.
+            prewarm_images: download each crawled profile's images into the
+                local image cache so its page loads without CDN requests.
+            image_concurrency: parallel image downloads per profile.
+            prefetch_embeds: fill the oEmbed cache for each crawled profile's
+                posts so /embed/<shortcode> never goes upstream.
+            expand: how the frontier grows: 'related' (edge_related_profiles),
+                'following' (paged following lists, see following.py) or 'both'.
+            follow_batch_size: most follow edges per bulk write.
+            following_concurrency: following lists ingested at once; each
+                runs as its own task beside the profile batches.
+            max_queue_size: most usernames held in the local frontier.
+            upstream_retries: times a profile is put back in the frontier
+                after its fetch failed because the API was down or timed
+                out, before it is given up on.
+            graph_index_path: save the related-profiles graph index here when
+                the crawl finishes (see graph_index.py).
+            known: local index of usernames already in profiles, used to
+                filter the frontier without asking storage (see
+                known_usernames.py, KnownUsernames.for_storage); None
+                checks every batch remotely.
+            storage: where crawled data goes (see storage.py); defaults to
+                the STORAGE_BACKEND one.
+            queue_state_key: also keep the queue state in storage under
+                this name, for crawls without a local state file.
+        """
+        if expand not in ('related', 'following', 'both'):
+            raise ValueError(f"expand must be 'related', 'following' or 'both', got {expand!r}")
         self.api_key = None
-        self.supabase = init_supabase()
-        self.queue = ProfileQueue(batch_size=batch_size, target_count=target_count)
+        self.storage = storage or get_storage()
+        self.queue = ProfileQueue(batch_size=batch_size, target_count=target_count, max_size=max_queue_size)
         self.queue_state_file = queue_state_file
+        self.queue_state_key = queue_state_key
+        self.profiling = profiling
+        self.prewarm_images = prewarm_images
+        self.image_concurrency = image_concurrency
+        self.prefetch_embeds = prefetch_embeds
+        self.expand = expand
+        self.graph_index_path = graph_index_path
+        self.known = known
+        self.following = FollowingIngestor(self.storage, self.queue, batch_size=follow_batch_size,
+                                           enqueue=self._enqueue_following)
+        self.following_concurrency = following_concurrency
+        self._following_tasks: Set[asyncio.Future] = set()
+        self._following_slots: Optional[asyncio.Semaphore] = None
+        # Usernames whose following list is being ingested in this process.
+        self._ingesting: Set[str] = set()
+        self._frontier_changed: Optional[asyncio.Event] = None
+        # Called with (username, error or None) when an ingestion ends.
+        self._after_following: Optional[Callable[[str, Optional[Exception]], None]] = None
+        self._compacting_graph = False
+        self.upstream_retries = upstream_retries
+        # Usernames whose last fetch failed because of the API, not the profile.
+        self._unavailable: Set[str] = set()
+        self._retries: Counter = Counter()
 
-    async def process_single_post(self, post, media_list):
+    def _save_state(self) -> None:
+        if self.queue_state_file:
+            self.queue.save_state(self.queue_state_file)
+        if self.queue_state_key:
+            self.storage.save_crawl_state(self.queue_state_key, self.queue.to_state())
+
+    def _existing_usernames(self, usernames: Iterable[str]) -> Set[str]:
+        """The given usernames that already have a row in profiles."""
+        usernames = list(usernames)
+        if self.known is not None:
+            self.known.refresh(self.storage)
+            return {username for username in usernames if username in self.known}
+        return self.storage.existing_usernames(usernames)
+
+    def _stored_usernames(self, usernames: List[str]) -> Set[str]:
+        """The given just-crawled usernames whose profile row was written."""
+        if self.known is not None:
+            # store_profile adds each successful upsert to the index.
+            return {username for username in usernames if username in self.known}
+        return self.storage.existing_usernames(usernames)
+
+    def _enqueue_following(self, usernames: Iterable[str]) -> None:
+        self.queue.extend(usernames, priority=graph_index.priority)
+        if self._frontier_changed is not None:
+            self._frontier_changed.set()
+
+    async def _start_following(self, session, username: str) -> None:
+        """Ingest `username`'s following list in a background task.
+
+        Waits while `following_concurrency` ingestions are running, so long
+        lists hold the crawl back instead of piling up.
+        """
+        if self._following_slots is None:
+            self._following_slots = asyncio.Semaphore(self.following_concurrency)
+        await self._following_slots.acquire()
+        self._ingesting.add(username)
+        task = asyncio.ensure_future(self._ingest_following(session, username))
+        self._following_tasks.add(task)
+        task.add_done_callback(self._following_tasks.discard)
+
+    async def _ingest_following(self, session, username: str) -> None:
+        error = None
         try:
-            # Insert post first
-            post_result = self.supabase.table('posts').upsert(post).execute()
-            if not post_result.data:
-                return f"Failed to insert post"
-            
-            post_id = post_result.data[0]['id']
-            
-            # Batch insert all media records
-            if media_list:
-                media_records = [{**media, 'post_id': post_id} for media in media_list]
-                self.supabase.table('post_media').insert(media_records).execute()
-            
-            return None
-            
+            await self.following.ingest(AsyncInstagramAPI(session, self.api_key), username)
         except Exception as e:
-            return f"Error processing post {post.get('shortcode', 'unknown')}: {str(e)}"
+            error = e
+            # The saved cursor lets a later run pick up where this one stopped.
+            logger.error("Error ingesting following list for %s: %s", username, e)
+        try:
+            if self._after_following is not None:
+                self._after_following(username, error)
+        except Exception as e:
+            logger.error("Error finishing following list for %s: %s", username, e)
+        finally:
+            self._ingesting.discard(username)
+            self._following_slots.release()
+
+    async def _wait_for_following(self) -> None:
+        """Wait until a following-list ingestion queues handles or ends."""
+        self._frontier_changed.clear()
+        changed = asyncio.ensure_future(self._frontier_changed.wait())
+        try:
+            await asyncio.wait({changed, *self._following_tasks}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            changed.cancel()
+
+    async def _drain_following(self) -> None:
+        while self._following_tasks:
+            await asyncio.gather(*self._following_tasks)
 
     async def process_posts_parallel(self, posts_data, profile_id, username):
         processed_posts = process_posts(posts_data, profile_id, username)
         if not processed_posts:
-            print(f"No posts to process for {username}")
+            logger.debug("No posts to process for %s", username)
             return []
             
-        print(f"Processing {len(processed_posts)} posts for {username}")
+        logger.debug("Processing %d posts for %s", len(processed_posts), username)
         chunk_size = 10
         results = []
         errors = []
@@ -61,22 +187,39 @@ class InstagramProcessor:
                 if result is not None:  # None means success, string means error
                     errors.append(result)
                     
+        CRAWL_POSTS.inc(len(processed_posts) - len(errors), outcome='ok')
         if errors:
-            print(f"Encountered {len(errors)} errors while processing posts for {username}:")
-            for error in errors[:5]:  # Show first 5 errors
-                print(f"- {error}")
+            CRAWL_POSTS.inc(len(errors), outcome='error')
+            logger.warning("Encountered %d errors while processing posts for %s; first: %s",
+                           len(errors), username, "; ".join(errors[:5]))
                 
         return errors
 
     async def _fetch_profile_data(self, session, username):
-        base_url = "https://api.scrapecreators.com/v1/instagram"
-        headers = {"x-api-key": self.api_key, "Accept": "application/json"}
-        
-        async with session.get(f"{base_url}/profile", headers=headers, params={"handle": username}) as response:
-            if response.status != 200:
-                print(f"Error fetching profile {username}: Status {response.status}")
-                return None
-            return await response.json()
+        try:
+            return await AsyncInstagramAPI(session, self.api_key).get_profile(username)
+        except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpen) as e:
+            if is_upstream_failure(e):
+                # The profile itself may be fine; the batch puts it back (see _to_retry).
+                self._unavailable.add(username)
+            if isinstance(e, CircuitOpen):
+                # get_profile logs the requests that failed, not the ones never sent.
+                logger.warning("Error fetching profile %s: %s", username, e)
+            return None
+
+    def _to_retry(self, usernames: Iterable[str]) -> List[str]:
+        """Those of the unstored `usernames` to crawl again because the API, not the profile, failed."""
+        retry = []
+        for username in usernames:
+            if username not in self._unavailable:
+                continue
+            self._unavailable.discard(username)
+            self._retries[username] += 1
+            if self._retries[username] <= self.upstream_retries:
+                retry.append(username)
+            else:
+                logger.warning("Giving up on profile %s after %d failed fetches", username, self._retries[username])
+        return retry
 
     async def _process_profile_data(self, profile_data):
         if not profile_data.get('data', {}).get('user'):
@@ -88,9 +231,14 @@ class InstagramProcessor:
             
         try:
             # Use upsert instead of insert to update existing profiles
-            result = self.supabase.table('profiles').upsert(processed_profile).execute()
-            if not result.data:
+            profile_id = self.storage.upsert_profile(processed_profile)
+            if profile_id is None:
                 return None
+
+            # A newer version of this profile invalidates its rendered pages.
+            page_cache.invalidate(processed_profile['username'])
+            if self.known is not None:
+                self.known.add(processed_profile['username'])
                 
             # Extract related users
             user = profile_data.get('data', {}).get('user', {})
@@ -98,26 +246,24 @@ class InstagramProcessor:
             for edge in user.get('edge_related_profiles', {}).get('edges', []):
                 if username := edge.get('node', {}).get('username'):
                     related_users.append(username)
+            graph_index.set_related(processed_profile['username'], related_users)
                     
-            return {'profile_id': result.data[0]['id'], 'related_users': related_users}
+            return {'profile_id': profile_id, 'related_users': related_users}
             
         except Exception as e:
-            print(f"Error upserting profile: {str(e)}")
+            logger.error("Error upserting profile: %s", e)
             return None
 
     async def process_single_post(self, post, media_list):
         try:
             # Upsert post first
-            post_result = self.supabase.table('posts').upsert(post).execute()
-            if not post_result.data:
-                return f"Failed to upsert post"
-            
-            post_id = post_result.data[0]['id']
+            post_id = self.storage.upsert_post(post)
+            if post_id is None:
+                return "Failed to upsert post"
             
             # Upsert media records instead of insert
             if media_list:
-                media_records = [{**media, 'post_id': post_id} for media in media_list]
-                self.supabase.table('post_media').upsert(media_records).execute()
+                self.storage.upsert_media([{**media, 'post_id': post_id} for media in media_list])
             
             return None
             
@@ -129,6 +275,38 @@ class InstagramProcessor:
         posts_data = user.get('edge_owner_to_timeline_media', {})
         return await self.process_posts_parallel(posts_data, profile_id, username)
 
+    async def store_profile(self, profile_data, username: str = None) -> Optional[List[str]]:
+        """Write an already fetched profile payload and its posts.
+
+        Returns the related usernames, or None if the profile was not stored.
+        """
+        username = username or profile_data.get('data', {}).get('user', {}).get('username')
+
+        # Process profile first to get profile_id
+        profile_result = await self._process_profile_data(profile_data)
+        if not profile_result:
+            return None
+
+        # Now process posts with the profile_id and check for errors
+        posts_errors = await self._process_profile_posts(profile_data, profile_result['profile_id'], username)
+        if posts_errors:
+            logger.info("Completed processing profile %s with %d post errors", username, len(posts_errors))
+        else:
+            logger.debug("Successfully processed all posts for %s", username)
+
+        await self._compact_graph_if_due()
+        return profile_result.get('related_users', [])
+
+    async def _compact_graph_if_due(self) -> None:
+        if self._compacting_graph or not graph_index.compaction_due():
+            return
+        self._compacting_graph = True
+        try:
+            # PageRank is pure Python; keep it off the event loop.
+            await asyncio.to_thread(graph_index.compact)
+        finally:
+            self._compacting_graph = False
+
     async def process_profile(self, session: aiohttp.ClientSession, username: str) -> Tuple[str, List[str]]:
         try:
             # Fetch profile data first
@@ -136,52 +314,204 @@ class InstagramProcessor:
             if not profile_data:
                 return username, []
 
-            # Process profile first to get profile_id
-            profile_result = await self._process_profile_data(profile_data)
-            if not profile_result:
+            related_users = await self.store_profile(profile_data, username)
+            if related_users is not None and self.prewarm_images:
+                await prewarm(profile_image_urls(profile_data), session=session, concurrency=self.image_concurrency)
+            if related_users is not None and self.prefetch_embeds:
+                await prefetch_oembed(profile_shortcodes(profile_data), session=session)
+            if related_users is not None and self.expand in ('following', 'both'):
+                if not profile_data.get('data', {}).get('user', {}).get('is_private'):
+                    await self._start_following(session, username)
+            if self.expand == 'following':
                 return username, []
-
-            # Now process posts with the profile_id and check for errors
-            posts_errors = await self._process_profile_posts(profile_data, profile_result['profile_id'], username)
-            if posts_errors:
-                print(f"Completed processing profile {username} with {len(posts_errors)} post errors")
-            else:
-                print(f"Successfully processed all posts for {username}")
-            
-            return username, profile_result.get('related_users', [])
+            return username, related_users or []
             
         except Exception as e:
-            print(f"Error processing profile {username}:")
-            traceback.print_exc()
+            logger.exception("Error processing profile %s", username)
             return username, []
 
     async def process_profiles(self, api_key: str, start_username: str = None):
+        return await self._profiled(f"crawl-{start_username or 'resume'}", self._crawl(api_key, start_username))
+
+    async def process_profiles_sharded(self, api_key: str, leases: LeaseStore, worker_id: str = None,
+                                       start_username: str = None, lease_seconds: float = 60,
+                                       idle_seconds: float = 2):
+        """Crawl as one of several workers sharing `leases` (see sharding.py).
+
+        target_count applies to profiles crawled by all workers together;
+        batch_size is per worker.
+        """
+        worker_id = worker_id or default_worker_id()
+        return await self._profiled(f"crawl-{worker_id}", self._crawl_sharded(
+            api_key, leases, worker_id, start_username, lease_seconds, idle_seconds))
+
+    async def _profiled(self, name: str, crawl):
+        if not self.profiling:
+            return await crawl
+
+        session = ProfileSession(name, mode=self.profiling).start()
+        try:
+            return await crawl
+        finally:
+            path = session.stop()
+            logger.info("Crawl profile written to %s (%s)", path, session.server_timing())
+
+    async def _crawl_sharded(self, api_key: str, leases: LeaseStore, worker_id: str, start_username: str,
+                             lease_seconds: float, idle_seconds: float):
+        self.api_key = api_key
+        if start_username:
+            leases.enqueue([start_username])
+        self._following_slots = asyncio.Semaphore(self.following_concurrency)
+        # Handles found through following lists go straight to the shared frontier.
+        self.following.enqueue = leases.enqueue
+        self._after_following = lambda username, error: self._finish_leased_following(
+            leases, worker_id, username, error)
+        keeper = asyncio.ensure_future(self._keep_leases(leases, worker_id, lease_seconds))
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                while True:
+                    # Exact counts: an estimate could stop the crawl early or never.
+                    progress = leases.progress(exact=True)
+                    QUEUE_DEPTH.set(progress['pending'])
+                    if progress['done'] >= self.queue.target_count:
+                        break
+
+                    # Do not burn through the frontier while the API is down.
+                    await wait_until_available('profile')
+                    shards = leases.rebalance(worker_id, lease_seconds)
+                    # Handles whose following list is still being read here stay pending.
+                    batch = [username for username in
+                             leases.pending(shards, self.queue.batch_size + len(self._ingesting))
+                             if username not in self._ingesting][:self.queue.batch_size]
+                    if not batch:
+                        if not progress['pending']:
+                            break
+                        # The remaining work is in other workers' shards.
+                        await asyncio.sleep(idle_seconds)
+                        continue
+
+                    try:
+                        await self._crawl_leased_batch(session, leases, worker_id, batch)
+                    except Exception as e:
+                        logger.error("Error processing batch: %s", e)
+                        continue
+                    logger.info("Progress: %d/%d profiles across workers (%s holds %d shards)",
+                                progress['done'] + len(batch), self.queue.target_count, worker_id, len(shards))
+                await self._drain_following()
+        finally:
+            keeper.cancel()
+            self.storage.flush()
+            leases.leave(worker_id)
+            if self.graph_index_path:
+                graph_index.save(self.graph_index_path)
+            if self.known is not None:
+                self.known.save()
+
+    async def _keep_leases(self, leases: LeaseStore, worker_id: str, lease_seconds: float) -> None:
+        """Renew this worker's leases for as long as the crawl runs.
+
+        Batches and following lists can outlast a lease; without this the
+        shards would be handed to another worker mid-batch.
+        """
+        while True:
+            await asyncio.sleep(lease_seconds / 3)
+            try:
+                leases.keep_alive(worker_id, lease_seconds)
+            except Exception as e:
+                logger.warning("Could not renew leases for %s: %s", worker_id, e)
+
+    def _finish_leased_following(self, leases: LeaseStore, worker_id: str, username: str,
+                                 error: Optional[Exception]) -> None:
+        if error is not None and is_upstream_failure(error):
+            # Left pending: whoever crawls it next resumes from the saved cursor.
+            return
+        self.storage.flush()
+        leases.mark([username], 'done', worker_id)
+
+    async def _crawl_leased_batch(self, session, leases: LeaseStore, worker_id: str, batch: List[str]) -> None:
+        existing_usernames = self._existing_usernames(batch)
+        resumed = set()
+        if self.expand in ('following', 'both'):
+            # Stored, but a worker may have stopped part way through the following list.
+            resumed = {u for u in existing_usernames if self.following.in_progress(u)}
+            for username in resumed:
+                await self._start_following(session, username)
+        leases.mark([u for u in batch if u in existing_usernames and u not in resumed], 'done', worker_id)
+        CRAWL_PROFILES.inc(len(existing_usernames), outcome='skipped')
+
+        profiles_to_process = [username for username in batch if username not in existing_usernames]
+        if not profiles_to_process:
+            return
+        results = await asyncio.gather(*(self.process_profile(session, u) for u in profiles_to_process))
+
+        stored_usernames = self._stored_usernames(profiles_to_process)
+
+        discovered = []
+        for username, related_users in results:
+            if username in stored_usernames:
+                discovered.extend(graph_index.by_rank(related_users))
+            else:
+                logger.error("Profile %s was not found in database after processing", username)
+        leases.enqueue(discovered)
+
+        # Rows must be durable before the handles are marked done.
+        self.storage.flush()
+        done = [u for u in profiles_to_process if u in stored_usernames]
+        # Those still reading their following list are marked when it ends.
+        leases.mark([u for u in done if u not in self._ingesting], 'done', worker_id)
+        not_stored = [u for u in profiles_to_process if u not in stored_usernames]
+        # Fetches the API failed stay pending for the next batch, here or elsewhere.
+        retry = set(self._to_retry(not_stored))
+        leases.mark([u for u in not_stored if u not in retry], 'failed', worker_id)
+        CRAWL_PROFILES.inc(len(done), outcome='processed')
+        CRAWL_PROFILES.inc(len(retry), outcome='retried')
+        CRAWL_PROFILES.inc(len(not_stored) - len(retry), outcome='failed')
+
+    async def _crawl(self, api_key: str, start_username: str = None):
         self.api_key = api_key
         
         if self.queue_state_file:
             self.queue.load_state(self.queue_state_file)
+        elif self.queue_state_key and (state := self.storage.load_crawl_state(self.queue_state_key)):
+            self.queue.restore(state)
         
         # Add queue cleaning at startup
-        print("Performing initial queue cleanup...")
-        self.queue.clean_queue(self.supabase)
+        logger.info("Performing initial queue cleanup...")
+        if self.known is not None:
+            self.known.refresh(self.storage)
+        self.queue.clean_queue(self.storage, known=self.known)
+        QUEUE_DEPTH.set(len(self.queue))
         
         if not self.queue.has_items() and self.queue.processed_count == 0 and start_username:
             self.queue.add_to_queue(start_username)
         
+        self._following_slots = asyncio.Semaphore(self.following_concurrency)
+        self._frontier_changed = asyncio.Event()
+        self.following.enqueue = self._enqueue_following
+        self._after_following = None
+
         async with aiohttp.ClientSession() as session:
-            while self.queue.should_continue():
+            # Finish following lists an earlier run was interrupted in.
+            for username in list(self.queue.following_cursors):
+                await self._start_following(session, username)
+
+            while self.queue.should_continue() or (
+                    self._following_tasks and self.queue.processed_count < self.queue.target_count):
                 # if self.queue.processed_count % 100 == 0:
-                #     self.queue.clean_queue(self.supabase)
+                #     self.queue.clean_queue(self.storage)
                 
+                await wait_until_available('profile')
                 batch = self.queue.get_next_batch()
                 if not batch:
+                    # Following lists still being read may add to the queue.
+                    await self._wait_for_following()
                     continue
                     
-                print(f"\nProcessing batch of {len(batch)} profiles...")
+                logger.debug("Processing batch of %d profiles...", len(batch))
                 try:
                     # Batch check existing profiles
-                    existing_profiles = self.supabase.table('profiles').select('id', 'username').in_('username', batch).execute()
-                    existing_usernames = {profile['username'] for profile in existing_profiles.data}
+                    existing_usernames = self._existing_usernames(batch)
                     
                     # Filter out existing profiles
                     profiles_to_process = [username for username in batch if username not in existing_usernames]
@@ -189,6 +519,7 @@ class InstagramProcessor:
                     # Mark existing profiles as processed
                     for username in existing_usernames:
                         self.queue.mark_processed(username)
+                    CRAWL_PROFILES.inc(len(existing_usernames), outcome='skipped')
                     
                     if not profiles_to_process:
                         continue
@@ -196,23 +527,62 @@ class InstagramProcessor:
                     tasks = [self.process_profile(session, username) for username in profiles_to_process]
                     results = await asyncio.gather(*tasks)
                     
-                    for i, (username, related_users) in enumerate(results):
-                        original_username = batch[i]
-                        verify_profile = self.supabase.table('profiles').select('id').eq('username', original_username).execute()
-                        if verify_profile.data:
-                            self.queue.mark_processed(original_username)
-                            for related_username in related_users:
-                                self.queue.add_to_queue(related_username)
+                    stored_usernames = self._stored_usernames(profiles_to_process)
+                    for username, related_users in results:
+                        if username in stored_usernames:
+                            self.queue.mark_processed(username)
+                            CRAWL_PROFILES.inc(outcome='processed')
+                            # Better-connected accounts first; see GraphIndex.priority.
+                            self.queue.extend(related_users, priority=graph_index.priority)
+                        elif self._to_retry([username]):
+                            CRAWL_PROFILES.inc(outcome='retried')
+                            self.queue.add_to_queue(username, graph_index.priority(username))
                         else:
-                            print(f"Error: Profile {original_username} was not found in database after processing")
+                            CRAWL_PROFILES.inc(outcome='failed')
+                            logger.error("Profile %s was not found in database after processing", username)
                         
-                        print(f"Progress: {self.queue.processed_count}/{self.queue.target_count} profiles (Queue size: {len(self.queue.queue)})")
+                    QUEUE_DEPTH.set(len(self.queue))
+                    logger.info("Progress: %d/%d profiles (Queue size: %d)",
+                                self.queue.processed_count, self.queue.target_count, len(self.queue))
                     
-                    if self.queue_state_file:
-                        self.queue.save_state(self.queue_state_file)
+                    self.storage.flush()
+                    self._save_state()
                 except Exception as e:
-                    print(f"Error processing batch: {str(e)}")
+                    logger.error("Error processing batch: %s", e)
             
-            print(f"\nCompleted! Processed {self.queue.processed_count} profiles")
-            if self.queue_state_file:
-                self.queue.save_state(self.queue_state_file)
\ No newline at end of file
+            await self._drain_following()
+            logger.info("Completed! Processed %d profiles", self.queue.processed_count)
+            self.storage.flush()
+            self._save_state()
+            if self.graph_index_path:
+                graph_index.save(self.graph_index_path)
+            if self.known is not None:
+                self.known.save()
+
+
+def main(argv=None):
+    """Run a crawl: python -m igprofileviewer.web.db.instagram_processor <start_username>"""
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('start_username', nargs='?', help='omit to resume from --state-file')
+    parser.add_argument('--target', type=int, default=10, help='profiles to crawl')
+    parser.add_argument('--batch-size', type=int, default=10)
+    parser.add_argument('--state-file', help='save and resume the queue here')
+    parser.add_argument('--expand', choices=('related', 'following', 'both'), default='related')
+    parser.add_argument('--prefetch-embeds', action='store_true',
+                        help="fill the oEmbed cache with each crawled profile's posts")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    configure_logging()
+    storage = get_storage()
+    processor = InstagramProcessor(batch_size=args.batch_size, target_count=args.target,
+                                   queue_state_file=args.state_file, expand=args.expand, storage=storage,
+                                   prefetch_embeds=args.prefetch_embeds,
+                                   known=KnownUsernames.for_storage(storage))
+    asyncio.run(processor.process_profiles(os.getenv('INSTAGRAM_API_KEY'), args.start_username))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# known_usernames.py
+"""Local index of the usernames already in `profiles`.
+
+Frontier cleaning and per-batch filtering used to ask Supabase about every
+queued handle, 50 at a time. This keeps the answer in a set instead:
+
+- the first `refresh()` bulk-loads every username with keyset pagination
+  on `profiles.id`, and later ones only fetch rows above the highest id
+  seen so far;
+- the crawler `add()`s each profile it upserts, so its own writes are
+  known before the next refresh;
+- `save()` persists the set (plus the id high-water mark and the
+  database it came from), and `load()` reads it back on the next run.
+
+Nothing is shared implicitly: crawlers build their own index with
+`KnownUsernames.for_storage(storage)` and pass it in. The default file
+lives in the data directory (see storage.data_dir()), so it survives
+reboots and temp cleaners, and is keyed by the database, so crawls against different backends never share
+one. Processes crawling the same database may share the file. Every save
+atomically replaces it with one process's index, which always holds every
+username up to its own high-water mark, so the last writer wins without
+making any other process's view wrong.
+
+Membership can lag rows written by other processes until the next refresh,
+which only costs a redundant crawl (profile writes are upserts). Deleted
+profiles are not tracked; if `profiles` has fewer rows than the index, the
+index is rebuilt from scratch.
+
+Settings: `KNOWN_USERNAMES_PATH` (overrides the per-database file),
+`KNOWN_USERNAMES_REFRESH` (seconds between incremental refreshes, default 60).
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Iterable, List, Optional
+
+from igprofileviewer.web.db.storage import data_dir
+from igprofileviewer.web.log import get_logger
+
+logger = get_logger(__name__)
+
+
+def default_path(source: str) -> str:
+    """KNOWN_USERNAMES_PATH, or a file in the data directory named after the database `source`."""
+    if os.getenv('KNOWN_USERNAMES_PATH'):
+        return os.environ['KNOWN_USERNAMES_PATH']
+    digest = hashlib.sha1(source.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(data_dir(), f"known-usernames-{digest}.txt")
+
+
+class KnownUsernames:
+    def __init__(self, path: Optional[str] = None, refresh_interval: float = 60.0):
+        """
+        Args:
+            path: File the index is persisted to; None keeps it in memory only
+            refresh_interval: Minimum seconds between incremental refreshes
+        """
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.usernames = set()
+        self.last_id = 0
+        # Storage.source of the database the index was built from.
+        self.source = None
+        self.loaded = False
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_storage(cls, storage, path: Optional[str] = None) -> 'KnownUsernames':
+        """An index of `storage`'s profiles, persisted to `path` or its default_path()."""
+        return cls(path or default_path(storage.source),
+                   refresh_interval=float(os.getenv('KNOWN_USERNAMES_REFRESH', '60')))
+
+    def __contains__(self, username: str) -> bool:
+        return username in self.usernames
+
+    def __len__(self) -> int:
+        return len(self.usernames)
+
+    def add(self, username: str) -> None:
+        """Record a profile we have just written."""
+        if username:
+            self.usernames.add(username)
+
+    def filter_unknown(self, usernames: Iterable[str]) -> List[str]:
+        """The usernames (in order) that are not in `profiles`."""
+        return [username for username in usernames if username not in self.usernames]
+
+    def refresh(self, storage, force: bool = False, page_size: int = 1000) -> None:
+        """Load the index (from disk, then storage) or pull in rows added since the last refresh."""
+        with self._lock:
+            if not self.loaded:
+                self.load()
+                self._check_consistency(storage)
+            elif not force and time.time() - self._refreshed_at < self.refresh_interval:
+                return
+
+            added = 0
+            while True:
+                rows = storage.scan('profiles', ('id', 'username'), after_id=self.last_id, limit=page_size)
+                for row in rows:
+                    self.usernames.add(row['username'])
+                added += len(rows)
+                if rows:
+                    self.last_id = rows[-1]['id']
+                if len(rows) < page_size:
+                    break
+
+            self.loaded = True
+            self._refreshed_at = time.time()
+            if added:
+                logger.info("Known usernames: %d new, %d total", added, len(self.usernames))
+                self.save()
+
+    def _check_consistency(self, storage) -> None:
+        """Start over if the index is for another database or profiles were deleted."""
+        source = storage.source
+        if self.source != source:
+            if self.usernames:
+                logger.info("Known usernames were indexed from another database; rebuilding")
+            self.usernames = set()
+            self.last_id = 0
+            self.source = source
+        if not self.usernames:
+            return
+        count = storage.count('profiles')
+        if count is not None and count < len(self.usernames):
+            logger.warning("profiles has %d rows but %d usernames are indexed; rebuilding",
+                           count, len(self.usernames))
+            self.usernames = set()
+            self.last_id = 0
+
+    def load(self) -> None:
+        """Read the persisted index, if there is one."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                meta = json.loads(f.readline())
+                self.usernames = set(f.read().split('\n')) - {''}
+            self.last_id = meta['last_id']
+            self.source = meta.get('source')
+            logger.info("Loaded %d known usernames from %s", len(self.usernames), self.path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Ignoring unreadable known-usernames file %s: %s", self.path, e)
+            self.usernames = set()
+            self.last_id = 0
+
+    def save(self) -> None:
+        """Write the index atomically (first line metadata, then one username per line)."""
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                meta = {'source': self.source, 'last_id': self.last_id, 'count': len(self.usernames)}
+                f.write(json.dumps(meta) + '\n')
+                f.write('\n'.join(sorted(self.usernames)))
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning("Failed to save known usernames to %s: %s", self.path, e)
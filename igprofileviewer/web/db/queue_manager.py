@@ -1,20 +1,78 @@
-from collections import deque
-from typing import List, Dict, Any, Set
+import heapq
+import itertools
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 import json
 from pathlib import Path
 
+from igprofileviewer.web.log import get_logger
+
+logger = get_logger(__name__)
+
 class ProfileQueue:
-    def __init__(self, batch_size: int = 1, target_count: int = 10):
-        self.queue = deque()
+    """Crawl frontier: a priority queue of usernames, highest priority first.
+
+    Each username is queued once; queuing it again with a higher priority
+    moves it up. Equal priorities come out in the order they were queued.
+    """
+
+    def __init__(self, batch_size: int = 1, target_count: int = 10, max_size: int = 100_000):
+        """
+        Args:
+            max_size: Most queued usernames; further ones are dropped, since
+                a crawl only ever takes target_count of them
+        """
+        # Heap of (-priority, sequence, username); entries whose priority was
+        # since raised are skipped when popped.
+        self._heap: List[Tuple[float, int, str]] = []
+        # Queued username -> its current priority.
+        self._priorities: Dict[str, float] = {}
+        self._sequence = itertools.count()
         self.batch_size = batch_size
         self.target_count = target_count
+        self.max_size = max_size
         self.processed_count = 0
         self.processed_usernames = set()
+        # Following lists being ingested: username -> cursor of the next
+        # unwritten page (None before the first). following.py keeps the
+        # authoritative copy in storage.
+        self.following_cursors: Dict[str, Optional[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._priorities)
+
+    def __contains__(self, username: str) -> bool:
+        return username in self._priorities
+
+    def usernames(self) -> List[str]:
+        """The queued usernames, highest priority first."""
+        return [username for priority, _, username in sorted(self._heap)
+                if self._priorities.get(username) == -priority]
         
-    def add_to_queue(self, username: str) -> None:
-        """Add username to queue if not already processed."""
-        if username not in self.processed_usernames and self.processed_count < self.target_count:
-            self.queue.append(username)
+    def add_to_queue(self, username: str, priority: float = 0.0) -> None:
+        """Queue username (or raise its priority) unless it was processed or there is no room."""
+        if username in self.processed_usernames or self.processed_count >= self.target_count:
+            return
+        current = self._priorities.get(username)
+        if current is None and len(self._priorities) >= self.max_size:
+            return
+        if current is not None and priority <= current:
+            return
+        self._priorities[username] = priority
+        heapq.heappush(self._heap, (-priority, next(self._sequence), username))
+        # Superseded entries are dropped once they outnumber the live ones.
+        if len(self._heap) > 2 * len(self._priorities) + 64:
+            self._reset(self.usernames(), self._priorities)
+
+    def extend(self, usernames: Iterable[str], priority: Callable[[str], float] = None) -> None:
+        for username in usernames:
+            self.add_to_queue(username, priority(username) if priority else 0.0)
+
+    def _reset(self, usernames: Iterable[str], priorities: Optional[Dict[str, float]] = None) -> None:
+        priorities = dict(priorities or {})
+        self._heap = []
+        self._priorities = {}
+        for username in usernames:
+            self.add_to_queue(username, priorities.get(username, 0.0))
     
     def mark_processed(self, username: str) -> None:
         """Mark a username as processed."""
@@ -22,70 +80,84 @@ class ProfileQueue:
         self.processed_count += 1
     
     def get_next_batch(self) -> List[str]:
-        """Get next batch of usernames to process."""
+        """Get the next batch of usernames to process, highest priority first."""
         batch = []
-        while len(batch) < self.batch_size and self.queue and self.processed_count < self.target_count:
-            batch.append(self.queue.popleft())
+        while len(batch) < self.batch_size and self._priorities and self.processed_count < self.target_count:
+            priority, _, username = heapq.heappop(self._heap)
+            if self._priorities.get(username) != -priority:
+                continue
+            del self._priorities[username]
+            batch.append(username)
         return batch
     
     def should_continue(self) -> bool:
         """Check if we should continue processing."""
-        return self.processed_count < self.target_count and (len(self.queue) > 0 or len(self.processed_usernames) == 0)
+        # An empty queue means there is nothing left to do, even if nothing was
+        # processed (e.g. the start profile could not be fetched).
+        return self.processed_count < self.target_count and len(self) > 0
     
     def has_items(self) -> bool:
         """Check if queue has items."""
-        return len(self.queue) > 0
+        return len(self) > 0
     
-    def clean_queue(self, supabase) -> None:
-        """Remove usernames that already exist in the database from the queue."""
-        print("\nCleaning queue...")
-        initial_size = len(self.queue)
+    def clean_queue(self, storage, known=None) -> None:
+        """Remove usernames that already exist in the database from the queue.
+
+        With `known` (a loaded KnownUsernames index) this is a local set
+        operation; otherwise `storage` is queried 50 usernames at a time.
+        """
+        logger.info("Cleaning queue...")
+        initial_size = len(self)
+        usernames = self.usernames()
+        priorities = self._priorities
         
-        # Convert deque to list for iteration
-        usernames = list(self.queue)
-        self.queue.clear()
+        if known is not None:
+            self._reset([username for username in usernames if username not in known], priorities)
+            logger.info("Cleaned %d already processed usernames from queue; size reduced from %d to %d",
+                        initial_size - len(self), initial_size, len(self))
+            return
+        
+        self._reset([])
         
         # Batch process usernames to check existence (50 at a time)
         batch_size = 50
-        cleaned_count = 0
         
         for i in range(0, len(usernames), batch_size):
             batch = usernames[i:i + batch_size]
-            # Use 'in' operator for more efficient querying
-            existing_profiles = supabase.table('profiles').select('username').in_('username', batch).execute()
-            existing_usernames = {profile['username'] for profile in existing_profiles.data}
+            existing_usernames = storage.existing_usernames(batch)
             
             # Add back usernames that don't exist in database
             for username in batch:
-                if username not in existing_usernames and username not in self.processed_usernames:
-                    self.queue.append(username)
-                else:
-                    cleaned_count += 1
+                if username not in existing_usernames:
+                    self.add_to_queue(username, priorities[username])
         
-        print(f"Cleaned {cleaned_count} already processed usernames from queue")
-        print(f"Queue size reduced from {initial_size} to {len(self.queue)}")
+        logger.info("Cleaned %d already processed usernames from queue; size reduced from %d to %d",
+                    initial_size - len(self), initial_size, len(self))
     
-    def save_state(self, filepath: str) -> None:
-        """Save queue state to file with duplicate removal."""
-        # Remove duplicates while maintaining order
-        seen = set()
-        unique_queue = []
-        for username in self.queue:
-            if username not in seen and username not in self.processed_usernames:
-                seen.add(username)
-                unique_queue.append(username)
-        
-        state = {
-            'queue': unique_queue,
-            'processed': list(self.processed_usernames)
+    def to_state(self) -> Dict[str, Any]:
+        """Queue state as a JSON-serializable dict."""
+        usernames = self.usernames()
+        return {
+            'queue': usernames,
+            'priorities': [self._priorities[username] for username in usernames],
+            'processed': list(self.processed_usernames),
+            'following_cursors': self.following_cursors,
         }
+    
+    def restore(self, state: Dict[str, Any]) -> None:
+        """Replace the queue state with one produced by to_state()."""
+        self.processed_usernames = set(state['processed'])
+        # States saved before priorities were kept have none.
+        self._reset(state['queue'], dict(zip(state['queue'], state.get('priorities', []))))
+        self.following_cursors = state.get('following_cursors', {})
+    
+    def save_state(self, filepath: str) -> None:
+        """Save queue state to file."""
         with open(filepath, 'w') as f:
-            json.dump(state, f)
+            json.dump(self.to_state(), f)
     
     def load_state(self, filepath: str) -> None:
         """Load queue state from file."""
         if Path(filepath).exists():
             with open(filepath, 'r') as f:
-                state = json.load(f)
-                self.queue = deque(state['queue'])
-                self.processed_usernames = set(state['processed'])
\ No newline at end of file
+                self.restore(json.load(f))
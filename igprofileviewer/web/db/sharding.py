@@ -0,0 +1,372 @@
+# sharding.py
+"""Lease-based work partitioning for running several crawl workers at once.
+
+Handles are hash-partitioned into a fixed number of shards. The crawl
+frontier lives in a shared table instead of a per-process ProfileQueue,
+and each worker owns a set of shards through time-limited leases:
+
+- every worker heartbeats, so all of them can see how many are alive;
+- on each rebalance a worker renews its leases, releases shards above its
+  fair share (ceil(shards / live workers)) and takes free or expired ones
+  up to it, so adding a worker spreads the shards out and a crashed
+  worker's shards are reclaimed once its leases expire;
+- a worker only crawls pending handles in shards it holds, and records
+  each result in the shared table, so progress is counted across all
+  workers;
+- while a batch is in flight the worker keeps renewing its leases
+  (`keep_alive`), and results are only recorded for shards it still holds,
+  so a stalled worker whose leases lapsed cannot overwrite the new owner's.
+
+An item stays 'pending' until a worker marks it 'done' or 'failed', so a
+handle in flight when its worker dies is simply crawled again by the
+shard's next owner (all writes are upserts). Leases use wall-clock
+seconds; keep `lease_seconds` well above the clock skew between machines.
+
+Two backends share the rebalancing logic:
+
+SQLiteLeaseStore: a local database file, for several processes on one machine.
+SupabaseLeaseStore: shared tables, for several machines:
+
+    create table crawl_frontier (
+        username text primary key,
+        shard integer not null,
+        state text not null default 'pending',
+        worker text,
+        updated_at double precision
+    );
+    create index on crawl_frontier (shard, state);
+    create index on crawl_frontier (state);
+    create table crawl_shards (
+        shard integer primary key,
+        owner text,
+        lease_expires double precision
+    );
+    create table crawl_workers (
+        worker_id text primary key,
+        expires double precision
+    );
+"""
+
+import math
+import os
+from abc import ABC, abstractmethod
+import socket
+import sqlite3
+import time
+import uuid
+import zlib
+from typing import Dict, Iterable, List, Sequence
+
+from igprofileviewer.web.log import get_logger
+from igprofileviewer.web.metrics import SUPABASE_LATENCY
+
+logger = get_logger(__name__)
+
+STATES = ('pending', 'done', 'failed')
+
+
+def shard_of(username: str, num_shards: int) -> int:
+    """Stable shard for `username` (crc32, identical in every process)."""
+    return zlib.crc32(username.lower().encode('utf-8')) % num_shards
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class LeaseStore(ABC):
+    """Shared frontier plus shard leases. Subclasses provide the storage."""
+
+    num_shards: int
+
+    # -- storage primitives ----------------------------------------------
+
+    @abstractmethod
+    def heartbeat(self, worker_id: str, expires: float) -> None:
+        """Record `worker_id` as live until `expires`."""
+
+    @abstractmethod
+    def live_workers(self, now: float) -> int:
+        """How many workers have an unexpired heartbeat."""
+
+    @abstractmethod
+    def owned_shards(self, worker_id: str, now: float) -> List[int]:
+        """Shards `worker_id` holds an unexpired lease on."""
+
+    @abstractmethod
+    def free_shards(self, now: float) -> List[int]:
+        """Shards that are unowned or whose lease expired."""
+
+    @abstractmethod
+    def try_acquire(self, worker_id: str, shard: int, now: float, expires: float) -> bool:
+        """Take `shard` if it is unowned, expired or already ours (compare-and-set)."""
+
+    @abstractmethod
+    def renew(self, worker_id: str, shards: Sequence[int], expires: float) -> None:
+        """Extend the leases `worker_id` holds on `shards`."""
+
+    @abstractmethod
+    def release(self, worker_id: str, shards: Sequence[int]) -> None:
+        """Give up the leases `worker_id` holds on `shards`."""
+
+    @abstractmethod
+    def enqueue(self, usernames: Iterable[str]) -> None:
+        """Add handles as pending; handles already in the frontier are left alone."""
+
+    @abstractmethod
+    def pending(self, shards: Sequence[int], limit: int) -> List[str]:
+        """Up to `limit` pending handles in `shards`, oldest first."""
+
+    @abstractmethod
+    def mark_owned(self, usernames: Sequence[str], state: str, worker_id: str, now: float) -> int:
+        """Set `state` on those `usernames` whose shard `worker_id` holds; returns how many."""
+
+    @abstractmethod
+    def progress(self, exact: bool = False) -> Dict[str, int]:
+        """Handle counts per state, across all workers.
+
+        Backends may return estimates unless `exact`; decisions such as
+        when to stop crawling need exact counts.
+        """
+
+    # -- coordination ----------------------------------------------------
+
+    def mark(self, usernames: Sequence[str], state: str, worker_id: str) -> int:
+        """Record a result for handles in shards `worker_id` still holds; returns how many.
+
+        Handles in shards whose lease lapsed are left to their new owner.
+        """
+        usernames = list(usernames)
+        if not usernames:
+            return 0
+        marked = self.mark_owned(usernames, state, worker_id, time.time())
+        if marked < len(usernames):
+            logger.warning("%s lost the lease on %d of %d handles it marked %s",
+                           worker_id, len(usernames) - marked, len(usernames), state)
+        return marked
+
+    def keep_alive(self, worker_id: str, lease_seconds: float) -> None:
+        """Heartbeat and renew the leases already held, without rebalancing."""
+        now = time.time()
+        self.heartbeat(worker_id, now + lease_seconds)
+        self.renew(worker_id, self.owned_shards(worker_id, now), now + lease_seconds)
+
+    def rebalance(self, worker_id: str, lease_seconds: float) -> List[int]:
+        """Heartbeat, then renew/release/acquire leases; returns the shards now held."""
+        now = time.time()
+        expires = now + lease_seconds
+        self.heartbeat(worker_id, expires)
+        fair_share = math.ceil(self.num_shards / max(self.live_workers(now), 1))
+
+        owned = sorted(self.owned_shards(worker_id, now))
+        if len(owned) > fair_share:
+            self.release(worker_id, owned[fair_share:])
+            owned = owned[:fair_share]
+        self.renew(worker_id, owned, expires)
+
+        for shard in self.free_shards(now):
+            if len(owned) >= fair_share:
+                break
+            if self.try_acquire(worker_id, shard, now, expires):
+                owned.append(shard)
+        return owned
+
+    def leave(self, worker_id: str) -> None:
+        """Release every shard and stop counting as live, so others take over at once."""
+        self.release(worker_id, self.owned_shards(worker_id, time.time()))
+        self.heartbeat(worker_id, 0.0)
+
+
+class SQLiteLeaseStore(LeaseStore):
+    def __init__(self, path: str, num_shards: int = 64):
+        """
+        Args:
+            path: Database file shared by the workers (created if missing)
+            num_shards: Shard count; ignored if the file already has shards
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript('''
+            create table if not exists crawl_frontier (
+                username text primary key,
+                shard integer not null,
+                state text not null default 'pending',
+                worker text,
+                updated_at real
+            );
+            create index if not exists crawl_frontier_shard_state on crawl_frontier (shard, state);
+            create table if not exists crawl_shards (
+                shard integer primary key,
+                owner text,
+                lease_expires real
+            );
+            create table if not exists crawl_workers (
+                worker_id text primary key,
+                expires real
+            );
+        ''')
+        self.conn.executemany('insert or ignore into crawl_shards (shard) values (?)',
+                              [(shard,) for shard in range(num_shards)])
+        self.num_shards = self.conn.execute('select count(*) from crawl_shards').fetchone()[0]
+
+    def heartbeat(self, worker_id, expires):
+        self.conn.execute('insert or replace into crawl_workers (worker_id, expires) values (?, ?)',
+                          (worker_id, expires))
+
+    def live_workers(self, now):
+        return self.conn.execute('select count(*) from crawl_workers where expires > ?', (now,)).fetchone()[0]
+
+    def owned_shards(self, worker_id, now):
+        rows = self.conn.execute('select shard from crawl_shards where owner = ? and lease_expires > ?',
+                                 (worker_id, now))
+        return [shard for shard, in rows]
+
+    def free_shards(self, now):
+        rows = self.conn.execute('select shard from crawl_shards where owner is null or lease_expires <= ? '
+                                 'order by shard', (now,))
+        return [shard for shard, in rows]
+
+    def try_acquire(self, worker_id, shard, now, expires):
+        cursor = self.conn.execute(
+            'update crawl_shards set owner = ?, lease_expires = ? '
+            'where shard = ? and (owner is null or lease_expires <= ? or owner = ?)',
+            (worker_id, expires, shard, now, worker_id))
+        return cursor.rowcount == 1
+
+    def renew(self, worker_id, shards, expires):
+        self.conn.executemany('update crawl_shards set lease_expires = ? where shard = ? and owner = ?',
+                              [(expires, shard, worker_id) for shard in shards])
+
+    def release(self, worker_id, shards):
+        self.conn.executemany('update crawl_shards set owner = null, lease_expires = null '
+                              'where shard = ? and owner = ?', [(shard, worker_id) for shard in shards])
+
+    def enqueue(self, usernames):
+        now = time.time()
+        self.conn.executemany(
+            'insert or ignore into crawl_frontier (username, shard, updated_at) values (?, ?, ?)',
+            [(username, shard_of(username, self.num_shards), now) for username in dict.fromkeys(usernames)])
+
+    def pending(self, shards, limit):
+        if not shards:
+            return []
+        marks = ','.join('?' * len(shards))
+        rows = self.conn.execute(
+            f"select username from crawl_frontier where state = 'pending' and shard in ({marks}) "
+            f"order by updated_at limit ?", (*shards, limit))
+        return [username for username, in rows]
+
+    def mark_owned(self, usernames, state, worker_id, now):
+        cursor = self.conn.executemany(
+            'update crawl_frontier set state = ?, worker = ?, updated_at = ? where username = ? and shard in '
+            '(select shard from crawl_shards where owner = ? and lease_expires > ?)',
+            [(state, worker_id, now, username, worker_id, now) for username in usernames])
+        return cursor.rowcount
+
+    def progress(self, exact=False):
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(self.conn.execute('select state, count(*) from crawl_frontier group by state'))
+        return counts
+
+
+class SupabaseLeaseStore(LeaseStore):
+    """LeaseStore on the tables in the module docstring.
+
+    PostgREST has no transactions, so leases are taken with conditional
+    updates: a row only comes back if the filter still matched.
+    """
+
+    def __init__(self, supabase, num_shards: int = 64):
+        self.supabase = supabase
+        with SUPABASE_LATENCY.time(table='crawl_shards', op='upsert'):
+            supabase.table('crawl_shards').upsert(
+                [{'shard': shard} for shard in range(num_shards)],
+                ignore_duplicates=True, on_conflict='shard', returning='minimal').execute()
+        with SUPABASE_LATENCY.time(table='crawl_shards', op='select'):
+            self.num_shards = supabase.table('crawl_shards').select('shard', count='exact').limit(1).execute().count
+
+    def heartbeat(self, worker_id, expires):
+        with SUPABASE_LATENCY.time(table='crawl_workers', op='upsert'):
+            self.supabase.table('crawl_workers').upsert(
+                {'worker_id': worker_id, 'expires': expires}, on_conflict='worker_id', returning='minimal').execute()
+
+    def live_workers(self, now):
+        with SUPABASE_LATENCY.time(table='crawl_workers', op='select'):
+            return self.supabase.table('crawl_workers').select('worker_id', count='exact') \
+                .gt('expires', now).limit(1).execute().count or 0
+
+    def owned_shards(self, worker_id, now):
+        with SUPABASE_LATENCY.time(table='crawl_shards', op='select'):
+            rows = self.supabase.table('crawl_shards').select('shard') \
+                .eq('owner', worker_id).gt('lease_expires', now).execute().data
+        return [row['shard'] for row in rows]
+
+    def free_shards(self, now):
+        with SUPABASE_LATENCY.time(table='crawl_shards', op='select'):
+            unowned = self.supabase.table('crawl_shards').select('shard').is_('owner', 'null').execute().data
+            expired = self.supabase.table('crawl_shards').select('shard').lte('lease_expires', now).execute().data
+        return sorted({row['shard'] for row in unowned + expired})
+
+    def try_acquire(self, worker_id, shard, now, expires):
+        changes = {'owner': worker_id, 'lease_expires': expires}
+        conditions = (lambda q: q.is_('owner', 'null'), lambda q: q.lte('lease_expires', now),
+                      lambda q: q.eq('owner', worker_id))
+        with SUPABASE_LATENCY.time(table='crawl_shards', op='update'):
+            for condition in conditions:
+                query = self.supabase.table('crawl_shards').update(changes).eq('shard', shard)
+                if condition(query).execute().data:
+                    return True
+        return False
+
+    def renew(self, worker_id, shards, expires):
+        if shards:
+            with SUPABASE_LATENCY.time(table='crawl_shards', op='update'):
+                self.supabase.table('crawl_shards').update({'lease_expires': expires}) \
+                    .eq('owner', worker_id).in_('shard', list(shards)).execute()
+
+    def release(self, worker_id, shards):
+        if shards:
+            with SUPABASE_LATENCY.time(table='crawl_shards', op='update'):
+                self.supabase.table('crawl_shards').update({'owner': None, 'lease_expires': None}) \
+                    .eq('owner', worker_id).in_('shard', list(shards)).execute()
+
+    def enqueue(self, usernames):
+        now = time.time()
+        rows = [{'username': username, 'shard': shard_of(username, self.num_shards),
+                 'state': 'pending', 'updated_at': now} for username in dict.fromkeys(usernames)]
+        if rows:
+            with SUPABASE_LATENCY.time(table='crawl_frontier', op='upsert'):
+                self.supabase.table('crawl_frontier').upsert(
+                    rows, ignore_duplicates=True, on_conflict='username', returning='minimal').execute()
+
+    def pending(self, shards, limit):
+        if not shards:
+            return []
+        with SUPABASE_LATENCY.time(table='crawl_frontier', op='select'):
+            rows = self.supabase.table('crawl_frontier').select('username') \
+                .eq('state', 'pending').in_('shard', list(shards)).order('updated_at').limit(limit).execute().data
+        return [row['username'] for row in rows]
+
+    def mark_owned(self, usernames, state, worker_id, now):
+        # No subqueries through PostgREST: filter on the shards held right now.
+        owned = self.owned_shards(worker_id, now)
+        if not owned:
+            return 0
+        with SUPABASE_LATENCY.time(table='crawl_frontier', op='update'):
+            rows = self.supabase.table('crawl_frontier').update(
+                {'state': state, 'worker': worker_id, 'updated_at': now}
+            ).in_('username', list(usernames)).in_('shard', owned).execute().data
+        return len(rows)
+
+    def progress(self, exact=False):
+        # Unless `exact`, planner estimates for large tables (exact below
+        # PostgREST's threshold), so a display polling this does not scan
+        # the frontier every time.
+        count = 'exact' if exact else 'estimated'
+        counts = {}
+        for state in STATES:
+            with SUPABASE_LATENCY.time(table='crawl_frontier', op='select'):
+                counts[state] = self.supabase.table('crawl_frontier').select('username', count=count) \
+                    .eq('state', state).limit(1).execute().count or 0
+        return counts
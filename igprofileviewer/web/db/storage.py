@@ -0,0 +1,518 @@
+# storage.py
+"""Storage backends for crawled data.
+
+`Storage` is the set of reads and writes the crawler and app need: profiles,
+posts, post media, relationship and follow edges, and crawl state. Two
+implementations:
+
+SupabaseStorage: the hosted database, through the PostgREST client.
+SQLiteStorage: an embedded database file in WAL mode. Writes are grouped
+    into one transaction per `commit_every` statements, and a timer commits
+    any transaction left open for `commit_interval` seconds, so a crawl runs
+    at local-disk speed; `flush()` commits early. The connection is opened
+    on first use in each process, so a storage created before a fork is
+    safe to use in the children. A local crawl can be pushed to Supabase
+    later in bulk.
+
+`get_storage()` returns the process-wide backend chosen by
+`STORAGE_BACKEND` ('supabase', the default, or 'sqlite').
+
+Settings:
+    STORAGE_SQLITE_PATH: the SQLite file (default igpv.sqlite3 in the data
+        directory)
+    IGPV_DATA_DIR: the data directory (default $XDG_DATA_HOME/igprofileviewer,
+        i.e. ~/.local/share/igprofileviewer)
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set
+
+from igprofileviewer.web.log import get_logger
+from igprofileviewer.web.metrics import SUPABASE_LATENCY
+
+logger = get_logger(__name__)
+
+# table -> (upsert conflict columns, JSON columns, boolean columns)
+TABLES = {
+    'profiles': (('username',), ('profile_data',), ('is_private', 'is_verified')),
+    'posts': (('shortcode',), ('location',), ()),
+    'post_media': (('post_id', 'media_order'), (), ()),
+    'profile_relationships': (('profile_id', 'related_profile_id', 'relationship_type'), (), ()),
+    'profile_follows': (('follower_username', 'following_username'), (), ()),
+}
+
+
+def data_dir() -> str:
+    """IGPV_DATA_DIR, or igprofileviewer under $XDG_DATA_HOME."""
+    if os.getenv('IGPV_DATA_DIR'):
+        return os.environ['IGPV_DATA_DIR']
+    base = os.getenv('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share')
+    return os.path.join(base, 'igprofileviewer')
+
+
+def default_sqlite_path() -> str:
+    return os.getenv('STORAGE_SQLITE_PATH') or os.path.join(data_dir(), 'igpv.sqlite3')
+
+
+class Storage(ABC):
+    """Backend interface. Rows are plain dicts keyed by column name."""
+
+    # Identifies the database, for local caches derived from it.
+    source: str = ''
+
+    @abstractmethod
+    def upsert_profile(self, profile: Dict[str, Any]) -> Optional[int]:
+        """Insert or update by username; returns the profile id."""
+
+    @abstractmethod
+    def upsert_post(self, post: Dict[str, Any]) -> Optional[int]:
+        """Insert or update by shortcode; returns the post id."""
+
+    @abstractmethod
+    def upsert_rows(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        """Bulk upsert into one of TABLES on its conflict columns."""
+
+    def upsert_media(self, media: List[Dict[str, Any]]) -> None:
+        self.upsert_rows('post_media', media)
+
+    def upsert_relationships(self, rows: List[Dict[str, Any]]) -> None:
+        self.upsert_rows('profile_relationships', rows)
+
+    def upsert_follows(self, rows: List[Dict[str, Any]]) -> None:
+        self.upsert_rows('profile_follows', rows)
+
+    @abstractmethod
+    def existing_usernames(self, usernames: Iterable[str]) -> Set[str]:
+        """The given usernames that have a row in profiles."""
+
+    @abstractmethod
+    def scan(self, table: str, columns: Sequence[str] = ('*',), after_id: int = 0, limit: int = 1000,
+             filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """One keyset page: up to `limit` rows with id > after_id, in id order."""
+
+    @abstractmethod
+    def scan_keyed(self, table: str, keys: Sequence[str], after: Optional[Sequence[Any]] = None,
+                   columns: Sequence[str] = ('*',), limit: int = 1000) -> List[Dict[str, Any]]:
+        """One keyset page on a composite key: up to `limit` rows with (keys) > after, in key order."""
+
+    @abstractmethod
+    def select_in(self, table: str, column: str, values: Iterable[Any],
+                  columns: Sequence[str] = ('*',)) -> List[Dict[str, Any]]:
+        """Rows whose `column` is one of `values`."""
+
+    @abstractmethod
+    def count(self, table: str) -> Optional[int]:
+        """Row count of `table`, or None if unknown."""
+
+    @abstractmethod
+    def load_crawl_state(self, name: str) -> Optional[Dict[str, Any]]:
+        """The state saved under `name`, or None."""
+
+    @abstractmethod
+    def save_crawl_state(self, name: str, state: Dict[str, Any]) -> None:
+        """Durably replace the state saved under `name`."""
+
+    @abstractmethod
+    def lease_store(self, num_shards: int = 64):
+        """A sharding.LeaseStore kept in this database."""
+
+    def flush(self) -> None:
+        """Make buffered writes durable."""
+
+
+class SupabaseStorage(Storage):
+    """Storage on the Supabase tables; crawl state needs one more, and media
+    upserts resolve on a key the original schema lacks:
+
+        create table crawl_state (
+            name text primary key,
+            state jsonb,
+            updated_at double precision
+        );
+        alter table post_media
+            add constraint post_media_post_id_media_order_key unique (post_id, media_order);
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.source = client.supabase_url
+
+    def upsert_profile(self, profile):
+        with SUPABASE_LATENCY.time(table='profiles', op='upsert'):
+            result = self.client.table('profiles').upsert(profile).execute()
+        return result.data[0]['id'] if result.data else None
+
+    def upsert_post(self, post):
+        with SUPABASE_LATENCY.time(table='posts', op='upsert'):
+            result = self.client.table('posts').upsert(post).execute()
+        return result.data[0]['id'] if result.data else None
+
+    def upsert_rows(self, table, rows):
+        if rows:
+            with SUPABASE_LATENCY.time(table=table, op='upsert'):
+                self.client.table(table).upsert(
+                    rows, on_conflict=','.join(TABLES[table][0]), returning='minimal').execute()
+
+    def existing_usernames(self, usernames):
+        usernames = list(usernames)
+        existing = set()
+        # Keep the query string well under URL length limits.
+        for i in range(0, len(usernames), 50):
+            with SUPABASE_LATENCY.time(table='profiles', op='select'):
+                rows = self.client.table('profiles').select('username') \
+                    .in_('username', usernames[i:i + 50]).execute().data
+            existing.update(row['username'] for row in rows)
+        return existing
+
+    def scan(self, table, columns=('*',), after_id=0, limit=1000, filters=None):
+        query = self.client.table(table).select(*columns).gt('id', after_id)
+        for column, value in (filters or {}).items():
+            query = query.eq(column, value)
+        with SUPABASE_LATENCY.time(table=table, op='select'):
+            return query.order('id').limit(limit).execute().data
+
+    def scan_keyed(self, table, keys, after=None, columns=('*',), limit=1000):
+        if after is None:
+            query = self.client.table(table).select(*columns).order(','.join(keys))
+            with SUPABASE_LATENCY.time(table=table, op='select'):
+                return query.limit(limit).execute().data
+        # PostgREST has no row comparison: walk (k0 = a0 and k1 > a1), then
+        # (k0 > a0), one query per key prefix until the page is full.
+        rows = []
+        for depth in range(len(keys) - 1, -1, -1):
+            query = self.client.table(table).select(*columns)
+            for key, value in zip(keys[:depth], after):
+                query = query.eq(key, value)
+            query = query.gt(keys[depth], after[depth]).order(','.join(keys[depth:]))
+            with SUPABASE_LATENCY.time(table=table, op='select'):
+                rows.extend(query.limit(limit - len(rows)).execute().data)
+            if len(rows) >= limit:
+                break
+        return rows
+
+    def select_in(self, table, column, values, columns=('*',)):
+        values = list(dict.fromkeys(values))
+        rows = []
+        for i in range(0, len(values), 50):
+            with SUPABASE_LATENCY.time(table=table, op='select'):
+                rows.extend(self.client.table(table).select(*columns).in_(column, values[i:i + 50]).execute().data)
+        return rows
+
+    def count(self, table):
+        with SUPABASE_LATENCY.time(table=table, op='select'):
+            return self.client.table(table).select('id', count='exact').limit(1).execute().count
+
+    def load_crawl_state(self, name):
+        with SUPABASE_LATENCY.time(table='crawl_state', op='select'):
+            rows = self.client.table('crawl_state').select('state').eq('name', name).execute().data
+        return rows[0]['state'] if rows else None
+
+    def save_crawl_state(self, name, state):
+        with SUPABASE_LATENCY.time(table='crawl_state', op='upsert'):
+            self.client.table('crawl_state').upsert(
+                {'name': name, 'state': state, 'updated_at': time.time()},
+                on_conflict='name', returning='minimal').execute()
+
+    def lease_store(self, num_shards=64):
+        from igprofileviewer.web.db.sharding import SupabaseLeaseStore
+        return SupabaseLeaseStore(self.client, num_shards=num_shards)
+
+
+SQLITE_SCHEMA = '''
+create table if not exists profiles (
+    id integer primary key,
+    username text not null unique,
+    full_name text,
+    biography text,
+    followers_count integer,
+    following_count integer,
+    is_private integer,
+    is_verified integer,
+    profile_data text,
+    last_updated text,
+    created_at text
+);
+create table if not exists posts (
+    id integer primary key,
+    profile_id integer references profiles (id),
+    username text,
+    type text,
+    shortcode text unique,
+    display_url text,
+    timestamp integer,
+    caption text,
+    likes_count integer,
+    location text,
+    created_at text
+);
+create index if not exists posts_profile_id on posts (profile_id);
+create index if not exists posts_username on posts (username);
+create table if not exists post_media (
+    id integer primary key,
+    post_id integer references posts (id),
+    username text,
+    type text,
+    display_url text,
+    media_order integer,
+    created_at text,
+    unique (post_id, media_order)
+);
+create table if not exists profile_relationships (
+    id integer primary key,
+    profile_id integer references profiles (id),
+    related_profile_id integer references profiles (id),
+    relationship_type text,
+    created_at text,
+    unique (profile_id, related_profile_id, relationship_type)
+);
+create index if not exists profile_relationships_related on profile_relationships (related_profile_id);
+create table if not exists profile_follows (
+    follower_username text not null,
+    following_username text not null,
+    created_at text,
+    primary key (follower_username, following_username)
+);
+create index if not exists profile_follows_following on profile_follows (following_username);
+create table if not exists crawl_state (
+    name text primary key,
+    state text,
+    updated_at real
+);
+'''
+
+
+class SQLiteStorage(Storage):
+    def __init__(self, path: str, commit_every: int = 500, commit_interval: float = 1.0):
+        """
+        Args:
+            path: Database file (created with the schema above if missing)
+            commit_every: Statements per write transaction
+            commit_interval: Longest a write may stay uncommitted, in seconds
+        """
+        self.path = path
+        self.source = f"sqlite:{os.path.abspath(path)}"
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        # Connections opened before a fork; never used or closed in this process.
+        self._inherited: List[sqlite3.Connection] = []
+        self._columns: Dict[str, List[str]] = {}
+        self._connect_lock = threading.Lock()
+        self._lock = threading.RLock()
+        self._pending = 0
+        self._timer: Optional[threading.Timer] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """This process's connection, opened on first use."""
+        if self._pid != os.getpid():
+            with self._connect_lock:
+                if self._pid != os.getpid():
+                    self._connect()
+        return self._conn
+
+    def _connect(self) -> None:
+        if self._conn is not None:
+            # Closing an inherited connection could disturb the parent's WAL.
+            self._inherited.append(self._conn)
+            self._pending = 0
+            self._timer = None
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # One connection per process, shared by the serving threads and the background loop.
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute('pragma journal_mode=wal')
+        # WAL plus synchronous=normal only risks the last commits on power loss.
+        conn.execute('pragma synchronous=normal')
+        conn.executescript(SQLITE_SCHEMA)
+        self._columns = {table: [row[1] for row in conn.execute(f'pragma table_info({table})')]
+                         for table in (*TABLES, 'crawl_state')}
+        self._conn = conn
+        self._pid = os.getpid()
+
+    # -- write batching ---------------------------------------------------
+
+    def _write(self, sql: str, params: Sequence[Any] = (), many: bool = False):
+        with self._lock:
+            if not self.conn.in_transaction:
+                self.conn.execute('begin')
+                # Commits an idle transaction even if no further write comes.
+                self._timer = threading.Timer(self.commit_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+            cursor = self.conn.executemany(sql, params) if many else self.conn.execute(sql, params)
+            result = cursor.fetchone() if not many and cursor.description else None
+            self._pending += 1
+            if self._pending >= self.commit_every:
+                self._commit()
+            return result
+
+    def _commit(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self.conn.in_transaction:
+            self.conn.execute('commit')
+        self._pending = 0
+
+    def flush(self):
+        with self._lock:
+            self._commit()
+
+    # -- row encoding -----------------------------------------------------
+
+    def _encode(self, table: str, row: Dict[str, Any], columns: List[str]) -> List[Any]:
+        json_columns = TABLES[table][1] if table in TABLES else ('state',)
+        values = []
+        for column in columns:
+            value = row.get(column)
+            if column in json_columns and value is not None and not isinstance(value, str):
+                value = json.dumps(value)
+            elif isinstance(value, (dict, list)):
+                value = json.dumps(value)
+            values.append(value)
+        return values
+
+    def _decode(self, table: str, row: Dict[str, Any]) -> Dict[str, Any]:
+        _, json_columns, bool_columns = TABLES[table]
+        decoded = dict(row)
+        for column in json_columns:
+            if isinstance(decoded.get(column), str):
+                try:
+                    decoded[column] = json.loads(decoded[column])
+                except ValueError:
+                    pass
+        for column in bool_columns:
+            if decoded.get(column) is not None:
+                decoded[column] = bool(decoded[column])
+        return decoded
+
+    def _upsert_sql(self, table: str, columns: List[str], returning: bool = False) -> str:
+        keys = TABLES[table][0]
+        updates = ', '.join(f"{c} = excluded.{c}" for c in columns if c not in keys and c != 'id')
+        sql = (f"insert into {table} ({', '.join(columns)}) values ({', '.join('?' * len(columns))}) "
+               f"on conflict ({', '.join(keys)}) do " + (f"update set {updates}" if updates else 'nothing'))
+        if returning:
+            sql += " returning id"
+        return sql
+
+    def _columns_of(self, table: str, rows: Iterable[Dict[str, Any]]) -> List[str]:
+        present = set().union(*rows)
+        self.conn  # reads the table columns on first use
+        return [column for column in self._columns[table] if column in present]
+
+    # -- Storage ----------------------------------------------------------
+
+    def _upsert_one(self, table: str, row: Dict[str, Any]) -> Optional[int]:
+        columns = self._columns_of(table, [row])
+        result = self._write(self._upsert_sql(table, columns, returning=True), self._encode(table, row, columns))
+        if result is not None:
+            return result[0]
+        # "do nothing" returns no row; look the id up instead.
+        keys = TABLES[table][0]
+        with self._lock:
+            found = self.conn.execute(f"select id from {table} where " + ' and '.join(f"{k} = ?" for k in keys),
+                                      [row.get(k) for k in keys]).fetchone()
+        return found[0] if found else None
+
+    def upsert_profile(self, profile):
+        return self._upsert_one('profiles', profile)
+
+    def upsert_post(self, post):
+        return self._upsert_one('posts', post)
+
+    def upsert_rows(self, table, rows):
+        # Group by column set so every statement in an executemany matches.
+        groups: Dict[tuple, List[Dict[str, Any]]] = {}
+        for row in rows:
+            groups.setdefault(tuple(self._columns_of(table, [row])), []).append(row)
+        for columns, group in groups.items():
+            self._write(self._upsert_sql(table, list(columns)),
+                        [self._encode(table, row, list(columns)) for row in group], many=True)
+
+    def existing_usernames(self, usernames):
+        usernames = list(usernames)
+        existing = set()
+        with self._lock:
+            for i in range(0, len(usernames), 500):
+                chunk = usernames[i:i + 500]
+                rows = self.conn.execute(
+                    f"select username from profiles where username in ({', '.join('?' * len(chunk))})", chunk)
+                existing.update(username for username, in rows)
+        return existing
+
+    def scan(self, table, columns=('*',), after_id=0, limit=1000, filters=None):
+        filters = filters or {}
+        where = ''.join(f" and {column} = ?" for column in filters)
+        with self._lock:
+            cursor = self.conn.execute(
+                f"select {', '.join(columns)} from {table} where id > ?{where} order by id limit ?",
+                [after_id, *filters.values(), limit])
+            names = [description[0] for description in cursor.description]
+            return [self._decode(table, dict(zip(names, row))) for row in cursor]
+
+    def scan_keyed(self, table, keys, after=None, columns=('*',), limit=1000):
+        where = f"where ({', '.join(keys)}) > ({', '.join('?' * len(keys))}) " if after is not None else ''
+        with self._lock:
+            cursor = self.conn.execute(
+                f"select {', '.join(columns)} from {table} {where}order by {', '.join(keys)} limit ?",
+                [*(after or ()), limit])
+            names = [description[0] for description in cursor.description]
+            return [self._decode(table, dict(zip(names, row))) for row in cursor]
+
+    def select_in(self, table, column, values, columns=('*',)):
+        values = list(dict.fromkeys(values))
+        rows = []
+        with self._lock:
+            for i in range(0, len(values), 500):
+                chunk = values[i:i + 500]
+                cursor = self.conn.execute(
+                    f"select {', '.join(columns)} from {table} where {column} in ({', '.join('?' * len(chunk))})",
+                    chunk)
+                names = [description[0] for description in cursor.description]
+                rows.extend(self._decode(table, dict(zip(names, row))) for row in cursor)
+        return rows
+
+    def count(self, table):
+        with self._lock:
+            return self.conn.execute(f"select count(*) from {table}").fetchone()[0]
+
+    def load_crawl_state(self, name):
+        with self._lock:
+            row = self.conn.execute('select state from crawl_state where name = ?', (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_crawl_state(self, name, state):
+        self._write('insert or replace into crawl_state (name, state, updated_at) values (?, ?, ?)',
+                    (name, json.dumps(state), time.time()))
+        self.flush()
+
+    def lease_store(self, num_shards=64):
+        from igprofileviewer.web.db.sharding import SQLiteLeaseStore
+        return SQLiteLeaseStore(self.path, num_shards=num_shards)
+
+
+_default: Optional[Storage] = None
+_default_lock = threading.Lock()
+
+
+def get_storage() -> Storage:
+    """The process-wide backend selected by STORAGE_BACKEND, created on first use."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            backend = os.getenv('STORAGE_BACKEND', 'supabase')
+            if backend == 'sqlite':
+                _default = SQLiteStorage(default_sqlite_path())
+            elif backend == 'supabase':
+                from igprofileviewer.web.db.supabase import init_supabase
+                _default = SupabaseStorage(init_supabase())
+            else:
+                raise ValueError(f"STORAGE_BACKEND must be 'supabase' or 'sqlite', got {backend!r}")
+            logger.info("Using %s storage", backend)
+        return _default
@@ -1,5 +1,11 @@
 # Add this to the top of your supabase.py file
 
+import logging
+
+from igprofileviewer.web.log import get_logger
+
+logger = get_logger(__name__)
+
 def init_supabase():
     """
     Initialize Supabase client with extensive debugging
@@ -8,59 +14,53 @@ def init_supabase():
     import sys
     from supabase import __version__ as supabase_version
     
-    # Print environment information
-    print(f"Python version: {sys.version}")
-    print(f"Supabase package version: {supabase_version}")
+    # Log environment information
+    logger.debug("Python version: %s", sys.version)
+    logger.debug("Supabase package version: %s", supabase_version)
     
     url = os.getenv("SUPABASE_URL")
     key = os.getenv("SUPABASE_KEY")
     
     # Check environment variables
     if not url:
-        print("ERROR: SUPABASE_URL environment variable is not set")
+        logger.error("SUPABASE_URL environment variable is not set")
     else:
-        # Print partial URL for debugging without exposing full URL
-        print(f"SUPABASE_URL is set (starts with {url[:10]}...)")
+        # Log partial URL for debugging without exposing full URL
+        logger.debug("SUPABASE_URL is set (starts with %s...)", url[:10])
         
     if not key:
-        print("ERROR: SUPABASE_KEY environment variable is not set")
+        logger.error("SUPABASE_KEY environment variable is not set")
     else:
-        print("SUPABASE_KEY is set (not shown for security)")
+        logger.debug("SUPABASE_KEY is set (not shown for security)")
     
     if not url or not key:
         raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
     
+    # postgrest-py logs every request through httpx at INFO, which floods the
+    # crawler's output; keep those to warnings and above.
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    
     # Try direct import first
     try:
-        print("Attempting to import Client directly from supabase.client...")
+        logger.debug("Attempting to import Client directly from supabase.client...")
         from supabase.client import Client
-        print("Successfully imported Client class")
 
-        # Try to see the signature of the Client constructor
-        import inspect
-        print(f"Client.__init__ signature: {inspect.signature(Client.__init__)}")
-        
         # Create client directly
-        print("Creating client directly with Client class...")
         client = Client(url, key)
-        print("Successfully created client directly with Client class")
+        logger.debug("Successfully created client directly with Client class")
         return client
     except Exception as e:
-        print(f"Error creating client directly: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.warning("Error creating client directly: %s: %s", type(e).__name__, e, exc_info=True)
     
     # Try with create_client as fallback
     try:
-        print("Attempting to use create_client...")
+        logger.debug("Attempting to use create_client...")
         from supabase import create_client
         client = create_client(url, key)
-        print("Successfully created client with create_client")
+        logger.debug("Successfully created client with create_client")
         return client
     except Exception as e:
-        print(f"Error using create_client: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.error("Error using create_client: %s: %s", type(e).__name__, e, exc_info=True)
         raise
 
 def process_profile_for_display(profile_data, supabase):
@@ -173,7 +173,7 @@ def process_posts(user_data, profile_id, supabase_client):
                         'username': user_data.get('username'),
                         'created_at': datetime.datetime.now().isoformat()
                     }
-                    supabase_client.table('post_media').upsert(media_record).execute()
+                    supabase_client.table('post_media').upsert(media_record, on_conflict='post_id,media_order').execute()
                     
         except Exception as e:
             print(f"Error saving post {shortcode}: {e}")
@@ -195,7 +195,7 @@ def process_post_media(node_data, post_id, username, supabase_client):
         }
         
         try:
-            supabase_client.table('post_media').upsert(media_record).execute()
+            supabase_client.table('post_media').upsert(media_record, on_conflict='post_id,media_order').execute()
         except Exception as e:
             print(f"Error saving media for post {post_id}, order {i}: {e}")
 
@@ -0,0 +1,280 @@
+# image_cache.py
+"""Local disk cache for proxied Instagram images, plus prewarming.
+
+`/image-proxy` serves from this cache when it can. Once a profile payload is
+in hand (page view or crawl), `prewarm()` downloads its profile picture,
+grid images and first carousel frames with bounded parallelism, so the
+browser's follow-up proxy requests never reach the CDN.
+
+Concurrent downloads of one URL are merged: whichever caller starts first
+(a prewarm, an async or a blocking /image-proxy request, on any thread or
+event loop) fetches and caches the image, and the others wait for it.
+
+Settings: `IMAGE_CACHE_DIR`, `IMAGE_CACHE_MAX_BYTES` (default 512MB),
+`IMAGE_CACHE_TTL` seconds (default 7 days).
+"""
+
+import asyncio
+import concurrent.futures
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+import requests
+
+from igprofileviewer.web.log import get_logger
+from igprofileviewer.web.metrics import API_CALLS, CACHE_REQUESTS
+from igprofileviewer.web.resilience import DeadlineExceeded, bounded_get, call, call_async, upstream
+
+logger = get_logger(__name__)
+
+# Use custom headers to bypass restrictions
+IMAGE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
+    'Referer': 'https://www.instagram.com/',
+}
+
+
+class ImageCache:
+    # Check the size bound every this many writes rather than on each one.
+    PRUNE_EVERY = 100
+
+    def __init__(self, directory: str, max_bytes: int = 512 * 1024 * 1024, ttl: float = 7 * 24 * 3600):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _path(self, url: str) -> Path:
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return self.directory / key[:2] / key
+
+    def get(self, url: str, stale: bool = False) -> Optional[Tuple[bytes, str]]:
+        """Return (content, content_type) for a fresh cached image, else None.
+
+        stale=True also returns expired images, for when the CDN is unreachable.
+        """
+        path = self._path(url)
+        try:
+            age = time.time() - path.stat().st_mtime
+            if age > self.ttl and not stale:
+                raise FileNotFoundError
+            raw = path.read_bytes()
+        except OSError:
+            CACHE_REQUESTS.inc(cache='image', result='miss')
+            return None
+        # File layout: content type, newline, image bytes.
+        content_type, _, content = raw.partition(b'\n')
+        CACHE_REQUESTS.inc(cache='image', result='hit' if age <= self.ttl else 'stale')
+        return content, content_type.decode('ascii')
+
+    def contains(self, url: str) -> bool:
+        try:
+            return time.time() - self._path(url).stat().st_mtime <= self.ttl
+        except OSError:
+            return False
+
+    def put(self, url: str, content: bytes, content_type: str = 'image/jpeg') -> None:
+        path = self._path(url)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write to a temp file and rename so readers never see a partial image.
+            fd, tmp = tempfile.mkstemp(dir=path.parent)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content_type.encode('ascii', 'replace') + b'\n' + content)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning("Failed to cache image %s: %s", url, e)
+            return
+
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self.PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    def prune(self) -> None:
+        """Delete the oldest images until the cache fits in max_bytes."""
+        files = []
+        total = 0
+        for path in self.directory.glob('*/*'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                pass
+
+
+image_cache = ImageCache(
+    os.getenv('IMAGE_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'igpv-images'),
+    max_bytes=int(os.getenv('IMAGE_CACHE_MAX_BYTES', str(512 * 1024 * 1024))),
+    ttl=float(os.getenv('IMAGE_CACHE_TTL', str(7 * 24 * 3600))),
+)
+
+
+class InFlight:
+    """Downloads in progress, by URL, shared across threads and event loops."""
+
+    def __init__(self):
+        self._futures: Dict[str, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+
+    def claim(self, url: str) -> Tuple[concurrent.futures.Future, bool]:
+        """The future for `url`, and whether the caller must download it and settle the future."""
+        with self._lock:
+            future = self._futures.get(url)
+            if future is not None:
+                return future, False
+            future = self._futures[url] = concurrent.futures.Future()
+            return future, True
+
+    def settle(self, url: str, future: concurrent.futures.Future, result=None,
+               error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            self._futures.pop(url, None)
+        if isinstance(error, Exception):
+            future.set_exception(error)
+        elif error is not None:
+            # The downloader was cancelled; that must not cancel the waiters too.
+            future.set_exception(ConnectionError(f"download of {url} was interrupted"))
+        else:
+            future.set_result(result)
+
+
+in_flight = InFlight()
+
+
+def profile_image_urls(profile_data, carousel_frames: int = 1, max_posts: int = 18) -> List[str]:
+    """Image URLs the profile page will request through /image-proxy.
+
+    Mirrors templates/profile.html: the profile picture, each grid post,
+    and the first `carousel_frames` slides of each carousel. The page
+    lazy-loads the later slides. A sidecar with a single child is shown by
+    the post's own display_url, as a plain image.
+    """
+    user = profile_data.get('data', {}).get('user', {}) or {}
+    urls = []
+    if user.get('profile_pic_url_hd') or user.get('profile_pic_url'):
+        urls.append(user.get('profile_pic_url_hd') or user.get('profile_pic_url'))
+
+    for edge in user.get('edge_owner_to_timeline_media', {}).get('edges', [])[:max_posts]:
+        node = edge.get('node', {})
+        children = node.get('edge_sidecar_to_children', {}).get('edges', [])
+        if node.get('__typename') == 'GraphSidecar' and len(children) > 1:
+            urls.extend(child.get('node', {}).get('display_url') for child in children[:carousel_frames])
+        else:
+            urls.append(node.get('display_url'))
+
+    # Keep order, drop blanks and duplicates.
+    return list(dict.fromkeys(url for url in urls if url))
+
+
+async def fetch_image(session: aiohttp.ClientSession, url: str) -> Tuple[bytes, str]:
+    """Download one image from the CDN and store it in the cache, or wait for a download in flight."""
+    future, owner = in_flight.claim(url)
+    if not owner:
+        return await asyncio.wrap_future(future)
+    try:
+        result = await _fetch_image(session, url)
+    except BaseException as e:
+        in_flight.settle(url, future, error=e)
+        raise
+    in_flight.settle(url, future, result)
+    return result
+
+
+async def _fetch_image(session: aiohttp.ClientSession, url: str) -> Tuple[bytes, str]:
+    async def fetch(timeout):
+        async with session.get(url, headers=IMAGE_HEADERS, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            response.raise_for_status()
+            return await response.read(), response.headers.get('Content-Type', 'image/jpeg')
+
+    try:
+        content, content_type = await call_async('image', fetch)
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        API_CALLS.inc(endpoint='image', outcome='error')
+        raise
+    API_CALLS.inc(endpoint='image', outcome='ok')
+    await asyncio.to_thread(image_cache.put, url, content, content_type)
+    return content, content_type
+
+
+def download_image(url: str) -> Tuple[bytes, str]:
+    """Blocking fetch_image, for the WSGI /image-proxy.
+
+    Raises:
+        requests.RequestException: If the CDN request fails
+        resilience.DeadlineExceeded: If the CDN (or a download in flight) did not answer in time
+        resilience.CircuitOpen: If the CDN is failing and was not called
+    """
+    future, owner = in_flight.claim(url)
+    if not owner:
+        deadline = upstream('image').deadline
+        try:
+            return future.result(timeout=deadline)
+        except concurrent.futures.TimeoutError:
+            raise DeadlineExceeded('image', deadline) from None
+
+    def fetch(timeout):
+        response = bounded_get(url, timeout, headers=IMAGE_HEADERS)
+        response.raise_for_status()
+        return response.content, response.headers.get('Content-Type', 'image/jpeg')
+
+    try:
+        content, content_type = call('image', fetch)
+    except BaseException as e:
+        if isinstance(e, (requests.RequestException, DeadlineExceeded)):
+            API_CALLS.inc(endpoint='image', outcome='error')
+        in_flight.settle(url, future, error=e)
+        raise
+    API_CALLS.inc(endpoint='image', outcome='ok')
+    image_cache.put(url, content, content_type)
+    in_flight.settle(url, future, (content, content_type))
+    return content, content_type
+
+
+async def prewarm(urls: Iterable[str], session: Optional[aiohttp.ClientSession] = None,
+                  concurrency: int = 8) -> int:
+    """Download every uncached url, at most `concurrency` at a time.
+
+    Returns the number of images fetched. Failures are logged and skipped.
+    """
+    urls = list(urls)
+    pending = await asyncio.to_thread(lambda: [url for url in urls if not image_cache.contains(url)])
+    if not pending:
+        return 0
+
+    semaphore = asyncio.Semaphore(concurrency)
+    fetched = 0
+
+    async def warm(client, url):
+        nonlocal fetched
+        async with semaphore:
+            try:
+                await fetch_image(client, url)
+                fetched += 1
+            except Exception as e:
+                logger.debug("Prewarm failed for %s: %s", url, e)
+
+    if session is not None:
+        await asyncio.gather(*(warm(session, url) for url in pending))
+    else:
+        async with aiohttp.ClientSession() as own_session:
+            await asyncio.gather(*(warm(own_session, url) for url in pending))
+    return fetched
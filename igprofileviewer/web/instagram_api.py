@@ -1,8 +1,36 @@
 import os
+import asyncio
+import aiohttp
 import requests
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, AsyncIterator, Iterator, List, Tuple
 import logging
 from datetime import datetime
+from igprofileviewer.web.log import configure_logging
+from igprofileviewer.web.metrics import API_CALLS
+from igprofileviewer.web.resilience import DeadlineExceeded, bounded_get, call, call_async
+
+# Override to point the client at a different ScrapeCreators deployment
+# (e.g. the local stand-in used by the benchmark suite).
+BASE_URL = os.getenv("SCRAPECREATORS_BASE_URL", "https://api.scrapecreators.com/v1/instagram")
+
+def parse_following_page(data: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Extract (users, next_cursor) from one page of a following response.
+
+    Accepts both the flat shape (`users` plus `next_max_id`/`next_cursor`)
+    and the GraphQL shape (`data.user.edge_follow` with `page_info`).
+    next_cursor is None on the last page.
+    """
+    if 'users' in data:
+        users = data.get('users') or []
+        cursor = data.get('next_max_id') or data.get('next_cursor') or data.get('cursor')
+        if data.get('has_more') is False or data.get('big_list') is False:
+            cursor = None
+    else:
+        edge_follow = data.get('data', {}).get('user', {}).get('edge_follow', {})
+        users = [edge.get('node', {}) for edge in edge_follow.get('edges', [])]
+        page_info = edge_follow.get('page_info', {})
+        cursor = page_info.get('end_cursor') if page_info.get('has_next_page') else None
+    return [user for user in users if user.get('username')], cursor or None
 
 class InstagramAPI:
     def __init__(self, api_key: Optional[str] = None):
@@ -16,16 +44,19 @@ class InstagramAPI:
         if not self.api_key:
             raise ValueError("API key must be provided or set in INSTAGRAM_API_KEY environment variable")
             
-        self.base_url = "https://api.scrapecreators.com/v1/instagram"
+        self.base_url = BASE_URL
         self.headers = {
             "x-api-key": self.api_key,
             "Accept": "application/json"
         }
         
-        # Configure logging
-        logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
 
+    def _get_json(self, url: str, params: Dict[str, str], timeout: float) -> Dict[str, Any]:
+        response = bounded_get(url, timeout, headers=self.headers, params=params)
+        response.raise_for_status()
+        return response.json()
+
     def get_profile(self, username: str) -> Dict[str, Any]:
         """Fetch Instagram profile data for a given username.
         
@@ -37,55 +68,134 @@ class InstagramAPI:
             
         Raises:
             requests.RequestException: If API request fails
+            resilience.DeadlineExceeded: If the API did not answer in time
+            resilience.CircuitOpen: If the API is failing and was not called
         """
         try:
             url = f"{self.base_url}/profile"
             params = {"handle": username}
             
-            response = requests.get(
-                url,
-                headers=self.headers,
-                params=params
-            )
-            response.raise_for_status()
+            data = call('profile', lambda timeout: self._get_json(url, params, timeout))
+            API_CALLS.inc(endpoint='profile', outcome='ok')
             
-            return response.json()
+            return data
             
-        except requests.RequestException as e:
+        except (requests.RequestException, DeadlineExceeded) as e:
+            API_CALLS.inc(endpoint='profile', outcome='error')
             self.logger.error(f"Error fetching profile for {username}: {str(e)}")
             raise
 
-    def get_following(self, username: str) -> Dict[str, Any]:
+    def get_following(self, username: str, cursor: Optional[str] = None) -> Dict[str, Any]:
         """Fetch users that a given Instagram user is following.
         
         Args:
             username (str): Instagram username to fetch following list for
+            cursor (str, optional): Page cursor returned with the previous page
             
         Returns:
             dict: Following data if successful
             
         Raises:
             requests.RequestException: If API request fails
+            resilience.DeadlineExceeded: If the API did not answer in time
+            resilience.CircuitOpen: If the API is failing and was not called
         """
         try:
             url = f"{self.base_url}/user/following"
             params = {"handle": username}
+            if cursor:
+                params["cursor"] = cursor
             
-            response = requests.get(
-                url,
-                headers=self.headers,
-                params=params
-            )
-            response.raise_for_status()
+            data = call('following', lambda timeout: self._get_json(url, params, timeout))
+            API_CALLS.inc(endpoint='following', outcome='ok')
             
-            return response.json()
+            return data
             
-        except requests.RequestException as e:
+        except (requests.RequestException, DeadlineExceeded) as e:
+            API_CALLS.inc(endpoint='following', outcome='error')
             self.logger.error(f"Error fetching following list for {username}: {str(e)}")
             raise
 
+    def iter_following(self, username: str, cursor: Optional[str] = None) -> Iterator[Tuple[List[Dict[str, Any]], Optional[str]]]:
+        """Page through a following list, yielding (users, next_cursor) per page.
+        
+        Only one page is held at a time. Pass a saved next_cursor as `cursor`
+        to resume after the page it came from.
+        """
+        while True:
+            users, cursor = parse_following_page(self.get_following(username, cursor))
+            yield users, cursor
+            if not cursor:
+                return
+
+class AsyncInstagramAPI:
+    """aiohttp counterpart of InstagramAPI for the ASGI serving mode.
+
+    The caller owns `session`, so one connection pool is shared by every
+    request served from the event loop.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, api_key: Optional[str] = None):
+        self.session = session
+        self.api_key = api_key or os.getenv("INSTAGRAM_API_KEY")
+        if not self.api_key:
+            raise ValueError("API key must be provided or set in INSTAGRAM_API_KEY environment variable")
+
+        self.base_url = BASE_URL
+        self.headers = {
+            "x-api-key": self.api_key,
+            "Accept": "application/json"
+        }
+        self.logger = logging.getLogger(__name__)
+
+    async def _get_json(self, url: str, params: Dict[str, str], timeout: float) -> Dict[str, Any]:
+        async with self.session.get(url, headers=self.headers, params=params,
+                                    timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def get_profile(self, username: str) -> Dict[str, Any]:
+        """Fetch Instagram profile data for a given username.
+
+        Raises:
+            aiohttp.ClientError: If API request fails
+            asyncio.TimeoutError: If it timed out
+            resilience.CircuitOpen: If the API is failing and was not called
+        """
+        try:
+            data = await call_async('profile', lambda timeout: self._get_json(
+                f"{self.base_url}/profile", {"handle": username}, timeout))
+            API_CALLS.inc(endpoint='profile', outcome='ok')
+            return data
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            API_CALLS.inc(endpoint='profile', outcome='error')
+            self.logger.error(f"Error fetching profile for {username}: {str(e)}")
+            raise
+
+    async def iter_following(self, username: str, cursor: Optional[str] = None) -> AsyncIterator[Tuple[List[Dict[str, Any]], Optional[str]]]:
+        """Async InstagramAPI.iter_following."""
+        while True:
+            params = {"handle": username}
+            if cursor:
+                params["cursor"] = cursor
+            try:
+                data = await call_async('following', lambda timeout: self._get_json(
+                    f"{self.base_url}/user/following", params, timeout))
+                API_CALLS.inc(endpoint='following', outcome='ok')
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                API_CALLS.inc(endpoint='following', outcome='error')
+                self.logger.error(f"Error fetching following list for {username}: {str(e)}")
+                raise
+
+            users, cursor = parse_following_page(data)
+            yield users, cursor
+            if not cursor:
+                return
+
 def main():
     """Example usage of the InstagramAPI class."""
+    configure_logging()
     try:
         # Initialize API client
         api = InstagramAPI()
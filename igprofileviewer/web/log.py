@@ -0,0 +1,68 @@
+# log.py
+"""Leveled logging with per-call-site rate limiting.
+
+Hot loops (post writes, batch progress) used to `print()` on every
+iteration. `get_logger()` returns a standard logger whose records are
+throttled per call site, so a tight loop emits at most `burst` records per
+`interval` seconds and reports how many it dropped on the next emit.
+
+Entry points (the web app, the crawler and the CLIs) call
+`configure_logging()`, which installs a stderr handler at `LOG_LEVEL`
+(default INFO) unless the host (e.g. Gunicorn) already configured one.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Dict, Tuple
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, interval: float = 5.0, burst: int = 5):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self._lock = threading.Lock()
+        # call site -> [window start, emitted in window, suppressed]
+        self._sites: Dict[Tuple[str, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # Warnings and errors are always let through.
+        if record.levelno >= logging.WARNING:
+            return True
+
+        site = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            state = self._sites.setdefault(site, [now, 0, 0])
+            if now - state[0] >= self.interval:
+                suppressed = state[2]
+                state[:] = [now, 0, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+            if state[1] >= self.burst:
+                state[2] += 1
+                return False
+            state[1] += 1
+            return True
+
+
+_filter = RateLimitFilter()
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Return the named logger with the shared rate limiter attached."""
+    logger = logging.getLogger(name)
+    if _filter not in logger.filters:
+        logger.addFilter(_filter)
+    return logger
+
+
+def configure_logging(level: str = None) -> None:
+    """Send records at `level` (default LOG_LEVEL, else INFO) and above to stderr.
+
+    Does nothing if the root logger already has handlers.
+    """
+    level = (level or os.getenv('LOG_LEVEL') or 'INFO').upper()
+    logging.basicConfig(level=level, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
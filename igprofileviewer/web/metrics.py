@@ -0,0 +1,210 @@
+# metrics.py
+"""In-process metrics with Prometheus text exposition.
+
+Counters, gauges and histograms are kept per worker process and rendered in
+the Prometheus 0.0.4 text format by `render()`, which backs the `/metrics`
+endpoint in app.py.
+"""
+
+import math
+import threading
+from abc import ABC, abstractmethod
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Tuple
+
+from igprofileviewer.web.profiling import record_stage
+
+# Latency buckets in seconds, tuned for network calls (5ms .. 30s).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Size buckets in bytes (1KB .. 10MB).
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 10485760)
+
+_registry: List['_Metric'] = []
+_registry_lock = threading.Lock()
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric(ABC):
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """The metric's sample lines in the text format."""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, stage=None):
+        super().__init__(name, documentation, labelnames)
+        # Timings from time() are also reported as this Server-Timing stage.
+        self.stage = stage
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # key -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of the `with` block, even if it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe(elapsed, **labels)
+            if self.stage:
+                record_stage(self.stage, elapsed)
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return int(state[-1]) if state else 0
+
+    def _samples(self):
+        lines = []
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for key, state in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, state):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(cumulative)}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(state[-1])}")
+        return lines
+
+
+def render() -> str:
+    """Render every registered metric in the Prometheus text format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upstream (ScrapeCreators, Instagram oEmbed, Instagram CDN)
+UPSTREAM_LATENCY = Histogram(
+    'igpv_upstream_request_seconds', 'Latency of upstream HTTP calls.', ['endpoint'], stage='upstream')
+API_CALLS = Counter(
+    'igpv_upstream_requests_total', 'Upstream HTTP calls by endpoint and outcome.', ['endpoint', 'outcome'])
+HEDGED_REQUESTS = Counter(
+    'igpv_upstream_hedged_total', 'Hedged upstream requests by endpoint and outcome (sent/won).',
+    ['endpoint', 'outcome'])
+CIRCUIT_STATE = Gauge(
+    'igpv_circuit_state', 'Upstream circuit breaker state (0 closed, 1 half-open, 2 open).', ['endpoint'])
+CIRCUIT_TRANSITIONS = Counter(
+    'igpv_circuit_transitions_total', 'Circuit breaker state changes by endpoint and new state.',
+    ['endpoint', 'state'])
+
+# Supabase / PostgREST
+SUPABASE_LATENCY = Histogram(
+    'igpv_supabase_request_seconds', 'Latency of Supabase calls.', ['table', 'op'], stage='supabase')
+
+# Image proxy
+IMAGE_PROXY_LATENCY = Histogram(
+    'igpv_image_proxy_seconds', 'Time to serve an /image-proxy request.')
+IMAGE_PROXY_BYTES = Histogram(
+    'igpv_image_proxy_bytes', 'Size of images served by /image-proxy.', buckets=SIZE_BUCKETS)
+
+# Rendering
+RENDER_TIME = Histogram(
+    'igpv_render_seconds', 'Jinja template render time.', ['template'], stage='render')
+
+# Caches
+CACHE_REQUESTS = Counter(
+    'igpv_cache_requests_total', 'Cache lookups by cache and result (hit/miss).', ['cache', 'result'])
+
+# Crawler
+CRAWL_PROFILES = Counter(
+    'igpv_crawl_profiles_total', 'Profiles handled by the crawler by outcome.', ['outcome'])
+CRAWL_POSTS = Counter(
+    'igpv_crawl_posts_total', 'Posts written by the crawler by outcome.', ['outcome'])
+FOLLOW_EDGES = Counter(
+    'igpv_follow_edges_total', 'Follow edges written by following-graph ingestion.')
+QUEUE_DEPTH = Gauge(
+    'igpv_crawl_queue_depth', 'Usernames waiting in the crawl frontier.')
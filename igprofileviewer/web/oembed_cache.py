@@ -0,0 +1,231 @@
+# oembed_cache.py
+"""Persistent shortcode-keyed cache of Instagram oEmbed responses.
+
+oEmbed HTML for a post practically never changes, so entries live for
+`OEMBED_CACHE_TTL` seconds (default 30 days). Posts the API reports as
+missing are cached too, for `OEMBED_NEGATIVE_TTL` (default 1 day), so
+repeated requests for a deleted post do not go upstream either. Entries are
+small JSON files under `OEMBED_CACHE_DIR`.
+
+`prefetch()` calls the API as its own `oembed_prefetch` upstream (see
+resilience.py), with its own timeout and circuit breaker and no hedging.
+A burst of throttled prefetches then cannot open the breaker that
+`/embed` requests go through.
+"""
+
+import asyncio
+import json
+import os
+import re
+import tempfile
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+import aiohttp
+import requests
+
+from igprofileviewer.web.log import get_logger
+from igprofileviewer.web.metrics import API_CALLS, CACHE_REQUESTS
+from igprofileviewer.web.resilience import (
+    CircuitOpen, DeadlineExceeded, bounded_get, call, call_async, is_upstream_failure,
+)
+
+logger = get_logger(__name__)
+
+OEMBED_URL = os.getenv("INSTAGRAM_OEMBED_URL", "https://api.instagram.com/oembed/")
+
+# Instagram shortcodes are URL-safe base64.
+SHORTCODE_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# Upstream statuses that mean the post is gone. Others, such as a 400 from a
+# bad or expired token, are errors and are not cached.
+MISSING_STATUSES = (404, 410)
+
+# Upstream endpoint name for background prefetches.
+PREFETCH_ENDPOINT = 'oembed_prefetch'
+
+
+class PostNotFound(Exception):
+    """The oEmbed API reported the post as missing (possibly from the negative cache)."""
+
+
+def oembed_params(shortcode: str) -> dict:
+    return {'url': f"https://www.instagram.com/p/{shortcode}/", 'omitscript': 'true'}
+
+
+class OEmbedCache:
+    def __init__(self, directory: str, ttl: float = 30 * 24 * 3600, negative_ttl: float = 24 * 3600):
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+    def _path(self, shortcode: str) -> Path:
+        return self.directory / shortcode[:2] / f"{shortcode}.json"
+
+    def get(self, shortcode: str, stale: bool = False) -> Optional[dict]:
+        """Return the fresh entry for `shortcode` ({'html': ...} or {'missing': True}), else None.
+
+        stale=True also returns expired entries, for when Instagram is unreachable.
+        """
+        try:
+            entry = json.loads(self._path(shortcode).read_text())
+        except (OSError, ValueError):
+            entry = None
+        result = 'hit' if entry is not None else 'miss'
+        if entry is not None:
+            ttl = self.negative_ttl if entry.get('missing') else self.ttl
+            if time.time() - entry.get('fetched_at', 0) > ttl:
+                entry, result = (entry, 'stale') if stale else (None, 'miss')
+        CACHE_REQUESTS.inc(cache='oembed', result=result)
+        return entry
+
+    def contains(self, shortcode: str) -> bool:
+        """Whether a fresh entry exists; unlike get() this is not counted as a cache lookup."""
+        try:
+            entry = json.loads(self._path(shortcode).read_text())
+        except (OSError, ValueError):
+            return False
+        ttl = self.negative_ttl if entry.get('missing') else self.ttl
+        return time.time() - entry.get('fetched_at', 0) <= ttl
+
+    def put(self, shortcode: str, html: Optional[str]) -> dict:
+        """Store `html`, or a negative entry when `html` is None."""
+        entry = {'html': html, 'fetched_at': time.time()} if html is not None else \
+            {'missing': True, 'fetched_at': time.time()}
+        path = self._path(shortcode)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.parent)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning("Failed to cache oEmbed for %s: %s", shortcode, e)
+        return entry
+
+
+oembed_cache = OEmbedCache(
+    os.getenv('OEMBED_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'igpv-oembed'),
+    ttl=float(os.getenv('OEMBED_CACHE_TTL', str(30 * 24 * 3600))),
+    negative_ttl=float(os.getenv('OEMBED_NEGATIVE_TTL', str(24 * 3600))),
+)
+
+
+def _html_or_raise(entry: dict) -> str:
+    if entry.get('missing'):
+        raise PostNotFound()
+    return entry['html']
+
+
+def get_embed_html(shortcode: str) -> str:
+    """oEmbed HTML for `shortcode`, from the cache or (blocking) from Instagram.
+
+    Raises:
+        PostNotFound: If the post does not exist
+        requests.RequestException: If the API request fails
+        resilience.DeadlineExceeded: If the API did not answer in time
+        resilience.CircuitOpen: If the API is failing and nothing is cached
+    """
+    entry = oembed_cache.get(shortcode)
+    if entry is None:
+        def fetch(timeout):
+            response = bounded_get(OEMBED_URL, timeout, params=oembed_params(shortcode))
+            if response.status_code in MISSING_STATUSES:
+                return None
+            response.raise_for_status()
+            return response.json()['html']
+
+        try:
+            html = call('oembed', fetch)
+        except (requests.RequestException, DeadlineExceeded) as e:
+            API_CALLS.inc(endpoint='oembed', outcome='error')
+            entry = _stale_or_raise(shortcode, e)
+        except CircuitOpen as e:
+            entry = _stale_or_raise(shortcode, e)
+        else:
+            API_CALLS.inc(endpoint='oembed', outcome='ok')
+            entry = oembed_cache.put(shortcode, html)
+    return _html_or_raise(entry)
+
+
+def _stale_or_raise(shortcode: str, error: Exception) -> dict:
+    """An expired entry to serve while Instagram is failing; otherwise re-raise `error`."""
+    entry = oembed_cache.get(shortcode, stale=True) if is_upstream_failure(error) else None
+    if entry is None:
+        raise error
+    logger.info("Serving stale oEmbed for %s: %s", shortcode, error)
+    return entry
+
+
+async def fetch_embed_html(session: aiohttp.ClientSession, shortcode: str) -> str:
+    """Async get_embed_html.
+
+    Raises:
+        PostNotFound: If the post does not exist
+        aiohttp.ClientError: If the API request fails
+        resilience.CircuitOpen: If the API is failing and nothing is cached
+    """
+    entry = oembed_cache.get(shortcode)
+    if entry is None:
+        try:
+            entry = await _fetch_entry(session, shortcode)
+        except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpen) as e:
+            entry = _stale_or_raise(shortcode, e)
+    return _html_or_raise(entry)
+
+
+async def _fetch_entry(session: aiohttp.ClientSession, shortcode: str, endpoint: str = 'oembed') -> dict:
+    """Fetch `shortcode` from Instagram and store the result, bypassing the cache lookup."""
+    async def fetch(timeout):
+        async with session.get(OEMBED_URL, params=oembed_params(shortcode),
+                               timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            if response.status in MISSING_STATUSES:
+                return None
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+            return data['html']
+
+    try:
+        html = await call_async(endpoint, fetch)
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        API_CALLS.inc(endpoint=endpoint, outcome='error')
+        raise
+    API_CALLS.inc(endpoint=endpoint, outcome='ok')
+    return oembed_cache.put(shortcode, html)
+
+
+async def prefetch(shortcodes: Iterable[str], session: Optional[aiohttp.ClientSession] = None,
+                   concurrency: int = 4) -> int:
+    """Fill the cache for every uncached shortcode; returns how many were fetched."""
+    pending = [sc for sc in dict.fromkeys(shortcodes)
+               if sc and SHORTCODE_RE.match(sc) and not oembed_cache.contains(sc)]
+    if not pending:
+        return 0
+
+    semaphore = asyncio.Semaphore(concurrency)
+    fetched = 0
+
+    async def fill(client, shortcode):
+        nonlocal fetched
+        async with semaphore:
+            try:
+                await _fetch_entry(client, shortcode, endpoint=PREFETCH_ENDPOINT)
+            except Exception as e:
+                logger.debug("oEmbed prefetch failed for %s: %s", shortcode, e)
+                return
+            fetched += 1
+
+    if session is not None:
+        await asyncio.gather(*(fill(session, sc) for sc in pending))
+    else:
+        async with aiohttp.ClientSession() as own_session:
+            await asyncio.gather(*(fill(own_session, sc) for sc in pending))
+    return fetched
+
+
+def profile_shortcodes(profile_data) -> list:
+    """Shortcodes of the posts in a profile payload."""
+    user = profile_data.get('data', {}).get('user', {}) or {}
+    edges = user.get('edge_owner_to_timeline_media', {}).get('edges', [])
+    return [edge.get('node', {}).get('shortcode') for edge in edges if edge.get('node', {}).get('shortcode')]
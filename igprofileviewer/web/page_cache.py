@@ -0,0 +1,103 @@
+# page_cache.py
+"""Rendered profile page cache.
+
+Pages are keyed by (username, digest of the normalized profile), so a
+changed profile can never be served from a stale entry. The digest doubles
+as a strong ETag, letting repeat visitors revalidate with If-None-Match and
+get a 304 without the page being rendered at all.
+
+The cache is per process and bounded by total HTML size
+(`PAGE_CACHE_MAX_BYTES`, default 32MB), evicting least recently used pages.
+The crawler calls `invalidate()` when it writes a newer version of a
+profile.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+
+from igprofileviewer.web.metrics import CACHE_REQUESTS
+
+_TEMPLATE_DIR = Path(__file__).resolve().parent / 'templates'
+
+
+def _template_fingerprint() -> bytes:
+    """Hash of the templates, so ETags change when a deploy changes the markup."""
+    h = hashlib.sha256()
+    for path in sorted(_TEMPLATE_DIR.glob('*.html')):
+        h.update(path.name.encode('utf-8'))
+        h.update(path.read_bytes())
+    return h.digest()
+
+
+_FINGERPRINT = _template_fingerprint()
+
+
+def profile_digest(profile: dict) -> str:
+    """Content digest of a normalized profile (as built by process_profile_for_display)."""
+    h = hashlib.sha256(_FINGERPRINT)
+    h.update(json.dumps(profile, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8'))
+    return h.hexdigest()[:32]
+
+
+class PageCache:
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._pages: 'OrderedDict[Tuple[str, str], bytes]' = OrderedDict()
+        self._by_username: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, username: str, digest: str) -> Optional[bytes]:
+        key = (username.lower(), digest)
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+        CACHE_REQUESTS.inc(cache='page', result='hit' if page is not None else 'miss')
+        return page
+
+    def put(self, username: str, digest: str, page: bytes) -> None:
+        if len(page) > self.max_bytes:
+            return
+        key = (username.lower(), digest)
+        with self._lock:
+            if key in self._pages:
+                self._remove(key)
+            self._pages[key] = page
+            self._by_username.setdefault(key[0], set()).add(digest)
+            self.size += len(page)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._pages)))
+
+    def invalidate(self, username: str) -> None:
+        """Drop every cached page for `username`."""
+        username = username.lower()
+        with self._lock:
+            for digest in list(self._by_username.get(username, ())):
+                self._remove((username, digest))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pages.clear()
+            self._by_username.clear()
+            self.size = 0
+
+    def _remove(self, key: Tuple[str, str]) -> None:
+        page = self._pages.pop(key)
+        self.size -= len(page)
+        digests = self._by_username.get(key[0])
+        if digests is not None:
+            digests.discard(key[1])
+            if not digests:
+                del self._by_username[key[0]]
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+
+page_cache = PageCache(int(os.getenv('PAGE_CACHE_MAX_BYTES', str(32 * 1024 * 1024))))
@@ -0,0 +1,230 @@
+# profiling.py
+"""Opt-in request and crawl profiling.
+
+A request is profiled when it carries `X-Profile: <PROFILE_TOKEN>` or when it
+is picked by `PROFILE_SAMPLE_RATE` (0.0-1.0). Profiled requests get a
+`Server-Timing` header with per-stage durations (upstream, supabase,
+normalize, render) and leave a profile in `PROFILE_DIR`:
+
+- `sample` mode (default): a wall-clock stack sampler writing collapsed
+  stacks (`.folded`), loadable by flamegraph.pl and speedscope.
+- `cprofile` mode: deterministic cProfile output (`.prof`), loadable by
+  snakeviz or flameprof.
+
+Only the newest `PROFILE_KEEP` files are kept.
+"""
+
+import contextvars
+import cProfile
+import hmac
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional
+
+from igprofileviewer.web.log import get_logger
+
+logger = get_logger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_MODE_HEADER = 'X-Profile-Mode'
+MODES = ('sample', 'cprofile')
+
+# Per-request (or per-crawl) stage durations in seconds; None when not profiling.
+_stage_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    'igpv_stage_timings', default=None)
+
+
+def record_stage(name: str, seconds: float) -> None:
+    """Add `seconds` to stage `name` if the current request is being profiled."""
+    timings = _stage_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name: str):
+    """Time the `with` block as stage `name` of the current profile."""
+    if _stage_timings.get() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def server_timing(timings: Dict[str, float], total: Optional[float] = None) -> str:
+    """Format stage timings as a Server-Timing header value (milliseconds).
+
+    Stages that run concurrently (e.g. parallel post writes) are summed, so
+    a stage can exceed the request's wall-clock total.
+    """
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in sorted(timings.items())]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack at a fixed interval from a helper thread."""
+
+    suffix = '.folded'
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = 0.005):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{Path(code.co_filename).stem}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._sample, name='igpv-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: Path) -> None:
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class DeterministicProfiler:
+    """cProfile wrapper with the same start/stop/write interface as SamplingProfiler."""
+
+    suffix = '.prof'
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+
+    def start(self) -> None:
+        self._profile.enable()
+
+    def stop(self) -> None:
+        self._profile.disable()
+
+    def write(self, path: Path) -> None:
+        self._profile.dump_stats(str(path))
+
+
+class ProfileSession:
+    """One profiled unit of work: a profiler plus its stage timings."""
+
+    def __init__(self, name: str, mode: str = 'sample', directory: Optional[str] = None,
+                 keep: Optional[int] = None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode {mode!r}; expected one of {MODES}")
+        self.name = name
+        self.mode = mode
+        self.directory = Path(directory or os.getenv('PROFILE_DIR') or
+                              Path(tempfile.gettempdir()) / 'igpv-profiles')
+        self.keep = keep if keep is not None else int(os.getenv('PROFILE_KEEP', '50'))
+        self.timings: Dict[str, float] = {}
+        self.path: Optional[Path] = None
+        self.elapsed = 0.0
+        self._profiler = SamplingProfiler() if mode == 'sample' else DeterministicProfiler()
+        self._token = None
+        self._started = None
+
+    def start(self) -> 'ProfileSession':
+        self._token = _stage_timings.set(self.timings)
+        self._started = time.perf_counter()
+        self._profiler.start()
+        return self
+
+    def stop(self) -> Optional[Path]:
+        self._profiler.stop()
+        self.elapsed = time.perf_counter() - self._started
+        _stage_timings.reset(self._token)
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            safe_name = "".join(c if c.isalnum() or c in '-_.' else '_' for c in self.name)[:80]
+            self.path = self.directory / f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{safe_name}{self._profiler.suffix}"
+            self._profiler.write(self.path)
+            self._rotate()
+        except OSError as e:
+            logger.warning("Failed to write profile for %s: %s", self.name, e)
+            self.path = None
+        return self.path
+
+    def _rotate(self) -> None:
+        files = sorted((p for p in self.directory.iterdir() if p.suffix in ('.folded', '.prof')),
+                       key=lambda p: p.stat().st_mtime)
+        for old in files[:max(len(files) - self.keep, 0)]:
+            try:
+                old.unlink()
+            except OSError:
+                pass
+
+    def server_timing(self) -> str:
+        return server_timing(self.timings, self.elapsed)
+
+    def __enter__(self) -> 'ProfileSession':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def should_profile(headers) -> bool:
+    """Decide whether a request opts in via the auth header or the sample rate."""
+    token = os.getenv('PROFILE_TOKEN')
+    supplied = headers.get(PROFILE_HEADER)
+    if token and supplied and hmac.compare_digest(token, supplied):
+        return True
+    rate = float(os.getenv('PROFILE_SAMPLE_RATE', '0') or 0)
+    return rate > 0 and random.random() < rate
+
+
+def init_app(app) -> None:
+    """Register request hooks that profile opted-in requests."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_profile():
+        if not should_profile(request.headers):
+            return
+        mode = request.headers.get(PROFILE_MODE_HEADER) or os.getenv('PROFILE_MODE', 'sample')
+        if mode not in MODES:
+            mode = 'sample'
+        g.profile_session = ProfileSession(f"{request.method}-{request.path}", mode=mode).start()
+
+    @app.after_request
+    def _finish_profile(response):
+        session = g.pop('profile_session', None)
+        if session is None:
+            return response
+        path = session.stop()
+        response.headers['Server-Timing'] = session.server_timing()
+        if path:
+            response.headers['X-Profile-File'] = path.name
+        return response
+
+    @app.teardown_request
+    def _abandon_profile(exc):
+        # after_request does not run when the view raised; still stop the profiler.
+        session = g.pop('profile_session', None)
+        if session is not None:
+            session.stop()
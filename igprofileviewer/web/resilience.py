@@ -0,0 +1,416 @@
+# resilience.py
+"""Timeouts, hedged requests and circuit breakers for upstream calls.
+
+Every call to ScrapeCreators, the Instagram CDN and oEmbed goes through
+`call()` (blocking) or `call_async()` under an endpoint name. The request
+itself is a callable taking the timeout to use:
+
+    data = call('profile', lambda timeout: bounded_get(url, timeout).json())
+
+- Each call, every attempt and hedge included, must finish within the
+  endpoint's deadline, or it raises `DeadlineExceeded`. Each attempt gets
+  the lesser of the endpoint's timeout and the time left. Blocking
+  attempts run on a thread pool (`UPSTREAM_THREADS`), so the deadline holds
+  even when a response trickles in under `requests`' per-read timeout.
+  The caller moves on, but the attempt's thread stays busy until the
+  request ends. Blocking requests should therefore use `bounded_get()`,
+  which stops reading once the attempt's timeout has passed; otherwise a
+  trickling upstream can tie up every thread in the pool.
+- For endpoints in `UPSTREAM_HEDGE`, a second identical request is sent if
+  the first has not answered within the endpoint's recent p95 latency, or
+  fails outright; whichever succeeds first wins. Hedges are capped at
+  `UPSTREAM_HEDGE_BUDGET` of recent calls, so a uniformly slow upstream does
+  not get twice the traffic.
+- A circuit breaker per endpoint opens when at least
+  `BREAKER_ERROR_RATE` of the last `BREAKER_WINDOW` calls failed. While it
+  is open, calls raise `CircuitOpen` at once and callers fall back to cached
+  or stored data. After `BREAKER_COOLDOWN` seconds a single trial call is
+  let through (half-open); its outcome closes or reopens the breaker.
+
+Timeouts, connection errors, 5xx and 429 count as failures. Other 4xx
+responses (an unknown username, a deleted post) do not, and neither do
+responses that fail to parse. `UPSTREAM_LATENCY` observes each admitted
+call, so rejected calls do not show up as near-zero latencies. State is per
+worker process.
+
+Settings: `UPSTREAM_TIMEOUT_<ENDPOINT>` (seconds; PROFILE, FOLLOWING, IMAGE,
+OEMBED, OEMBED_PREFETCH), `UPSTREAM_DEADLINE_<ENDPOINT>` (seconds; default the timeout),
+`UPSTREAM_THREADS` (default 32), `UPSTREAM_HEDGE` (comma-separated endpoints, default
+profile,image,oembed), `UPSTREAM_HEDGE_BUDGET` (default 0.1),
+`BREAKER_WINDOW` (default 20), `BREAKER_ERROR_RATE` (default 0.5),
+`BREAKER_COOLDOWN` (default 30).
+"""
+
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import requests
+
+from igprofileviewer.web.log import get_logger
+from igprofileviewer.web.metrics import (
+    API_CALLS, CIRCUIT_STATE, CIRCUIT_TRANSITIONS, HEDGED_REQUESTS, UPSTREAM_LATENCY,
+)
+
+logger = get_logger(__name__)
+
+T = TypeVar('T')
+
+DEFAULT_TIMEOUTS = {
+    'profile': 20.0,
+    'following': 20.0,
+    'image': 10.0,
+    'oembed': float(os.getenv('OEMBED_TIMEOUT', '10')),
+    'oembed_prefetch': float(os.getenv('OEMBED_TIMEOUT', '10')),
+}
+# The crawler-only following endpoint favours throughput over tail latency.
+HEDGED_ENDPOINTS = set(filter(None, os.getenv('UPSTREAM_HEDGE', 'profile,image,oembed').split(',')))
+HEDGE_BUDGET = float(os.getenv('UPSTREAM_HEDGE_BUDGET', '0.1'))
+# p95 is not trusted (and slow attempts are not hedged) until this many samples.
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.05
+
+BREAKER_WINDOW = int(os.getenv('BREAKER_WINDOW', '20'))
+BREAKER_ERROR_RATE = float(os.getenv('BREAKER_ERROR_RATE', '0.5'))
+BREAKER_COOLDOWN = float(os.getenv('BREAKER_COOLDOWN', '30'))
+
+# A response that does not parse is a problem with that response, not the upstream.
+PARSE_ERRORS = (ValueError, LookupError, TypeError)
+
+BODY_CHUNK_SIZE = 64 * 1024
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(Exception):
+    """The endpoint's circuit breaker is open; the call was not attempted."""
+
+    def __init__(self, endpoint: str, retry_after: float):
+        super().__init__(f"{endpoint} upstream is unavailable; retry in {retry_after:.0f}s")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(TimeoutError):
+    """No attempt answered within the endpoint's deadline."""
+
+    def __init__(self, endpoint: str, deadline: float):
+        super().__init__(f"{endpoint} upstream did not answer within {deadline:.0f}s")
+        self.endpoint = endpoint
+        self.deadline = deadline
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """Whether `error` means the upstream is unhealthy, rather than that the request was bad."""
+    if isinstance(error, (CircuitOpen, DeadlineExceeded)):
+        return True
+    if isinstance(error, PARSE_ERRORS):
+        return False
+    # aiohttp.ClientResponseError has .status, requests.HTTPError has .response.
+    status = getattr(error, 'status', None)
+    response = getattr(error, 'response', None)
+    if status is None and response is not None:
+        status = getattr(response, 'status_code', None)
+    if not isinstance(status, int):
+        return True
+    return status >= 500 or status == 429
+
+
+class CircuitBreaker:
+    def __init__(self, endpoint: str, window: int = 20, error_rate: float = 0.5,
+                 cooldown: float = 30.0, min_calls: Optional[int] = None):
+        """
+        Args:
+            endpoint: Name used in logs and metric labels
+            window: Number of recent calls the error rate is computed over
+            error_rate: Fraction of failed calls in the window that opens the breaker
+            cooldown: Seconds to stay open before letting a trial call through
+            min_calls: Calls needed in the window before it can open (default window / 2)
+        """
+        self.endpoint = endpoint
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.min_calls = min_calls if min_calls is not None else max(window // 2, 1)
+        self.state = CLOSED
+        self._results = deque(maxlen=window)
+        self._opened_at = 0.0
+        # Start time of the half-open trial call, if one is in flight.
+        self._trial_started: Optional[float] = None
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.set(_STATE_VALUES[CLOSED], endpoint=endpoint)
+
+    def retry_after(self) -> float:
+        """Seconds until a call may be let through again (0 when closed)."""
+        if self.state == OPEN:
+            return max(self.cooldown - (time.monotonic() - self._opened_at), 0.0)
+        return 1.0 if self.state == HALF_OPEN else 0.0
+
+    def allow(self) -> None:
+        """Admit one call, or raise CircuitOpen."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now - self._opened_at < self.cooldown:
+                    raise CircuitOpen(self.endpoint, self.retry_after())
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                # A trial whose caller went away (e.g. was cancelled) expires after a cooldown.
+                if self._trial_started is not None and now - self._trial_started < self.cooldown:
+                    raise CircuitOpen(self.endpoint, self.retry_after())
+                self._trial_started = now
+
+    def record(self, ok: bool) -> None:
+        """Record the outcome of a call admitted by allow()."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._trial_started = None
+                self._transition(CLOSED if ok else OPEN)
+                return
+            if self.state == OPEN:
+                # A call that started before the breaker opened.
+                return
+            self._results.append(ok)
+            failures = self._results.count(False)
+            if len(self._results) >= self.min_calls and failures >= self.error_rate * len(self._results):
+                self._transition(OPEN)
+
+    def _transition(self, state: str) -> None:
+        previous, self.state = self.state, state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            logger.warning("Circuit for %s upstream opened (was %s); failing fast for %.0fs",
+                           self.endpoint, previous, self.cooldown)
+        else:
+            logger.info("Circuit for %s upstream is now %s (was %s)", self.endpoint, state, previous)
+        if state == CLOSED:
+            self._results.clear()
+        CIRCUIT_STATE.set(_STATE_VALUES[state], endpoint=self.endpoint)
+        CIRCUIT_TRANSITIONS.inc(endpoint=self.endpoint, state=state)
+
+
+class Upstream:
+    """Timeout, recent latencies, hedging policy and circuit breaker of one endpoint."""
+
+    def __init__(self, name: str, timeout: float, hedge: bool = False, breaker: Optional[CircuitBreaker] = None,
+                 samples: int = 200, deadline: Optional[float] = None):
+        self.name = name
+        self.timeout = timeout
+        # Total seconds per call, across attempts.
+        self.deadline = deadline if deadline is not None else timeout
+        self.hedge = hedge
+        self.breaker = breaker or CircuitBreaker(name)
+        # Durations of recent successful attempts, for the hedge delay.
+        self._latencies = deque(maxlen=samples)
+        # Whether each recent call sent a hedge, for the hedge budget.
+        self._hedged = deque(maxlen=samples)
+        self._lock = threading.Lock()
+
+    def p95(self) -> Optional[float]:
+        with self._lock:
+            if len(self._latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging a slow attempt; None to only hedge failed ones."""
+        p95 = self.p95()
+        return None if p95 is None else min(max(p95, HEDGE_MIN_DELAY), self.timeout)
+
+    def _may_hedge(self, deadline: float) -> bool:
+        if not self.hedge or self.breaker.state != CLOSED or deadline - time.monotonic() < HEDGE_MIN_DELAY:
+            return False
+        with self._lock:
+            return sum(self._hedged) < HEDGE_BUDGET * max(len(self._hedged), HEDGE_MIN_SAMPLES)
+
+    def _finished(self, hedged: bool) -> None:
+        with self._lock:
+            self._hedged.append(hedged)
+
+    def _observe(self, started: float) -> None:
+        with self._lock:
+            self._latencies.append(time.perf_counter() - started)
+
+    def _attempt_timeout(self, deadline: float) -> float:
+        timeout = min(self.timeout, deadline - time.monotonic())
+        if timeout <= 0:
+            raise DeadlineExceeded(self.name, self.deadline)
+        return timeout
+
+    def attempt(self, fn: Callable[[float], T], deadline: float) -> T:
+        timeout = self._attempt_timeout(deadline)
+        started = time.perf_counter()
+        result = fn(timeout)
+        self._observe(started)
+        return result
+
+    async def attempt_async(self, fn: Callable[[float], Awaitable[T]], deadline: float) -> T:
+        timeout = self._attempt_timeout(deadline)
+        started = time.perf_counter()
+        # wait_for bounds the whole attempt even if fn ignores its timeout argument.
+        result = await asyncio.wait_for(fn(timeout), timeout)
+        self._observe(started)
+        return result
+
+    def _admit(self) -> None:
+        try:
+            self.breaker.allow()
+        except CircuitOpen:
+            API_CALLS.inc(endpoint=self.name, outcome='rejected')
+            raise
+
+    def _should_hedge(self, hedged: bool, done, error: Optional[BaseException], deadline: float) -> bool:
+        """Hedge once: when the first attempt is slow, or has failed because of the upstream."""
+        if hedged or not self._may_hedge(deadline):
+            return False
+        return not done or (error is not None and is_upstream_failure(error))
+
+    def _wait_time(self, hedged: bool, deadline: float) -> float:
+        """How long to wait for the attempts in flight: until the hedge delay or the deadline."""
+        remaining = max(deadline - time.monotonic(), 0.0)
+        delay = None if hedged or not self.hedge else self.hedge_delay()
+        return remaining if delay is None else min(delay, remaining)
+
+    def call(self, fn: Callable[[float], T]) -> T:
+        """Blocking call with a deadline, hedging and the circuit breaker."""
+        self._admit()
+        deadline = time.monotonic() + self.deadline
+        executor = _attempt_executor()
+        primary = executor.submit(self.attempt, fn, deadline)
+        pending = {primary}
+        hedged = False
+        error: Optional[BaseException] = None
+        try:
+            with UPSTREAM_LATENCY.time(endpoint=self.name):
+                while pending:
+                    if time.monotonic() >= deadline:
+                        error = DeadlineExceeded(self.name, self.deadline)
+                        break
+                    done, pending = concurrent.futures.wait(
+                        pending, timeout=self._wait_time(hedged, deadline),
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        if future.exception() is None:
+                            if future is not primary:
+                                HEDGED_REQUESTS.inc(endpoint=self.name, outcome='won')
+                            self.breaker.record(True)
+                            return future.result()
+                        error = future.exception()
+                    if self._should_hedge(hedged, done, error, deadline):
+                        hedged = True
+                        HEDGED_REQUESTS.inc(endpoint=self.name, outcome='sent')
+                        pending.add(executor.submit(self.attempt, fn, deadline))
+            self.breaker.record(not is_upstream_failure(error))
+            raise error
+        finally:
+            # An attempt still running cannot be interrupted; it is abandoned.
+            # Through bounded_get() it gives up about one read after its timeout.
+            self._finished(hedged)
+
+    async def call_async(self, fn: Callable[[float], Awaitable[T]]) -> T:
+        """Async call(); the losing attempt of a hedged pair is cancelled."""
+        self._admit()
+        deadline = time.monotonic() + self.deadline
+        primary = asyncio.ensure_future(self.attempt_async(fn, deadline))
+        pending = {primary}
+        hedged = False
+        error: Optional[BaseException] = None
+        try:
+            with UPSTREAM_LATENCY.time(endpoint=self.name):
+                while pending:
+                    if time.monotonic() >= deadline:
+                        error = DeadlineExceeded(self.name, self.deadline)
+                        break
+                    done, pending = await asyncio.wait(pending, timeout=self._wait_time(hedged, deadline),
+                                                       return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None:
+                            if task is not primary:
+                                HEDGED_REQUESTS.inc(endpoint=self.name, outcome='won')
+                            self.breaker.record(True)
+                            return task.result()
+                        error = task.exception()
+                    if self._should_hedge(hedged, done, error, deadline):
+                        hedged = True
+                        HEDGED_REQUESTS.inc(endpoint=self.name, outcome='sent')
+                        pending.add(asyncio.ensure_future(self.attempt_async(fn, deadline)))
+            self.breaker.record(not is_upstream_failure(error))
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+            self._finished(hedged)
+
+
+_upstreams: Dict[str, Upstream] = {}
+_upstreams_lock = threading.Lock()
+_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+
+def _attempt_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _executor
+    with _upstreams_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=int(os.getenv('UPSTREAM_THREADS', '32')), thread_name_prefix='upstream')
+        return _executor
+
+
+def upstream(name: str) -> Upstream:
+    """The per-process Upstream for endpoint `name`, configured from the environment."""
+    with _upstreams_lock:
+        if name not in _upstreams:
+            timeout = float(os.getenv(f'UPSTREAM_TIMEOUT_{name.upper()}', str(DEFAULT_TIMEOUTS.get(name, 10.0))))
+            deadline = float(os.getenv(f'UPSTREAM_DEADLINE_{name.upper()}', str(timeout)))
+            breaker = CircuitBreaker(name, window=BREAKER_WINDOW, error_rate=BREAKER_ERROR_RATE,
+                                     cooldown=BREAKER_COOLDOWN)
+            _upstreams[name] = Upstream(name, timeout, hedge=name in HEDGED_ENDPOINTS, breaker=breaker,
+                                        deadline=deadline)
+        return _upstreams[name]
+
+
+def bounded_get(url: str, timeout: float, **kwargs) -> requests.Response:
+    """requests.get whose whole response must arrive within about `timeout` seconds.
+
+    `requests` applies its timeout to the connect and to each read, so a
+    body trickling in a few bytes at a time never times out. This reads the
+    body itself and raises `requests.Timeout` (closing the connection) at
+    the first chunk after `timeout`.
+    """
+    started = time.monotonic()
+    response = requests.get(url, stream=True, timeout=timeout, **kwargs)
+    chunks = []
+    try:
+        for chunk in response.iter_content(BODY_CHUNK_SIZE):
+            if time.monotonic() - started > timeout:
+                raise requests.Timeout(f"{url} did not finish within {timeout:.1f}s")
+            chunks.append(chunk)
+    except BaseException:
+        response.close()
+        raise
+    # What response.content would have read, so .content and .json() work as usual.
+    response._content = b''.join(chunks)
+    return response
+
+
+def call(endpoint: str, fn: Callable[[float], T]) -> T:
+    """Run the blocking request `fn(timeout)` against `endpoint` (see module docstring)."""
+    return upstream(endpoint).call(fn)
+
+
+async def call_async(endpoint: str, fn: Callable[[float], Awaitable[T]]) -> T:
+    """Run the request coroutine `fn(timeout)` against `endpoint` (see module docstring)."""
+    return await upstream(endpoint).call_async(fn)
+
+
+async def wait_until_available(endpoint: str) -> None:
+    """Sleep while `endpoint`'s breaker is open, e.g. to pause a crawl during an outage."""
+    breaker = upstream(endpoint).breaker
+    while breaker.state == OPEN and (delay := breaker.retry_after()) > 0:
+        logger.info("%s upstream unavailable; pausing %.0fs", endpoint, delay)
+        await asyncio.sleep(delay)
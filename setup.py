@@ -11,6 +11,7 @@ setup(
         'gunicorn==21.2.0',
         'supabase==2.3.1',
         'asgiref==3.7.2',
+        'uvicorn==0.23.2',
         'aiohttp==3.8.5',
         'typing-extensions==4.7.1',
     ],
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from igprofileviewer.web import asgi
+from igprofileviewer.web.image_cache import ImageCache
+
+
+def get(path, query=''):
+    """Drive the ASGI app through one GET; returns (status, headers, body)."""
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'root_path': '', 'query_string': query.encode('ascii'), 'headers': [],
+        'server': ('testserver', 80), 'client': ('127.0.0.1', 50000),
+    }
+    asyncio.run(asgi.app(scope, receive, send))
+    start = messages[0]
+    headers = {k.decode('latin1'): v.decode('latin1') for k, v in start['headers']}
+    body = b''.join(m.get('body', b'') for m in messages if m['type'] == 'http.response.body')
+    return start['status'], headers, body
+
+
+@pytest.fixture
+def images(monkeypatch, tmp_path):
+    cache = ImageCache(str(tmp_path / 'images'))
+    monkeypatch.setattr(asgi, 'image_cache', cache)
+    return cache
+
+
+def test_image_proxy_needs_a_url():
+    status, _, body = get('/image-proxy')
+    assert status == 400
+    assert body == b'No URL provided'
+
+
+def test_image_proxy_serves_cached_images(images):
+    images.put('http://cdn.test/img/a.jpg', b'JPEG', 'image/jpeg')
+
+    status, headers, body = get('/image-proxy', 'url=http://cdn.test/img/a.jpg')
+    assert status == 200
+    assert body == b'JPEG'
+    assert headers['content-type'] == 'image/jpeg'
+    assert headers['content-disposition'] == 'inline; filename="a.jpg"'
+
+
+def test_embed_rejects_bad_shortcodes():
+    status, _, _ = get('/embed/not!valid')
+    assert status == 400
+
+
+def test_other_routes_fall_through_to_flask():
+    status, headers, body = get('/')
+    assert status == 200
+    assert headers['content-type'].startswith('text/html')
+    assert b'<form' in body
@@ -0,0 +1,69 @@
+import pytest
+from supabase import create_client
+
+from igprofileviewer.bench.fake_servers import FakeServers
+from igprofileviewer.web.db import dump
+from igprofileviewer.web.db.storage import SQLiteStorage, SupabaseStorage
+
+
+@pytest.fixture
+def source(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'source.sqlite3'))
+    ids = {username: storage.upsert_profile({'username': username, 'is_private': False,
+                                             'profile_data': {'bio': username}})
+           for username in ('alice', 'bob', 'carol')}
+    post_id = storage.upsert_post({'profile_id': ids['alice'], 'username': 'alice', 'shortcode': 'P1'})
+    storage.upsert_media([{'post_id': post_id, 'username': 'alice', 'media_order': order} for order in range(3)])
+    storage.upsert_relationships([{'profile_id': ids['alice'], 'related_profile_id': ids[other],
+                                   'relationship_type': 'related'} for other in ('bob', 'carol')])
+    storage.upsert_follows([{'follower_username': follower, 'following_username': following}
+                            for follower in ('alice', 'bob') for following in ('carol', 'dave', 'erin')])
+    storage.flush()
+    return storage
+
+
+def _rows(storage, sql):
+    return sorted(storage.conn.execute(sql).fetchall())
+
+
+def test_ndjson_round_trip(source, tmp_path):
+    directory = str(tmp_path / 'dump')
+    counts = dump.export(source, directory, page_size=2)
+    assert counts == {'profiles': 3, 'posts': 1, 'post_media': 3, 'profile_relationships': 2, 'profile_follows': 6}
+
+    target = SQLiteStorage(str(tmp_path / 'target.sqlite3'))
+    target.upsert_profile({'username': 'zed'})  # ids in the target differ from the source
+    target.flush()
+    assert dump.import_dump(target, directory, batch_size=2, workers=2) == counts
+
+    assert target.select_in('profiles', 'username', ['alice'])[0]['profile_data'] == {'bio': 'alice'}
+    assert _rows(target, 'select m.media_order from post_media m join posts p on p.id = m.post_id '
+                         "where p.shortcode = 'P1'") == [(0,), (1,), (2,)]
+    assert _rows(target, 'select a.username, b.username from profile_relationships r '
+                         'join profiles a on a.id = r.profile_id join profiles b on b.id = r.related_profile_id') == \
+        [('alice', 'bob'), ('alice', 'carol')]
+    follows = 'select follower_username, following_username from profile_follows'
+    assert _rows(target, follows) == _rows(source, follows)
+
+    # Importing again resolves on the same keys instead of duplicating.
+    dump.import_dump(target, directory)
+    assert target.count('post_media') == 3
+    assert target.count('profile_follows') == 6
+
+
+def test_supabase_import_resolves_media_on_post_and_order(source, tmp_path):
+    directory = str(tmp_path / 'dump')
+    dump.export(source, directory)
+    servers = FakeServers(db_latency_ms=0).start()
+    try:
+        target = SupabaseStorage(create_client(servers.postgrest_url, 'bench.bench.bench'))
+        for _ in range(2):
+            dump.import_dump(target, directory)
+        assert target.count('post_media') == 3
+
+        # The crawler's writes resolve on the same key.
+        post_id = target.select_in('posts', 'shortcode', ['P1'], ('id',))[0]['id']
+        target.upsert_media([{'post_id': post_id, 'username': 'alice', 'media_order': 0}])
+        assert target.count('post_media') == 3
+    finally:
+        servers.stop()
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from igprofileviewer.web.db.following import FollowingIngestor, state_key
+from igprofileviewer.web.db.queue_manager import ProfileQueue
+from igprofileviewer.web.db.storage import SQLiteStorage
+
+PAGES = {None: (['a', 'b'], 'c1'), 'c1': (['c', 'd'], 'c2'), 'c2': (['e'], None)}
+NEVER = object()
+
+
+class FakeAPI:
+    """Serves PAGES, failing when asked for the page at cursor `fail_at`."""
+
+    def __init__(self, fail_at=NEVER):
+        self.fail_at = fail_at
+        self.requested = []
+
+    async def iter_following(self, username, cursor=None):
+        while True:
+            self.requested.append(cursor)
+            if cursor == self.fail_at:
+                raise ConnectionError('upstream went away')
+            handles, cursor = PAGES[cursor]
+            yield [{'username': handle} for handle in handles], cursor
+            if not cursor:
+                return
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return SQLiteStorage(str(tmp_path / 'crawl.sqlite3'))
+
+
+def _edges(storage):
+    return sorted(username for username, in storage.conn.execute('select following_username from profile_follows'))
+
+
+def test_queue_dedupes_and_caps():
+    queue = ProfileQueue(batch_size=10, target_count=100, max_size=3)
+    queue.extend(['a', 'b', 'a', 'c', 'd'])
+    assert queue.usernames() == ['a', 'b', 'c']
+
+    queue.get_next_batch()
+    queue.mark_processed('a')
+    queue.extend(['a', 'e'])
+    assert queue.usernames() == ['e']
+
+
+def test_restore_drops_duplicates_and_processed():
+    queue = ProfileQueue(target_count=100)
+    queue.restore({'queue': ['a', 'b', 'a', 'c'], 'processed': ['b']})
+    assert queue.usernames() == ['a', 'c']
+    assert 'following_done' not in queue.to_state()
+
+
+def test_interrupted_ingestion_resumes_at_the_failed_page(storage):
+    queue = ProfileQueue(target_count=100)
+    ingestor = FollowingIngestor(storage, queue, batch_size=500)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(ingestor.ingest(FakeAPI(fail_at='c2'), 'alice'))
+    # Both completed pages are durable and the cursor points past them.
+    assert storage.load_crawl_state(state_key('alice')) == {'cursor': 'c2', 'done': False}
+    assert queue.following_cursors == {'alice': 'c2'}
+    assert ingestor.in_progress('alice')
+
+    # A fresh process (new queue) resumes from storage alone.
+    queue = ProfileQueue(target_count=100)
+    ingestor = FollowingIngestor(storage, queue, batch_size=500)
+    api = FakeAPI()
+    assert asyncio.run(ingestor.ingest(api, 'alice')) == 1
+    assert api.requested == ['c2']
+    assert storage.load_crawl_state(state_key('alice'))['done']
+    assert queue.following_cursors == {}
+    storage.flush()
+    assert _edges(storage) == ['a', 'b', 'c', 'd', 'e']
+
+    # Finished lists are not fetched again.
+    api = FakeAPI()
+    assert asyncio.run(ingestor.ingest(api, 'alice')) == 0
+    assert api.requested == []
+
+
+def test_start_is_recorded_before_the_first_page(storage):
+    queue = ProfileQueue(target_count=100)
+    ingestor = FollowingIngestor(storage, queue)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(ingestor.ingest(FakeAPI(fail_at=None), 'bob'))
+    assert storage.load_crawl_state(state_key('bob')) == {'cursor': None, 'done': False}
+    assert queue.following_cursors == {'bob': None}
+
+
+def test_handles_go_to_the_given_sink(storage):
+    queue = ProfileQueue(target_count=100)
+    seen = []
+    ingestor = FollowingIngestor(storage, queue, batch_size=1, enqueue=seen.extend)
+    asyncio.run(ingestor.ingest(FakeAPI(), 'carol'))
+    assert seen == ['a', 'b', 'c', 'd', 'e']
+    assert not len(queue)
@@ -0,0 +1,102 @@
+import threading
+
+from igprofileviewer.web.db.graph_index import GraphIndex
+from igprofileviewer.web.db.queue_manager import ProfileQueue
+
+EDGES = {
+    'a': ['b', 'c'],
+    'b': ['c'],
+    'c': ['a'],
+    'd': ['c', 'b'],
+}
+
+
+def test_build_and_query():
+    index = GraphIndex.from_edges(EDGES)
+
+    assert len(index) == 4
+    assert index.edge_count == 6
+    assert index.related('A') == ['b', 'c']
+    assert index.related('d', limit=1) == ['c']
+    assert index.related('nobody') == []
+    assert index.suggestions('d') == ['a']
+    assert index.top(1) == ['c']
+    assert abs(sum(index.rank(name) for name in EDGES) - 1.0) < 1e-6
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = str(tmp_path / 'graph.idx')
+    GraphIndex.from_edges(EDGES).save(path)
+
+    loaded = GraphIndex.load(path)
+    assert loaded.related('d') == ['c', 'b']
+    assert loaded.top(1) == ['c']
+    assert loaded.in_degree('c') == 3
+
+
+def test_overlay_shadows_rows_until_compacted():
+    index = GraphIndex.from_edges(EDGES)
+    index.set_related('b', ['a', 'e'])
+
+    assert index.related('b') == ['a', 'e']
+    assert index.rank('e') == 0.0
+    assert index.compaction_due(max_rows=1)
+    assert not index.compaction_due(max_rows=2, max_age=3600)
+
+    index.compact()
+    assert index.related('b') == ['a', 'e']
+    assert index.rank('e') > 0.0
+    assert not index.compaction_due(max_rows=1, max_age=0)
+
+
+def test_rows_replaced_during_compaction_stay_in_overlay(monkeypatch):
+    index = GraphIndex.from_edges(EDGES)
+    index.set_related('a', ['d'])
+    started, resume = threading.Event(), threading.Event()
+    pagerank = GraphIndex._pagerank
+
+    def slow_pagerank(*args, **kwargs):
+        started.set()
+        resume.wait(5)
+        return pagerank(*args, **kwargs)
+
+    monkeypatch.setattr(GraphIndex, '_pagerank', staticmethod(slow_pagerank))
+    compaction = threading.Thread(target=index.compact)
+    compaction.start()
+    assert started.wait(5)
+    # Neither reads nor writes wait for the compaction.
+    index.set_related('a', ['b'])
+    assert index.related('a') == ['b']
+    resume.set()
+    compaction.join(5)
+
+    assert index.related('a') == ['b']
+    assert index.compaction_due(max_rows=1)
+
+
+def test_priority_counts_new_in_links_before_compaction():
+    index = GraphIndex.from_edges(EDGES)
+    assert index.in_degree('c') == 3
+
+    index.set_related('x', ['e'])
+    index.set_related('y', ['e', 'f'])
+    index.set_related('d', ['b'])
+    assert index.in_degree('c') == 2
+    assert index.in_degree('e') == 2
+    assert index.by_rank(['f', 'e', 'nobody']) == ['e', 'f', 'nobody']
+
+
+def test_queue_pops_highest_priority_first():
+    queue = ProfileQueue(batch_size=2, target_count=100)
+    queue.extend(['low', 'mid', 'high'], priority={'low': 0.1, 'mid': 1.0, 'high': 2.0}.get)
+    queue.add_to_queue('low', 5.0)  # raised
+    queue.add_to_queue('high', 0.0)  # not lowered
+
+    assert len(queue) == 3
+    assert queue.get_next_batch() == ['low', 'high']
+    assert queue.get_next_batch() == ['mid']
+
+    queue.extend(['p', 'q', 'r'])
+    restored = ProfileQueue(batch_size=3, target_count=100)
+    restored.restore(queue.to_state())
+    assert restored.get_next_batch() == ['p', 'q', 'r']
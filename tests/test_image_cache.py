@@ -0,0 +1,173 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from igprofileviewer.bench.payloads import profile_payload
+from igprofileviewer.web import image_cache as image_cache_module
+from igprofileviewer.web import resilience
+from igprofileviewer.web.image_cache import ImageCache, download_image, fetch_image, prewarm, profile_image_urls
+
+
+class FakeResponse:
+    def __init__(self, content, status=200):
+        self.content = content
+        self.status = status
+        self.status_code = status
+        self.headers = {'Content-Type': 'image/jpeg'}
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        yield self.content
+
+    def close(self):
+        pass
+
+    async def read(self):
+        return self.content
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeCDN:
+    """Counts downloads; each takes `delay` seconds."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.requested = []
+        self._lock = threading.Lock()
+
+    def _body(self, url):
+        with self._lock:
+            self.requested.append(url)
+        return f"image:{url}".encode()
+
+    # aiohttp.ClientSession.get
+    def get(self, url, **kwargs):
+        cdn = self
+
+        class Pending(FakeResponse):
+            async def __aenter__(self):
+                await asyncio.sleep(cdn.delay)
+                return FakeResponse(cdn._body(url))
+
+        return Pending(b'')
+
+    # requests.get
+    def blocking_get(self, url, **kwargs):
+        time.sleep(self.delay)
+        return FakeResponse(self._body(url))
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    cache = ImageCache(str(tmp_path / 'images'))
+    monkeypatch.setattr(image_cache_module, 'image_cache', cache)
+    monkeypatch.setattr(resilience, '_upstreams', {})
+    return cache
+
+
+def test_hits_misses_and_stale_entries(cache):
+    url = 'http://cdn.test/a.jpg'
+    assert cache.get(url) is None
+    cache.put(url, b'JPEG', 'image/jpeg')
+    assert cache.contains(url)
+    assert cache.get(url) == (b'JPEG', 'image/jpeg')
+
+    old = time.time() - cache.ttl - 10
+    os.utime(cache._path(url), (old, old))
+    assert not cache.contains(url)
+    assert cache.get(url) is None
+    assert cache.get(url, stale=True) == (b'JPEG', 'image/jpeg')
+
+
+def test_urls_match_what_the_page_renders():
+    payload = profile_payload('alice', 'http://cdn.test')
+    user = payload['data']['user']
+    edges = user['edge_owner_to_timeline_media']['edges']
+    edges[0]['node'].update({
+        '__typename': 'GraphSidecar', 'display_url': 'http://cdn.test/cover.jpg',
+        'edge_sidecar_to_children': {'edges': [{'node': {'display_url': f'http://cdn.test/s{i}.jpg'}}
+                                               for i in range(3)]},
+    })
+    edges[1]['node'].update({
+        '__typename': 'GraphSidecar', 'display_url': 'http://cdn.test/single.jpg',
+        'edge_sidecar_to_children': {'edges': [{'node': {'display_url': 'http://cdn.test/child.jpg'}}]},
+    })
+
+    urls = profile_image_urls(payload)
+    assert urls[0] == (user.get('profile_pic_url_hd') or user.get('profile_pic_url'))
+    assert 'http://cdn.test/s0.jpg' in urls and 'http://cdn.test/s1.jpg' not in urls
+    # A one-child sidecar is shown as a plain image of the post's display_url.
+    assert 'http://cdn.test/single.jpg' in urls and 'http://cdn.test/child.jpg' not in urls
+    assert 'http://cdn.test/s1.jpg' in profile_image_urls(payload, carousel_frames=2)
+
+
+def test_prewarm_skips_cached_images(cache):
+    cdn = FakeCDN()
+    cache.put('http://cdn.test/cached.jpg', b'JPEG')
+
+    fetched = asyncio.run(prewarm(['http://cdn.test/cached.jpg', 'http://cdn.test/new.jpg'], session=cdn))
+    assert fetched == 1
+    assert cdn.requested == ['http://cdn.test/new.jpg']
+    assert cache.contains('http://cdn.test/new.jpg')
+
+
+def test_concurrent_fetches_of_one_url_are_merged(cache):
+    cdn = FakeCDN(delay=0.1)
+    url = 'http://cdn.test/a.jpg'
+
+    async def views():
+        return await asyncio.gather(prewarm([url], session=cdn), *(fetch_image(cdn, url) for _ in range(5)))
+
+    fetched, *images = asyncio.run(views())
+    assert cdn.requested == [url]
+    assert images == [(f"image:{url}".encode(), 'image/jpeg')] * 5
+
+
+def test_blocking_download_waits_for_a_prewarm_in_flight(cache, monkeypatch):
+    cdn = FakeCDN(delay=0.2)
+    monkeypatch.setattr(image_cache_module.requests, 'get', cdn.blocking_get)
+    url = 'http://cdn.test/a.jpg'
+
+    started = threading.Event()
+
+    def warm():
+        async def run():
+            task = asyncio.ensure_future(prewarm([url], session=cdn))
+            await asyncio.sleep(0.05)
+            started.set()
+            await task
+        asyncio.run(run())
+
+    thread = threading.Thread(target=warm)
+    thread.start()
+    started.wait(5)
+    assert download_image(url) == (f"image:{url}".encode(), 'image/jpeg')
+    thread.join(5)
+    assert cdn.requested == [url]
+
+
+def test_image_proxy_fetches_once_then_serves_from_cache(cache, monkeypatch):
+    from igprofileviewer.web import app as app_module
+    monkeypatch.setattr(app_module, 'image_cache', cache)
+    cdn = FakeCDN()
+    monkeypatch.setattr(image_cache_module.requests, 'get', cdn.blocking_get)
+    client = app_module.app.test_client()
+
+    for _ in range(2):
+        response = client.get('/image-proxy', query_string={'url': 'http://cdn.test/a.jpg'})
+        assert response.status_code == 200
+        assert response.data == b'image:http://cdn.test/a.jpg'
+        assert response.mimetype == 'image/jpeg'
+    assert cdn.requested == ['http://cdn.test/a.jpg']
+
+    assert client.get('/image-proxy').status_code == 400
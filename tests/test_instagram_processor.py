@@ -0,0 +1,61 @@
+import asyncio
+
+import aiohttp
+import pytest
+from yarl import URL
+
+from igprofileviewer.web import resilience
+from igprofileviewer.web.db.instagram_processor import InstagramProcessor
+from igprofileviewer.web.db.queue_manager import ProfileQueue
+from igprofileviewer.web.db.storage import SQLiteStorage
+
+
+class FailingSession:
+    """Answers every request with HTTP `status`."""
+
+    def __init__(self, status):
+        self.status = status
+
+    def get(self, url, **kwargs):
+        request_info = aiohttp.RequestInfo(URL(url), 'GET', {}, URL(url))
+        raise aiohttp.ClientResponseError(request_info, (), status=self.status, message='')
+
+
+@pytest.fixture(autouse=True)
+def fresh_upstreams(monkeypatch):
+    monkeypatch.setattr(resilience, '_upstreams', {})
+
+
+@pytest.fixture
+def processor(tmp_path):
+    processor = InstagramProcessor(storage=SQLiteStorage(str(tmp_path / 'crawl.sqlite3')), upstream_retries=2)
+    processor.api_key = 'test'
+    return processor
+
+
+def test_empty_queue_stops_the_crawl():
+    queue = ProfileQueue(batch_size=5, target_count=10)
+    # Nothing processed and nothing to do, e.g. the start profile failed.
+    assert not queue.should_continue()
+    queue.add_to_queue('alice')
+    assert queue.should_continue()
+    queue.get_next_batch()
+    assert not queue.should_continue()
+
+
+def test_upstream_failures_are_retried_and_client_errors_are_not(processor):
+    assert asyncio.run(processor._fetch_profile_data(FailingSession(404), 'gone')) is None
+    assert asyncio.run(processor._fetch_profile_data(FailingSession(503), 'alice')) is None
+    assert processor._to_retry(['gone', 'alice']) == ['alice']
+
+    # Until the retries run out.
+    for _ in range(2):
+        asyncio.run(processor._fetch_profile_data(FailingSession(503), 'alice'))
+        retried = processor._to_retry(['alice'])
+    assert retried == []
+
+
+def test_rejected_fetches_are_retried(processor):
+    resilience.upstream('profile').breaker._transition(resilience.OPEN)
+    assert asyncio.run(processor._fetch_profile_data(FailingSession(200), 'alice')) is None
+    assert processor._to_retry(['alice']) == ['alice']
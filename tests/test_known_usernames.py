@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+from igprofileviewer.web.db.known_usernames import KnownUsernames, default_path
+from igprofileviewer.web.db.storage import SQLiteStorage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'crawl.sqlite3'))
+    for username in ('alice', 'bob'):
+        storage.upsert_profile({'username': username})
+    storage.flush()
+    return storage
+
+
+def test_default_path_is_keyed_by_database(monkeypatch, tmp_path):
+    monkeypatch.delenv('KNOWN_USERNAMES_PATH', raising=False)
+    monkeypatch.setenv('IGPV_DATA_DIR', str(tmp_path))
+    assert default_path('sqlite:/a.db') != default_path('sqlite:/b.db')
+    assert os.path.dirname(default_path('sqlite:/a.db')) == str(tmp_path)
+    monkeypatch.setenv('KNOWN_USERNAMES_PATH', '/tmp/known.txt')
+    assert default_path('sqlite:/a.db') == '/tmp/known.txt'
+
+
+def test_refresh_is_incremental_and_persisted(storage, tmp_path):
+    path = str(tmp_path / 'known.txt')
+    known = KnownUsernames.for_storage(storage, path)
+    known.refresh(storage)
+    assert 'alice' in known and 'carol' not in known
+
+    storage.upsert_profile({'username': 'carol'})
+    storage.flush()
+    known.refresh(storage)
+    assert 'carol' not in known  # refresh_interval has not passed
+    known.refresh(storage, force=True)
+    assert 'carol' in known
+
+    reloaded = KnownUsernames.for_storage(storage, path)
+    reloaded.refresh(storage)
+    assert len(reloaded) == 3
+
+
+def test_processes_sharing_a_file_stay_correct(storage, tmp_path):
+    path = str(tmp_path / 'known.txt')
+    first = KnownUsernames.for_storage(storage, path)
+    second = KnownUsernames.for_storage(storage, path)
+    first.refresh(storage)
+    second.refresh(storage)
+
+    storage.upsert_profile({'username': 'carol'})
+    storage.flush()
+    first.add('carol')
+    second.refresh(storage, force=True)
+    # An older index saved last must not hide rows from the next reader.
+    first.save()
+
+    third = KnownUsernames.for_storage(storage, path)
+    third.refresh(storage, force=True)
+    assert {'alice', 'bob', 'carol'} <= third.usernames
+
+
+def test_index_from_another_database_is_rebuilt(storage, tmp_path):
+    path = str(tmp_path / 'known.txt')
+    known = KnownUsernames(path)
+    known.refresh(storage)
+
+    other = SQLiteStorage(str(tmp_path / 'other.sqlite3'))
+    other.upsert_profile({'username': 'dave'})
+    other.flush()
+    rebuilt = KnownUsernames(path)
+    rebuilt.refresh(other)
+    assert rebuilt.usernames == {'dave'}
@@ -0,0 +1,55 @@
+import logging
+
+import pytest
+
+from igprofileviewer.web import metrics
+from igprofileviewer.web.log import RateLimitFilter
+
+
+def test_counter_renders_labelled_samples():
+    counter = metrics.Counter('igpv_test_counter_total', 'Test counter.', ['endpoint'])
+    counter.inc(endpoint='profile')
+    counter.inc(2, endpoint='profile')
+    counter.inc(endpoint='image')
+
+    lines = counter.render().splitlines()
+    assert lines[:2] == ['# HELP igpv_test_counter_total Test counter.', '# TYPE igpv_test_counter_total counter']
+    assert 'igpv_test_counter_total{endpoint="image"} 1' in lines
+    assert 'igpv_test_counter_total{endpoint="profile"} 3' in lines
+    assert counter.get(endpoint='profile') == 3
+
+
+def test_labels_must_match():
+    counter = metrics.Counter('igpv_test_labels_total', 'Test counter.', ['endpoint'])
+    with pytest.raises(ValueError):
+        counter.inc(table='profiles')
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram('igpv_test_seconds', 'Test histogram.', buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value)
+
+    lines = histogram.render().splitlines()
+    assert 'igpv_test_seconds_bucket{le="0.1"} 1' in lines
+    assert 'igpv_test_seconds_bucket{le="1"} 2' in lines
+    assert 'igpv_test_seconds_bucket{le="+Inf"} 3' in lines
+    assert 'igpv_test_seconds_count 3' in lines
+    assert histogram.count() == 3
+
+
+def test_metric_base_is_abstract():
+    with pytest.raises(TypeError):
+        metrics._Metric('igpv_test_abstract', 'Abstract.')
+
+
+def test_rate_limit_filter_throttles_per_call_site():
+    limiter = RateLimitFilter(interval=60, burst=2)
+
+    def record(level=logging.INFO, lineno=10):
+        return logging.LogRecord('test', level, __file__, lineno, 'message', None, None)
+
+    assert [limiter.filter(record()) for _ in range(4)] == [True, True, False, False]
+    # Other call sites and warnings are not affected.
+    assert limiter.filter(record(lineno=11))
+    assert limiter.filter(record(level=logging.WARNING))
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import time
+
+import aiohttp
+import pytest
+import requests
+from yarl import URL
+
+from igprofileviewer.web import oembed_cache as oembed
+from igprofileviewer.web import resilience
+from igprofileviewer.web.metrics import API_CALLS, CACHE_REQUESTS
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status = self.status_code = status
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise requests.HTTPError(f"HTTP {self.status}", response=self)
+
+    def iter_content(self, chunk_size):
+        yield b'{}'
+
+    def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeAsyncResponse(FakeResponse):
+    def raise_for_status(self):
+        if self.status >= 400:
+            request_info = aiohttp.RequestInfo(URL(oembed.OEMBED_URL), 'GET', {}, URL(oembed.OEMBED_URL))
+            raise aiohttp.ClientResponseError(request_info, (), status=self.status, message='')
+
+
+class FakeSession:
+    """aiohttp.ClientSession.get answering every request with `status`."""
+
+    def __init__(self, status):
+        self.status = status
+
+    def get(self, url, **kwargs):
+        return FakeAsyncResponse(self.status)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = oembed.OEmbedCache(str(tmp_path))
+    monkeypatch.setattr(oembed, 'oembed_cache', cache)
+    monkeypatch.setattr(resilience, '_upstreams', {})
+    return cache
+
+
+def test_contains_respects_ttls_and_is_not_counted(tmp_path):
+    cache = oembed.OEmbedCache(str(tmp_path), ttl=60, negative_ttl=10)
+    cache.put('fresh', '<blockquote/>')
+    cache.put('gone', None)
+    expired = cache.put('old', '<blockquote/>')
+    expired['fetched_at'] = time.time() - 120
+    cache._path('old').write_text(json.dumps(expired))
+
+    misses = CACHE_REQUESTS.get(cache='oembed', result='miss')
+    hits = CACHE_REQUESTS.get(cache='oembed', result='hit')
+    assert cache.contains('fresh')
+    assert cache.contains('gone')
+    assert not cache.contains('old')
+    assert not cache.contains('never')
+    assert CACHE_REQUESTS.get(cache='oembed', result='miss') == misses
+    assert CACHE_REQUESTS.get(cache='oembed', result='hit') == hits
+
+
+def test_prefetch_fetches_only_uncached_shortcodes(tmp_path, monkeypatch):
+    cache = oembed.OEmbedCache(str(tmp_path))
+    cache.put('cached', '<blockquote/>')
+    monkeypatch.setattr(oembed, 'oembed_cache', cache)
+    fetched = []
+
+    async def fake_fetch(session, shortcode, endpoint='oembed'):
+        assert endpoint == oembed.PREFETCH_ENDPOINT
+        fetched.append(shortcode)
+        return cache.put(shortcode, f'<{shortcode}/>')
+
+    monkeypatch.setattr(oembed, '_fetch_entry', fake_fetch)
+    count = asyncio.run(oembed.prefetch(['cached', 'new', 'new', 'bad/code', ''], session=object()))
+
+    assert count == 1
+    assert fetched == ['new']
+    assert cache.get('new')['html'] == '<new/>'
+
+
+def test_only_gone_posts_are_negatively_cached(cache, monkeypatch):
+    monkeypatch.setattr(oembed.requests, 'get', lambda url, **kwargs: FakeResponse(404))
+    with pytest.raises(oembed.PostNotFound):
+        oembed.get_embed_html('gone')
+    assert cache.get('gone')['missing']
+
+    # A 400 (e.g. an expired token) is an error, not a missing post.
+    monkeypatch.setattr(oembed.requests, 'get', lambda url, **kwargs: FakeResponse(400))
+    with pytest.raises(requests.HTTPError):
+        oembed.get_embed_html('denied')
+    assert not cache.contains('denied')
+
+
+def test_prefetch_uses_its_own_upstream(cache):
+    errors = API_CALLS.get(endpoint=oembed.PREFETCH_ENDPOINT, outcome='error')
+    assert asyncio.run(oembed.prefetch(['a', 'b'], session=FakeSession(503))) == 0
+
+    assert API_CALLS.get(endpoint=oembed.PREFETCH_ENDPOINT, outcome='error') == errors + 2
+    assert list(resilience.upstream(oembed.PREFETCH_ENDPOINT).breaker._results) == [False, False]
+    assert 'oembed' not in resilience._upstreams
+    assert not resilience.upstream(oembed.PREFETCH_ENDPOINT).hedge
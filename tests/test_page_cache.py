@@ -0,0 +1,81 @@
+import pytest
+
+from igprofileviewer.bench.payloads import profile_payload
+from igprofileviewer.web.page_cache import PageCache, profile_digest
+
+
+@pytest.fixture
+def flask_app():
+    from igprofileviewer.web import app as app_module
+    app_module.page_cache.clear()
+    return app_module
+
+
+def _processed(app_module, username='alice'):
+    return app_module.process_profile_for_display(profile_payload(username, 'http://cdn.test'))
+
+
+def test_lru_eviction_is_bounded_by_size():
+    cache = PageCache(max_bytes=10)
+    cache.put('a', 'd1', b'12345')
+    cache.put('b', 'd1', b'12345')
+    assert cache.get('a', 'd1') == b'12345'  # now most recently used
+    cache.put('c', 'd1', b'12345')
+
+    assert cache.get('b', 'd1') is None
+    assert cache.get('a', 'd1') == b'12345'
+    assert cache.size == 10
+
+
+def test_invalidate_drops_every_version_of_a_username():
+    cache = PageCache()
+    cache.put('Alice', 'old', b'x')
+    cache.put('alice', 'new', b'y')
+    cache.put('bob', 'd', b'z')
+
+    cache.invalidate('ALICE')
+
+    assert len(cache) == 1
+    assert cache.get('bob', 'd') == b'z'
+
+
+def test_digest_changes_with_the_profile():
+    profile = {'username': 'alice', 'followers': 1}
+    assert profile_digest(profile) == profile_digest(dict(profile))
+    assert profile_digest(profile) != profile_digest({**profile, 'followers': 2})
+
+
+def test_page_carries_an_etag_and_is_cached(flask_app):
+    processed = _processed(flask_app)
+    with flask_app.app.test_request_context('/profile/alice'):
+        response = flask_app.render_profile_page(processed)
+
+    assert response.status_code == 200
+    assert response.headers['ETag'] == f'"{profile_digest(processed)}"'
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert flask_app.page_cache.get('alice', profile_digest(processed)) == response.get_data()
+
+
+def test_matching_if_none_match_gets_304_without_rendering(flask_app, monkeypatch):
+    processed = _processed(flask_app)
+    etag = f'"{profile_digest(processed)}"'
+
+    def fail(*args, **kwargs):
+        raise AssertionError('page was rendered')
+
+    monkeypatch.setattr(flask_app, 'render_timed', fail)
+    with flask_app.app.test_request_context('/profile/alice', headers={'If-None-Match': etag}):
+        response = flask_app.render_profile_page(processed)
+
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert response.get_data() == b''
+
+
+def test_stale_if_none_match_gets_the_page(flask_app):
+    processed = _processed(flask_app)
+    with flask_app.app.test_request_context('/profile/alice', headers={'If-None-Match': '"stale"'}):
+        response = flask_app.render_profile_page(processed)
+
+    assert response.status_code == 200
+    assert b'alice' in response.get_data()
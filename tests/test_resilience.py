@@ -0,0 +1,214 @@
+import asyncio
+import threading
+import time
+
+import pytest
+import requests
+
+from igprofileviewer.web import resilience
+from igprofileviewer.web.metrics import HEDGED_REQUESTS, UPSTREAM_LATENCY
+from igprofileviewer.web.resilience import (
+    CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen, DeadlineExceeded, Upstream, is_upstream_failure,
+)
+
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+
+def _warmed(name, latency=0.01, **kwargs):
+    """An Upstream with enough latency samples to hedge slow attempts."""
+    upstream = Upstream(name, **kwargs)
+    upstream._latencies.extend([latency] * resilience.HEDGE_MIN_SAMPLES)
+    return upstream
+
+
+class SlowThenFast:
+    """The first attempt takes `slow` seconds, later ones answer at once."""
+
+    def __init__(self, slow=2.0):
+        self.slow = slow
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _first(self):
+        with self._lock:
+            self.calls += 1
+            return self.calls == 1
+
+    def __call__(self, timeout):
+        if self._first():
+            time.sleep(self.slow)
+            return 'primary'
+        return 'hedge'
+
+    async def run(self, timeout):
+        if self._first():
+            await asyncio.sleep(self.slow)
+            return 'primary'
+        return 'hedge'
+
+
+def test_upstream_failures_are_told_from_bad_requests():
+    assert is_upstream_failure(HTTPError(503))
+    assert is_upstream_failure(HTTPError(429))
+    assert is_upstream_failure(TimeoutError())
+    assert is_upstream_failure(ConnectionError())
+    assert is_upstream_failure(CircuitOpen('profile', 1))
+    assert not is_upstream_failure(HTTPError(404))
+    assert not is_upstream_failure(KeyError('html'))
+    assert not is_upstream_failure(ValueError('Expecting value'))
+
+
+def test_breaker_opens_half_opens_and_closes(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience.time, 'monotonic', clock.monotonic)
+    breaker = CircuitBreaker('test', window=4, error_rate=0.5, cooldown=30, min_calls=2)
+
+    breaker.allow()
+    breaker.record(True)
+    breaker.allow()
+    breaker.record(False)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpen) as excinfo:
+        breaker.allow()
+    assert excinfo.value.retry_after == 30
+
+    # After the cooldown one trial call is let through, and only one.
+    clock.now += 30
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+    breaker.record(False)
+    assert breaker.state == OPEN
+
+    clock.now += 30
+    breaker.allow()
+    breaker.record(True)
+    assert breaker.state == CLOSED
+    breaker.allow()
+
+
+def test_client_and_parse_errors_leave_the_breaker_closed():
+    upstream = Upstream('test-parse', timeout=1.0, breaker=CircuitBreaker('test-parse', window=4, min_calls=1))
+
+    def missing_field(timeout):
+        return {}['html']
+
+    for _ in range(4):
+        with pytest.raises(KeyError):
+            upstream.call(missing_field)
+    assert upstream.breaker.state == CLOSED
+
+    def server_error(timeout):
+        raise HTTPError(502)
+
+    for _ in range(2):
+        with pytest.raises(HTTPError):
+            upstream.call(server_error)
+    assert upstream.breaker.state == OPEN
+
+
+def test_rejected_calls_are_not_timed():
+    upstream = Upstream('test-latency', timeout=1.0, breaker=CircuitBreaker('test-latency', min_calls=1))
+    assert upstream.call(lambda timeout: 'ok') == 'ok'
+    assert UPSTREAM_LATENCY.count(endpoint='test-latency') == 1
+
+    upstream.breaker.record(False)
+    with pytest.raises(CircuitOpen):
+        upstream.call(lambda timeout: 'ok')
+    assert UPSTREAM_LATENCY.count(endpoint='test-latency') == 1
+
+
+def test_slow_attempt_is_hedged():
+    upstream = _warmed('test-hedge', timeout=5.0, hedge=True)
+    fn = SlowThenFast()
+
+    started = time.perf_counter()
+    assert upstream.call(fn) == 'hedge'
+    assert time.perf_counter() - started < 1.0
+    assert HEDGED_REQUESTS.get(endpoint='test-hedge', outcome='won') == 1
+
+
+def test_slow_attempt_is_hedged_async():
+    upstream = _warmed('test-hedge-async', timeout=5.0, hedge=True)
+    fn = SlowThenFast()
+
+    started = time.perf_counter()
+    assert asyncio.run(upstream.call_async(fn.run)) == 'hedge'
+    assert time.perf_counter() - started < 1.0
+    assert HEDGED_REQUESTS.get(endpoint='test-hedge-async', outcome='won') == 1
+
+
+def test_hedges_are_capped_by_the_budget():
+    upstream = _warmed('test-budget', timeout=5.0, hedge=True)
+    upstream._hedged.extend([True] * resilience.HEDGE_MIN_SAMPLES)
+
+    assert upstream.call(SlowThenFast(slow=0.2)) == 'primary'
+    assert HEDGED_REQUESTS.get(endpoint='test-budget', outcome='sent') == 0
+
+
+def test_deadline_bounds_all_attempts():
+    # Before HEDGE_MIN_SAMPLES a failed attempt is hedged; both together
+    # still have to fit in the deadline.
+    upstream = Upstream('test-deadline', timeout=0.3, hedge=True, deadline=0.4)
+    timeouts = []
+
+    def hang(timeout):
+        timeouts.append(timeout)
+        if len(timeouts) == 1:
+            time.sleep(timeout)
+            raise TimeoutError()
+        time.sleep(5)  # a response trickling in under a per-read timeout
+
+    started = time.perf_counter()
+    with pytest.raises(DeadlineExceeded):
+        upstream.call(hang)
+    assert time.perf_counter() - started < 1.0
+    assert len(timeouts) == 2 and timeouts[1] < 0.2
+    assert upstream.breaker._results[-1] is False
+
+
+def test_deadline_bounds_all_attempts_async():
+    upstream = Upstream('test-deadline-async', timeout=0.3, hedge=True, deadline=0.4)
+
+    async def hang(timeout):
+        await asyncio.sleep(5)
+
+    started = time.perf_counter()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(upstream.call_async(hang))
+    assert time.perf_counter() - started < 1.0
+
+
+def test_bounded_get_gives_up_on_a_trickling_body(monkeypatch):
+    class Trickle:
+        closed = False
+
+        def iter_content(self, chunk_size):
+            for _ in range(50):
+                time.sleep(0.05)
+                yield b'x'
+
+        def close(self):
+            self.closed = True
+
+    response = Trickle()
+    monkeypatch.setattr(resilience.requests, 'get', lambda url, **kwargs: response)
+
+    started = time.perf_counter()
+    with pytest.raises(requests.Timeout):
+        resilience.bounded_get('http://upstream.test/', 0.2)
+    assert time.perf_counter() - started < 1.0
+    assert response.closed
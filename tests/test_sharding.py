@@ -0,0 +1,119 @@
+import pytest
+from supabase import create_client
+
+from igprofileviewer.bench.fake_servers import FakeServers
+from igprofileviewer.web.db import sharding
+from igprofileviewer.web.db.sharding import LeaseStore, SQLiteLeaseStore, SupabaseLeaseStore, shard_of
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sharding.time, 'time', clock.time)
+    return clock
+
+
+@pytest.fixture
+def leases(tmp_path):
+    return SQLiteLeaseStore(str(tmp_path / 'leases.db'), num_shards=8)
+
+
+@pytest.fixture
+def postgrest():
+    servers = FakeServers(db_latency_ms=0).start()
+    yield servers
+    servers.stop()
+
+
+def test_lease_store_is_abstract():
+    with pytest.raises(TypeError):
+        LeaseStore()
+
+
+def test_shards_are_stable_and_case_insensitive():
+    assert shard_of('Alice', 8) == shard_of('alice', 8)
+    assert 0 <= shard_of('alice', 8) < 8
+
+
+def test_rebalance_spreads_shards_over_live_workers(leases, clock):
+    assert len(leases.rebalance('w1', 30)) == 8
+
+    # w2 joins: w1 gives back half on its next rebalance, w2 picks them up.
+    assert leases.rebalance('w2', 30) == []
+    w1 = leases.rebalance('w1', 30)
+    w2 = leases.rebalance('w2', 30)
+    assert len(w1) == len(w2) == 4
+    assert not set(w1) & set(w2)
+
+
+def test_expired_leases_are_reclaimed(leases, clock):
+    leases.rebalance('w1', 30)
+    leases.rebalance('w2', 30)
+    leases.rebalance('w1', 30)
+    w2 = leases.rebalance('w2', 30)
+
+    # w1 stops heartbeating; once its leases lapse w2 takes everything.
+    clock.now += 10
+    leases.keep_alive('w2', 30)
+    clock.now += 25
+    assert sorted(leases.rebalance('w2', 30)) == list(range(8))
+    assert len(w2) == 4
+
+
+def test_leave_releases_at_once(leases, clock):
+    leases.rebalance('w1', 30)
+    leases.leave('w1')
+    assert len(leases.rebalance('w2', 30)) == 8
+
+
+def test_mark_is_fenced_by_lease_ownership(leases, clock):
+    leases.enqueue(['alice', 'bob', 'alice'])
+    shards = leases.rebalance('w1', 30)
+    assert sorted(leases.pending(shards, 10)) == ['alice', 'bob']
+
+    # w1 stalls past its lease and w2 takes over.
+    clock.now += 31
+    leases.rebalance('w2', 30)
+    assert leases.mark(['alice', 'bob'], 'failed', 'w1') == 0
+    assert leases.mark(['alice'], 'done', 'w2') == 1
+    assert leases.progress() == {'pending': 1, 'done': 1, 'failed': 0}
+
+
+def test_keep_alive_holds_leases_through_a_long_batch(leases, clock):
+    leases.enqueue(['alice'])
+    leases.rebalance('w1', 30)
+    for _ in range(5):
+        clock.now += 20
+        leases.keep_alive('w1', 30)
+    assert leases.rebalance('w2', 30) == []
+    assert leases.mark(['alice'], 'done', 'w1') == 1
+
+
+def test_supabase_leases_are_retaken_by_their_owner_and_counted_exactly(postgrest, monkeypatch):
+    leases = SupabaseLeaseStore(create_client(postgrest.postgrest_url, 'bench.bench.bench'), num_shards=4)
+    assert leases.num_shards == 4
+
+    assert leases.try_acquire('w1', 0, 1000.0, 1030.0)
+    assert leases.try_acquire('w1', 0, 1010.0, 1040.0)
+    assert not leases.try_acquire('w2', 0, 1010.0, 1040.0)
+
+    prefers = []
+    handle = postgrest.postgrest.handle
+
+    async def recording(request):
+        prefers.append(request.headers.get('Prefer', ''))
+        return await handle(request)
+
+    monkeypatch.setattr(postgrest.postgrest, 'handle', recording)
+    leases.enqueue(['alice', 'bob'])
+    prefers.clear()
+    assert leases.progress(exact=True) == {'pending': 2, 'done': 0, 'failed': 0}
+    assert all('count=exact' in prefer for prefer in prefers)
@@ -0,0 +1,75 @@
+import multiprocessing
+import os
+import sqlite3
+import time
+
+import pytest
+
+from igprofileviewer.web.db import storage as storage_module
+from igprofileviewer.web.db.storage import SQLiteStorage, Storage
+
+
+def _usernames(path):
+    with sqlite3.connect(path) as conn:
+        return sorted(username for username, in conn.execute('select username from profiles'))
+
+
+def _write_profile(storage, username):
+    storage.upsert_profile({'username': username})
+    storage.flush()
+
+
+def test_storage_is_abstract():
+    with pytest.raises(TypeError):
+        Storage()
+
+
+def test_default_path_is_in_the_data_dir(monkeypatch, tmp_path):
+    monkeypatch.delenv('STORAGE_SQLITE_PATH', raising=False)
+    monkeypatch.setenv('IGPV_DATA_DIR', str(tmp_path))
+    assert storage_module.default_sqlite_path() == str(tmp_path / 'igpv.sqlite3')
+
+    monkeypatch.delenv('IGPV_DATA_DIR')
+    monkeypatch.setenv('XDG_DATA_HOME', str(tmp_path / 'xdg'))
+    assert storage_module.default_sqlite_path() == str(tmp_path / 'xdg' / 'igprofileviewer' / 'igpv.sqlite3')
+
+
+def test_connection_is_opened_on_first_use(tmp_path):
+    path = tmp_path / 'sub' / 'crawl.sqlite3'
+    storage = SQLiteStorage(str(path))
+    assert not path.exists()
+    assert storage.existing_usernames(['alice']) == set()
+    assert path.exists()
+
+
+def test_idle_transaction_is_committed_by_the_timer(tmp_path):
+    path = str(tmp_path / 'crawl.sqlite3')
+    storage = SQLiteStorage(path, commit_every=1000, commit_interval=0.05)
+    storage.upsert_profile({'username': 'alice'})
+    assert _usernames(path) == []
+
+    deadline = time.monotonic() + 5
+    while not _usernames(path) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert _usernames(path) == ['alice']
+    assert not storage.conn.in_transaction
+
+
+def test_forked_children_open_their_own_connection(tmp_path):
+    path = str(tmp_path / 'crawl.sqlite3')
+    storage = SQLiteStorage(path)
+    _write_profile(storage, 'parent')
+    parent_conn = storage.conn
+
+    context = multiprocessing.get_context('fork')
+    children = [context.Process(target=_write_profile, args=(storage, f"child{i}")) for i in range(3)]
+    for child in children:
+        child.start()
+    for child in children:
+        child.join(10)
+        assert child.exitcode == 0
+
+    assert storage.conn is parent_conn
+    assert storage.existing_usernames(['parent', 'child0', 'child1', 'child2']) == \
+        {'parent', 'child0', 'child1', 'child2'}
+    assert os.getpid() == storage._pid